@@ -0,0 +1,271 @@
+from agents.items import ModelResponse
+from agents.models.interface import Model
+from agents.usage import Usage
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage
+from langchain_redis import RedisConfig
+from config.llm_config import LLMConfig
+from config.redis_config import DEFAULT_INDEX_NAME, get_redis_manager
+from schemas.models import BatchEvaluation, Evaluation, PageEvaluation
+
+from pydantic import BaseModel
+from openai.types.responses import (
+    Response,
+    ResponseCompletedEvent,
+    ResponseOutputMessage,
+    ResponseOutputText,
+    ResponseTextDeltaEvent,
+)
+from typing import Any, Dict, List, Optional
+import numpy as np
+import hashlib
+import asyncio
+import json
+import time
+import os
+
+WORDS = (
+    "king queen church abbey river castle letter merchant harvest council bishop treaty "
+    "village soldier winter market ship silver grain debt court feast saint plague road"
+).split()
+
+
+def seeded(text: str) -> np.random.Generator:
+    return np.random.default_rng(int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little"))
+
+
+def fake_evaluation(seed: str, model: str = "fake-vision", words: int = 150) -> Evaluation:
+    """A page evaluation whose text depends only on `seed`."""
+    rng = seeded(seed)
+    sentence = lambda: " ".join(rng.choice(WORDS, size=12)).capitalize() + "."
+    text = lambda: " ".join(sentence() for _ in range(max(1, words // 12)))
+    return Evaluation(
+        model=model,
+        transcription=text(),
+        translation=text(),
+        keywords=[str(word) for word in rng.choice(WORDS, size=5, replace=False)],
+    )
+
+
+class FakeEmbeddings(Embeddings):
+    """Unit vectors derived from a hash of the text, with an optional delay per call."""
+
+    def __init__(self, dimensions: int = 768, latency: float = 0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+
+    def _vector(self, text: str) -> List[float]:
+        vector = seeded(text).standard_normal(self.dimensions)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return self._vector(text)
+
+
+class FakeStructuredVision:
+    def __init__(self, model: "FakeVisionModel", schema: Any):
+        self.vision = model
+        self.schema = schema
+
+    def invoke(self, messages: Any) -> Dict[str, Any]:
+        images = [part["image_url"]["url"] for part in messages[-1].content if part["type"] == "image_url"]
+        time.sleep(self.vision.latency * (0.5 + 0.5 * len(images)))
+        evaluations = [fake_evaluation(image[-4096:], self.vision.model) for image in images]
+        if self.schema is BatchEvaluation:
+            parsed = BatchEvaluation(pages=[
+                PageEvaluation(page=n, **evaluation.model_dump(exclude={"model"}))
+                for n, evaluation in enumerate(evaluations, start=1)
+            ])
+        else:
+            parsed = evaluations[0]
+        pages = len(images)
+        raw = AIMessage(content="", usage_metadata={"input_tokens": 1000 + 500 * pages, "output_tokens": 500 * pages, "total_tokens": 1000 + 1000 * pages})
+        return {"raw": raw, "parsed": parsed, "parsing_error": None}
+
+
+class FakeVisionModel(BaseModel):
+    """Vision model answering with evaluations derived from the image bytes.
+
+    Half of `latency` is paid per request and half per page, so batched scans save the fixed part.
+    A pydantic model, like the real chat models.
+    """
+
+    latency: float = 0.0
+    model: str = "fake-vision"
+
+    def with_structured_output(self, schema: Any, include_raw: bool = False) -> FakeStructuredVision:
+        return FakeStructuredVision(self, schema)
+
+
+def fake_json(schema: Dict[str, Any]) -> Any:
+    """Smallest value matching a JSON schema: true, "fake", 0.5, empty lists and filled objects."""
+    kind = schema.get("type")
+    if kind == "boolean":
+        return True
+    if kind in ("number", "integer"):
+        return 0.5 if kind == "number" else 1
+    if kind == "array":
+        return []
+    if kind == "object":
+        return {name: fake_json(field) for name, field in schema.get("properties", {}).items()}
+    return "fake"
+
+
+class FakeQueryModel(Model):
+    """Agents SDK model answering every request with fixed text, or the smallest valid structured output."""
+
+    model = "fake-query"
+
+    def __init__(self, latency: float = 0.0, answer: str = "This is a fake answer citing [book / page]."):
+        self.latency = latency
+        self.answer = answer
+
+    def _text(self, output_schema: Any) -> str:
+        if output_schema is None or output_schema.is_plain_text():
+            return self.answer
+        return json.dumps(fake_json(output_schema.json_schema()))
+
+    @staticmethod
+    def _message(text: str) -> ResponseOutputMessage:
+        return ResponseOutputMessage(
+            id="fake", type="message", role="assistant", status="completed",
+            content=[ResponseOutputText(type="output_text", text=text, annotations=[])],
+        )
+
+    async def get_response(self, system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, *, previous_response_id, prompt=None) -> ModelResponse:
+        await asyncio.sleep(self.latency)
+        return ModelResponse(output=[self._message(self._text(output_schema))], usage=Usage(requests=1), response_id=None)
+
+    async def stream_response(self, system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, *, previous_response_id, prompt=None):
+        text = self._text(output_schema)
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.latency / len(words))
+            delta = word if i == 0 else f" {word}"
+            yield ResponseTextDeltaEvent(type="response.output_text.delta", delta=delta, content_index=0, item_id="fake", output_index=0, sequence_number=i)
+        response = Response(
+            id="fake", created_at=0, model="fake-query", object="response", output=[self._message(text)],
+            tool_choice="auto", tools=[], parallel_tool_calls=False,
+        )
+        yield ResponseCompletedEvent(type="response.completed", sequence_number=len(words), response=response)
+
+
+class MemoryPipeline:
+    """The HGETs of stored vectors that `stored_vectors` pipelines, answered from a MemoryVectorStore."""
+
+    def __init__(self, vectorstore: "MemoryVectorStore"):
+        self.vectorstore = vectorstore
+        self.keys: List[str] = []
+
+    def __enter__(self) -> "MemoryPipeline":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.keys = []
+
+    def hget(self, key: str, field: str) -> None:
+        self.keys.append(key)
+
+    def execute(self) -> List[Optional[bytes]]:
+        return [self.vectorstore.stored_vector(key) for key in self.keys]
+
+
+class MemoryVectorStore:
+    """In-process stand-in for RedisVectorStore, with the calls the pipeline makes.
+
+    Writes keep the vectors in a numpy matrix and searches are exact; filters are ignored.
+    The store is also its own `index.client`, so the stored vectors of pages can be read back.
+    """
+
+    def __init__(self, embeddings: Embeddings, index_name: str = DEFAULT_INDEX_NAME):
+        self.embeddings = embeddings
+        self.config = RedisConfig(index_name=index_name)
+        self.ids: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.texts: List[str] = []
+        self.metadatas: List[dict] = []
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self._pending: List[List[float]] = []
+
+    def add_texts(self, texts: List[str], metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        vectors = self.embeddings.embed_documents(list(texts))
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(len(self.ids) + i) for i in range(len(texts))]
+        for id, text, metadata, vector in zip(ids, texts, metadatas, vectors):
+            if id in self.positions:
+                position = self.positions[id]
+                self.texts[position], self.metadatas[position] = text, metadata
+                self._flush()
+                self.vectors[position] = vector
+                continue
+            self.positions[id] = len(self.ids)
+            self.ids.append(id)
+            self.texts.append(text)
+            self.metadatas.append(metadata)
+            self._pending.append(vector)
+        return list(ids)
+
+    def _flush(self) -> None:
+        if self._pending:
+            pending = np.asarray(self._pending, dtype=np.float32)
+            self.vectors = pending if not self.vectors.size else np.vstack([self.vectors, pending])
+            self._pending = []
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, filter: Any = None, **kwargs: Any) -> List[Document]:
+        self._flush()
+        if not self.ids:
+            return []
+        scores = self.vectors @ np.asarray(embedding, dtype=np.float32)
+        top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+        return [
+            Document(page_content=self.texts[i], metadata=self.metadatas[i])
+            for i in top[np.argsort(-scores[top])]
+        ]
+
+    def stored_vector(self, key: str) -> Optional[bytes]:
+        self._flush()
+        position = self.positions.get(key.removeprefix(f"{self.config.key_prefix}:"))
+        return None if position is None else self.vectors[position].tobytes()
+
+    @property
+    def index(self) -> "MemoryVectorStore":
+        return self
+
+    @property
+    def client(self) -> "MemoryVectorStore":
+        return self
+
+    def pipeline(self, transaction: bool = True) -> MemoryPipeline:
+        return MemoryPipeline(self)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+def install(vision_latency: float = 0.0, query_latency: float = 0.0, embedding_latency: float = 0.0,
+            memory_store: bool = True) -> FakeEmbeddings:
+    """Register the fake models in LLMConfig and, unless benchmarking a real Redis, the in-memory store.
+
+    Must run before the first embedding call, since the Redis manager keeps the embeddings model it loads.
+    """
+    # Caches would turn repeated runs into cache reads
+    os.environ["INGEST_CACHE"] = "0"
+    os.environ["ANSWER_CACHE"] = "0"
+    embeddings = FakeEmbeddings(get_redis_manager().embedding_dimensions, embedding_latency)
+    LLMConfig.override("vision", FakeVisionModel(latency=vision_latency))
+    LLMConfig.override("query", FakeQueryModel(query_latency))
+    LLMConfig.override("embeddings", embeddings)
+
+    if memory_store:
+        # The chunk index and BM25 need server-side queries, so the in-memory runs search whole pages by vector
+        os.environ["INDEX_MODE"] = "page"
+        os.environ["RETRIEVAL_MODE"] = "vector"
+        # Through the manager's embeddings, so their time shows up in the metrics
+        get_redis_manager()._vectorstores[DEFAULT_INDEX_NAME] = MemoryVectorStore(get_redis_manager().embeddings)
+    return embeddings
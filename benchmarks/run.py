@@ -0,0 +1,249 @@
+from benchmarks import fakes
+from config.redis_config import DEFAULT_INDEX_NAME, get_redis_manager
+from config.log_config import LoggingConfig
+
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from pathlib import Path
+from PIL import Image
+from rich.table import Table
+from typing import Any, Dict, List, Tuple
+import numpy as np
+import subprocess
+import tempfile
+import argparse
+import asyncio
+import json
+import time
+import sys
+import io
+import os
+
+
+ROOT = Path(__file__).resolve().parent.parent
+STARTUP_MODULES = ("query_agent", "graph")
+
+
+def bench_startup(runs: int) -> Dict[str, Any]:
+    """Cold import time of the entry points, each in a fresh interpreter; the median of `runs`."""
+    startup = {}
+    for module in STARTUP_MODULES:
+        code = f"import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+        samples = [
+            float(subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True).stdout.split()[-1]) * 1000
+            for _ in range(runs)
+        ]
+        startup[module] = {"runs": runs, "import_ms": float(np.median(samples))}
+    return startup
+
+
+def synthetic_book(directory: Path, pages: int) -> List[str]:
+    """Write `pages` distinct page images and return their paths."""
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(pages):
+        pixels = np.random.default_rng(i).integers(0, 255, size=(800, 600), dtype=np.uint8)
+        path = directory / f"{directory.name}_page_{i}.jpg"
+        Image.fromarray(pixels, mode="L").save(path, quality=70)
+        paths.append(str(path))
+    return paths
+
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"mean_ms": float(np.mean(samples)), "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+
+def bench_ingest(workdir: Path, pages: int, concurrency: int) -> Dict[str, Any]:
+    """Pages per second through the evaluation graph, from conduct_evaluation to evaluation_summary."""
+    import graph
+    from handlers.ingest_handler import IngestHandler
+
+    images = synthetic_book(workdir / "bench_book", pages)
+    handler = IngestHandler(graph.graph, "bench_book", graph.evaluation_models(), concurrency=concurrency, preprocessor=graph.preprocessor)
+    # Page and node logs would dominate the timings
+    with redirect_stdout(io.StringIO()):
+        # A full bucket would let a short run through without waiting, hiding the steady-state rate
+        graph.rate_limiter.drain()
+        started = time.perf_counter()
+        images = graph.batch_scanner.scan(images, graph.evaluation_models())
+        if concurrency > 1:
+            asyncio.run(handler.arun(images))
+        else:
+            handler.run(images)
+        seconds = time.perf_counter() - started
+    return {
+        "pages": pages,
+        "failed": handler.failed,
+        "concurrency": concurrency,
+        "batch_pages": graph.batch_scanner.max_pages,
+        "seconds": seconds,
+        "pages_per_sec": handler.done / seconds,
+    }
+
+
+def page_text(i: int) -> Tuple[str, dict, str]:
+    evaluation = fakes.fake_evaluation(f"page-{i}")
+    text = f"Model: {evaluation.model}\nTranscription: {evaluation.transcription}\nTranslation: {evaluation.translation}\nKeywords: {', '.join(evaluation.keywords)}"
+    return text, {"book_id": f"book_{i // 100}", "image_id": f"page_{i}"}, f"book_{i // 100}:page_{i}"
+
+
+def bench_corpus(vectorstore: Any, sizes: List[int], queries: int, batch_size: int) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Grow the store to every size in turn, timing the writes and then `context_retrieval` at that size.
+
+    `context_retrieval` searches the default collection, so `vectorstore` has to be the one behind it.
+    """
+    from query_agent import context_retrieval
+
+    written, write_seconds, retrieval = 0, 0.0, []
+    for size in sorted(sizes):
+        while written < size:
+            batch = [page_text(i) for i in range(written, min(size, written + batch_size))]
+            texts, metadatas, ids = map(list, zip(*batch))
+            started = time.perf_counter()
+            vectorstore.add_texts(texts, metadatas=metadatas, ids=ids)
+            write_seconds += time.perf_counter() - started
+            written += len(batch)
+
+        rng = np.random.default_rng(size)
+        latencies = []
+        # Cache warnings of the in-memory runs, which have no Redis, would dominate the timings
+        with redirect_stdout(io.StringIO()):
+            for _ in range(queries):
+                query = " ".join(rng.choice(fakes.WORDS, size=6))
+                started = time.perf_counter()
+                context_retrieval(query)
+                latencies.append((time.perf_counter() - started) * 1000)
+        retrieval.append({"corpus": size, "queries": queries, **latency_summary(latencies)})
+
+    writes = {"docs": written, "seconds": write_seconds, "docs_per_sec": written / write_seconds if write_seconds else 0.0}
+    return writes, retrieval
+
+
+def metrics(results: Dict[str, Any]) -> Dict[str, Tuple[float, bool]]:
+    """Flatten results into metric -> (value, higher is better)."""
+    flat = {
+        "ingest.pages_per_sec": (results["ingest"]["pages_per_sec"], True),
+        "writes.docs_per_sec": (results["writes"]["docs_per_sec"], True),
+    }
+    for module, row in results.get("startup", {}).items():
+        flat[f"startup.{module}.import_ms"] = (row["import_ms"], False)
+    for row in results["retrieval"]:
+        for name in ("p50_ms", "p95_ms", "p99_ms"):
+            flat[f"retrieval.{row['corpus']}.{name}"] = (row[name], False)
+    return flat
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float, noise_ms: float = 1.0) -> bool:
+    """Print every metric against the baseline and return whether any got worse by more than `threshold`.
+
+    Latencies within `noise_ms` of the baseline never count as regressions.
+    """
+    console = LoggingConfig().console
+    table = Table(title=f"Benchmark vs baseline (threshold {threshold:.0%})")
+    for column in ("metric", "baseline", "current", "change", "status"):
+        table.add_column(column)
+
+    regressed = False
+    current = metrics(results)
+    for name, (base, _) in metrics(baseline).items():
+        if name not in current:
+            continue
+        value, higher_is_better = current[name]
+        change = (value - base) / base if base else 0.0
+        worse = -change if higher_is_better else change
+        if not higher_is_better and value - base < noise_ms:
+            worse = min(worse, 0.0)
+        status = "[error]regression[/error]" if worse > threshold else "ok"
+        regressed |= worse > threshold
+        table.add_row(name, f"{base:.2f}", f"{value:.2f}", f"{change:+.1%}", status)
+    console.print(table)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of startup time, ingest throughput, write throughput and retrieval latency.")
+    parser.add_argument("--pages", type=int, default=20, help="Pages of the synthetic book sent through the graph")
+    parser.add_argument("--concurrency", type=int, default=4, help="Pages processed at a time")
+    parser.add_argument("--sizes", default="100,1000,5000", help="Comma-separated corpus sizes at which retrieval is measured")
+    parser.add_argument("--queries", type=int, default=100, help="Queries per corpus size")
+    parser.add_argument("-k", type=int, default=5, help="Pages packed into the context of every query (CONTEXT_PAGES)")
+    parser.add_argument("--batch-size", type=int, default=100, help="Documents per write")
+    parser.add_argument("--batch-pages", type=int, default=1, help="Pages per vision request (VISION_BATCH_PAGES)")
+    parser.add_argument("--vision-rpm", type=float, help="Vision requests per minute allowed (VISION_RPM)")
+    parser.add_argument("--vision-latency", type=float, default=0.0, help="Simulated seconds per vision call")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="Simulated seconds per embedding call")
+    parser.add_argument("--startup-runs", type=int, default=3, help="Fresh interpreters per import-time measurement (0 to skip)")
+    parser.add_argument("--redis", action="store_true", help="Use the Redis server of REDIS_URL (temporary index) instead of the in-memory store")
+    parser.add_argument("--output", default="benchmark.json", help="Where to write the JSON results")
+    parser.add_argument("--baseline", help="Earlier results to compare against; exits with 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative slowdown per metric")
+    parser.add_argument("--noise-ms", type=float, default=1.0, help="Latency increases below this are ignored")
+    args = parser.parse_args()
+
+    console = LoggingConfig().console
+    # Read by graph.py when the ingest benchmark imports it
+    os.environ["VISION_BATCH_PAGES"] = str(args.batch_pages)
+    # Read by query_agent.py when the retrieval benchmark imports it
+    os.environ["CONTEXT_PAGES"] = str(args.k)
+    if args.vision_rpm:
+        os.environ["VISION_RPM"] = str(args.vision_rpm)
+    embeddings = fakes.install(args.vision_latency, embedding_latency=args.embedding_latency, memory_store=not args.redis)
+    manager = get_redis_manager()
+    if args.redis:
+        # Ingest writes go to a throwaway index instead of the real one
+        bench_index = f"bench_{int(time.time())}"
+        manager._vectorstores[DEFAULT_INDEX_NAME] = manager.open_vectorstore(bench_index)
+        corpus_store = manager.open_vectorstore(f"{bench_index}_corpus")
+    else:
+        corpus_store = fakes.MemoryVectorStore(embeddings)
+    ingest_store = manager.get_vectorstore(DEFAULT_INDEX_NAME)
+
+    startup = {}
+    if args.startup_runs:
+        console.print("Measuring cold import times...", style="system")
+        startup = bench_startup(args.startup_runs)
+
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            console.print(f"Ingesting {args.pages} synthetic pages...", style="system")
+            ingest = bench_ingest(Path(workdir), args.pages, args.concurrency)
+        if ingest["failed"]:
+            console.print(f"⚠️ {ingest['failed']} pages failed during the ingest benchmark", style="warning")
+        console.print("Growing the corpus and measuring retrieval...", style="system")
+        sizes = [int(size) for size in args.sizes.split(",")]
+        # Queries search the default collection, so the corpus takes the place of the ingested pages
+        manager._vectorstores[DEFAULT_INDEX_NAME] = corpus_store
+        writes, retrieval = bench_corpus(corpus_store, sizes, args.queries, args.batch_size)
+    finally:
+        if args.redis:
+            ingest_store.index.delete(drop=True)
+            corpus_store.index.delete(drop=True)
+
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "backend": "redis" if args.redis else "memory",
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "threshold", "noise_ms")},
+        "startup": startup,
+        "ingest": ingest,
+        "writes": writes,
+        "retrieval": retrieval,
+    }
+    Path(args.output).write_text(json.dumps(results, indent=2))
+
+    table = Table(title=f"Benchmark ({results['backend']})")
+    for column in ("metric", "value"):
+        table.add_column(column)
+    for name, (value, _) in metrics(results).items():
+        table.add_row(name, f"{value:.2f}")
+    console.print(table)
+    console.print(f"Results written to {args.output}", style="system")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        if compare(results, baseline, args.threshold, args.noise_ms):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+)
+from langgraph.checkpoint.memory import MemorySaver
+from config.redis_config import get_redis_manager
+
+from dotenv import load_dotenv
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, Sequence, Tuple
+import threading
+import asyncio
+import time
+import os
+
+load_dotenv()
+
+CHECKPOINTERS = ("memory", "sqlite", "redis")
+# Seconds between two searches for idle threads of the sqlite checkpointer
+PRUNE_INTERVAL = 60.0
+
+
+class LazySaver(BaseCheckpointSaver):
+    """Checkpointer built on its first use, so importing the graph opens no file or connection.
+
+    The sqlite and redis savers of langgraph are synchronous classes, with separate async ones; the
+    async graph API (`IngestHandler.arun`) runs the synchronous saver on threads, so one saver, and
+    one connection, serves both.
+    """
+
+    def __init__(self, factory: Callable[[], BaseCheckpointSaver]):
+        super().__init__()
+        self.factory = factory
+        self._saver: Optional[BaseCheckpointSaver] = None
+        self._lock = threading.Lock()
+
+    @property
+    def saver(self) -> BaseCheckpointSaver:
+        if self._saver is None:
+            with self._lock:
+                if self._saver is None:
+                    self._saver = self.factory()
+        return self._saver
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self.saver.get_tuple(config)
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        return self.saver.list(config, filter=filter, before=before, limit=limit)
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        return self.saver.put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        self.saver.put_writes(config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str) -> None:
+        self.saver.delete_thread(thread_id)
+
+    def get_next_version(self, current: Optional[Any], channel: None) -> Any:
+        return self.saver.get_next_version(current, channel)
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        for item in await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit))):
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+def sqlite_saver(path: str, ttl: Optional[int] = None) -> BaseCheckpointSaver:
+    """langgraph's SqliteSaver on `path`, dropping the threads idle for more than `ttl` seconds."""
+    from langgraph.checkpoint.sqlite import SqliteSaver
+    import sqlite3
+
+    class PrunedSqliteSaver(SqliteSaver):
+        """Records when every thread was last written, and deletes idle threads on writes."""
+
+        def __init__(self, conn: sqlite3.Connection):
+            super().__init__(conn)
+            self.ttl = ttl
+            self.pruned = 0.0
+
+        def setup(self) -> None:
+            if self.is_setup:
+                return
+            super().setup()
+            self.conn.execute("CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, updated REAL NOT NULL)")
+
+        def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                new_versions: ChannelVersions) -> RunnableConfig:
+            saved = super().put(config, checkpoint, metadata, new_versions)
+            now = time.time()
+            with self.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO thread_activity VALUES (?, ?) ON CONFLICT(thread_id) DO UPDATE SET updated = excluded.updated",
+                    (str(config["configurable"]["thread_id"]), now),
+                )
+                # A long-lived process keeps pruning, not only when it opens the file
+                if self.ttl and now - self.pruned >= PRUNE_INTERVAL:
+                    self.pruned = now
+                    stale = "SELECT thread_id FROM thread_activity WHERE updated < ?"
+                    for table in ("writes", "checkpoints"):
+                        cur.execute(f"DELETE FROM {table} WHERE thread_id IN ({stale})", (now - self.ttl,))
+                    cur.execute("DELETE FROM thread_activity WHERE updated < ?", (now - self.ttl,))
+            return saved
+
+        def delete_thread(self, thread_id: str) -> None:
+            super().delete_thread(thread_id)
+            with self.cursor() as cur:
+                cur.execute("DELETE FROM thread_activity WHERE thread_id = ?", (str(thread_id),))
+
+    # Pages run on several threads; SqliteSaver serializes them on its own lock
+    return PrunedSqliteSaver(sqlite3.connect(path, check_same_thread=False))
+
+
+def redis_saver(ttl: Optional[int] = None) -> BaseCheckpointSaver:
+    """langgraph's RedisSaver on the shared client, with its keys expiring `ttl` seconds after their last use."""
+    from langgraph.checkpoint.redis import RedisSaver
+
+    saver = RedisSaver(
+        redis_client=get_redis_manager().client,
+        ttl={"default_ttl": ttl / 60, "refresh_on_read": True} if ttl else None,
+    )
+    saver.setup()
+    return saver
+
+
+def get_checkpointer() -> BaseCheckpointSaver:
+    """The checkpointer selected by CHECKPOINTER; none of them connects before its first use."""
+    backend = os.getenv("CHECKPOINTER", "memory").lower()
+    ttl = os.getenv("CHECKPOINT_TTL")
+    ttl = int(ttl) if ttl else None
+    if backend == "memory":
+        return MemorySaver()
+    if backend == "sqlite":
+        path = os.getenv("CHECKPOINT_PATH", "checkpoints.sqlite")
+        return LazySaver(lambda: sqlite_saver(path, ttl))
+    if backend == "redis":
+        return LazySaver(lambda: redis_saver(ttl))
+    raise ValueError(f"Unsupported CHECKPOINTER: {backend}. Supported checkpointers: {', '.join(CHECKPOINTERS)}")
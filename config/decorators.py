@@ -1,14 +1,16 @@
 from functools import wraps
 from config.log_config import LoggingConfig
+from config.metrics import metrics
 
 console = LoggingConfig().console
 
 def node(func):
-    """Decorator to add logging functionality to a node."""
+    """Decorator to add logging and timing to a node."""
     @wraps(func)
     def wrapper(*args, **kwargs):
         console.print(f"Calling node: {func.__name__}", style="system")
-        result = func(*args, **kwargs)
+        with metrics.timer("node", node=func.__name__):
+            result = func(*args, **kwargs)
         console.print(f"Node execution finished: {func.__name__}\n", style="system")
         return result
     return wrapper
\ No newline at end of file
@@ -1,43 +1,76 @@
-from agents.extensions.models.litellm_model import LitellmModel
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 from config.log_config import LoggingConfig
 
-from typing import Any
+from typing import Any, Callable, Dict
 from dotenv import load_dotenv
+import threading
 import os
 
 load_dotenv()
 
+
+def _vision_model(name: str = "gemini-2.5-pro") -> Any:
+    # Vision model for graph analysis
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(
+        model=name,
+        google_api_key=os.getenv("GOOGLE_API_KEY"),
+        # graph.py retries vision calls itself (call_with_retry, LLM_MAX_RETRIES), through the rate limiter
+        max_retries=0,
+    )
+
+
+def _query_model(name: str = "gemini/gemini-2.5-flash") -> Any:
+    # Query model (using LiteLLM for OpenAI Agents SDK compatibility)
+    from agents.extensions.models.litellm_model import LitellmModel
+    return LitellmModel(
+        model=name,
+        api_key=os.getenv("GOOGLE_API_KEY")
+    )
+
+
+def _embeddings_model(name: str = "models/text-embedding-004") -> Any:
+    # Embeddings model
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return GoogleGenerativeAIEmbeddings(
+        model=name
+    )
+
+
 class LLMConfig:
-    """Centralized configuration for all LLMs in the project."""
+    """Centralized configuration for all LLMs in the project.
+
+    Models, and the client libraries behind them, are only loaded on the first `get_model`
+    of their type, then shared by every LLMConfig of the process. A type may name a specific
+    model after a colon, e.g. 'vision:gemini-2.5-flash' or 'query:gemini/gemini-2.5-pro'.
+    """
+
+    factories: Dict[str, Callable[..., Any]] = {
+        'vision': _vision_model,
+        'query': _query_model,
+        'embeddings': _embeddings_model,
+    }
+    # Models registered with `override` replace the configured ones (e.g. fakes in benchmarks)
+    overrides: Dict[str, Any] = {}
+    _models: Dict[str, Any] = {}
+    _lock = threading.Lock()
 
     def __init__(self):
         self.console = LoggingConfig().console
-        self._models = {}
-        self._initialize_models()
-
-    def _initialize_models(self):
-        """Initialize all models"""
-        # Vision model for graph analysis
-        self._models['vision'] = ChatGoogleGenerativeAI(
-            model="gemini-2.5-pro",
-            google_api_key=os.getenv("GOOGLE_API_KEY")
-        )
-
-        # Query model (using LiteLLM for OpenAI Agents SDK compatibility)
-        self._models['query'] = LitellmModel(
-            model="gemini/gemini-2.5-flash",
-            api_key=os.getenv("GOOGLE_API_KEY")
-        )
-
-        # Embeddings model
-        self._models['embeddings'] = GoogleGenerativeAIEmbeddings(
-            model="models/text-embedding-004"
-        )
+
+    @classmethod
+    def override(cls, model_type: str, model: Any) -> None:
+        """Use `model` for `model_type` from now on, in every LLMConfig."""
+        cls.overrides[model_type] = model
 
     def get_model(self, model_type: str) -> Any:
-        """Get a specific model by type"""
-        if model_type not in self._models:
+        """Get a specific model by type, creating it on first use"""
+        if model_type in self.overrides:
+            return self.overrides[model_type]
+        kind, _, name = model_type.partition(":")
+        if kind not in self.factories:
             raise ValueError(f"Unknown model type: {model_type}")
+        if model_type not in self._models:
+            with self._lock:
+                if model_type not in self._models:
+                    self._models[model_type] = self.factories[kind](name) if name else self.factories[kind]()
         return self._models[model_type]
-
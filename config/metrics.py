@@ -0,0 +1,341 @@
+from config.log_config import LoggingConfig
+
+from langchain_core.embeddings import Embeddings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from dotenv import load_dotenv
+from rich.table import Table
+from typing import Any, Callable, Dict, Iterator, List, Optional, TextIO, Tuple
+import threading
+import secrets
+import json
+import time
+import sys
+import os
+
+load_dotenv()
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+@dataclass
+class Histogram:
+    counts: List[int] = field(default_factory=lambda: [0] * len(BUCKETS))
+    count: int = 0
+    sum: float = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+@dataclass
+class Span:
+    """A timed operation; the root span of a page or query also sums the time of everything under it."""
+    name: str
+    labels: Dict[str, str]
+    trace_id: str
+    span_id: str
+    parent: Optional["Span"] = None
+    start: float = field(default_factory=time.time)
+    end: Optional[float] = None
+    error: Optional[str] = None
+    breakdown: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def root(self) -> "Span":
+        return self.parent.root if self.parent else self
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.time()) - self.start
+
+
+class Exporter:
+    """Receives every finished span."""
+
+    def export(self, span: Span) -> None:
+        pass
+
+
+class JsonLogExporter(Exporter):
+    """One JSON log line per span."""
+
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = {
+            "ts": span.start,
+            "span": span.name,
+            **span.labels,
+            "duration_ms": round(span.duration * 1000, 3),
+            "status": "error" if span.error else "ok",
+        }
+        if span.breakdown:
+            line["breakdown_ms"] = {name: round(seconds * 1000, 3) for name, seconds in span.breakdown.items()}
+        with self._lock:
+            self.stream.write(json.dumps(line) + "\n")
+            self.stream.flush()
+
+
+class OtelSpanExporter(Exporter):
+    """Spans in the OpenTelemetry JSON shape (trace and span ids, nanosecond times, attributes, status)."""
+
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        attributes = dict(span.labels)
+        attributes.update({f"breakdown.{name}_ms": round(seconds * 1000, 3) for name, seconds in span.breakdown.items()})
+        record = {
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_span_id": span.parent.span_id if span.parent else None,
+            "name": span.name,
+            "start_time_unix_nano": int(span.start * 1e9),
+            "end_time_unix_nano": int((span.end or time.time()) * 1e9),
+            "attributes": attributes,
+            "status": {"code": "ERROR", "message": span.error} if span.error else {"code": "OK"},
+        }
+        with self._lock:
+            self.stream.write(json.dumps(record) + "\n")
+            self.stream.flush()
+
+
+class PrometheusExporter(Exporter):
+    """Serves the registry in the Prometheus text format on /metrics."""
+
+    def __init__(self, registry: "Metrics", port: int, host: str = "127.0.0.1"):
+        registry_ref = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = registry_ref.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True, name="metrics").start()
+
+
+class Metrics:
+    """Process-wide timers, histograms and counters, with spans handed to the configured exporters."""
+
+    def __init__(self):
+        self.console = LoggingConfig().console
+        self.histograms: Dict[LabelKey, Histogram] = {}
+        self.counters: Dict[LabelKey, float] = {}
+        self.exporters: List[Exporter] = []
+        self._current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> LabelKey:
+        return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self.histograms.setdefault(key, Histogram()).observe(value)
+
+    def increment(self, name: str, amount: float = 1, **labels: Any) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def _finish(self, current: Span, span: bool, labels: Dict[str, Any]) -> None:
+        self.observe(f"{current.name}_duration_seconds", current.duration, **labels)
+        if current.error:
+            self.increment(f"{current.name}_errors_total", **labels)
+        if current.parent is not None:
+            category = f"{current.name}:{labels['kind']}" if "kind" in labels else current.name
+            root = current.root
+            with self._lock:
+                root.breakdown[category] = root.breakdown.get(category, 0.0) + current.duration
+        if span:
+            for exporter in self.exporters:
+                exporter.export(current)
+
+    def _span(self, name: str, labels: Dict[str, Any], start: Optional[float] = None) -> Span:
+        parent = self._current.get()
+        return Span(
+            name=name,
+            labels={label: str(value) for label, value in labels.items()},
+            trace_id=parent.trace_id if parent else secrets.token_hex(16),
+            span_id=secrets.token_hex(8),
+            parent=parent,
+            start=start if start is not None else time.time(),
+        )
+
+    @contextmanager
+    def timer(self, name: str, span: bool = True, **labels: Any) -> Iterator[Span]:
+        """Time a block into `<name>_duration_seconds`, count its failures in `<name>_errors_total`
+        and add its time to the breakdown of the enclosing page or query.
+
+        With `span=False` (e.g. per Redis command) nothing is sent to the exporters.
+        """
+        current = self._span(name, labels)
+        token = self._current.set(current)
+        try:
+            yield current
+        except BaseException as e:
+            current.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self._current.reset(token)
+            current.end = time.time()
+            self._finish(current, span, labels)
+
+    def record(self, name: str, start: float, error: Optional[str] = None, **labels: Any) -> Span:
+        """Record an operation that started at `start` (time.time()) and just ended, like `timer` does.
+
+        For work that cannot sit inside a `with` block, such as a stream consumed by someone else.
+        """
+        current = self._span(name, labels, start)
+        current.end = time.time()
+        current.error = error
+        self._finish(current, True, labels)
+        return current
+
+    def record_tokens(self, model: str, input_tokens: int = 0, output_tokens: int = 0) -> None:
+        if input_tokens:
+            self.increment("llm_tokens_total", input_tokens, model=model, direction="input")
+        if output_tokens:
+            self.increment("llm_tokens_total", output_tokens, model=model, direction="output")
+
+    def prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        def escape(value: str) -> str:
+            # Book and page names end up in label values
+            return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        def labels_text(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+            parts = [f'{label}="{escape(value)}"' for label, value in labels] + ([extra] if extra else [])
+            return "{" + ",".join(parts) + "}" if parts else ""
+
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        for name in sorted({key[0] for key, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), histogram in histograms:
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    bucket_label = f'le="{le}"'
+                    lines.append(f"{name}_bucket{labels_text(labels, bucket_label)} {cumulative}")
+                lines.append(f"{name}_sum{labels_text(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{labels_text(labels)} {histogram.count}")
+        for name in sorted({key[0] for key, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(f"{name}{labels_text(labels)} {value}" for (metric, labels), value in counters if metric == name)
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Plain-dict view of every histogram and counter."""
+        with self._lock:
+            return {
+                "histograms": [
+                    {"name": name, "labels": dict(labels), "count": h.count, "sum": h.sum}
+                    for (name, labels), h in sorted(self.histograms.items())
+                ],
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+            }
+
+    def report(self) -> None:
+        """Print call counts and mean latency per operation, and the token and retry totals."""
+        snapshot = self.snapshot()
+        if not snapshot["histograms"]:
+            return
+        table = Table(title="Metrics")
+        for column in ("operation", "labels", "calls", "mean ms", "total s"):
+            table.add_column(column)
+        for h in snapshot["histograms"]:
+            labels = ", ".join(f"{label}={value}" for label, value in h["labels"].items())
+            table.add_row(h["name"].removesuffix("_duration_seconds"), labels, str(h["count"]), f"{h['sum'] / h['count'] * 1000:.1f}", f"{h['sum']:.2f}")
+        for c in snapshot["counters"]:
+            labels = ", ".join(f"{label}={value}" for label, value in c["labels"].items())
+            table.add_row(c["name"], labels, f"{c['value']:g}", "", "")
+        self.console.print(table)
+
+
+def model_name(model: Any) -> str:
+    """Label of a model client: its configured model name, else its class name."""
+    return str(getattr(model, "model", None) or type(model).__name__)
+
+
+class InstrumentedEmbeddings(Embeddings):
+    """Times every call of the wrapped embeddings model as an `llm` operation of kind `embeddings`.
+
+    The model is loaded by `load` on first use, so wrapping it costs nothing at startup.
+    """
+
+    def __init__(self, load: Callable[[], Embeddings]):
+        self.load = load
+        self._embeddings: Optional[Embeddings] = None
+
+    @property
+    def embeddings(self) -> Embeddings:
+        if self._embeddings is None:
+            self._embeddings = self.load()
+        return self._embeddings
+
+    @property
+    def model(self) -> str:
+        return model_name(self.embeddings)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with metrics.timer("llm", kind="embeddings", model=self.model):
+            return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with metrics.timer("llm", kind="embeddings", model=self.model):
+            return self.embeddings.embed_query(text)
+
+
+def configure(registry: Metrics) -> Metrics:
+    """Attach the exporters listed in METRICS_EXPORTERS (json, prometheus, otel)."""
+    for name in filter(None, (part.strip().lower() for part in os.getenv("METRICS_EXPORTERS", "").split(","))):
+        try:
+            if name == "json":
+                path = os.getenv("METRICS_JSON_PATH", "-")
+                registry.exporters.append(JsonLogExporter(sys.stderr if path == "-" else open(path, "a")))
+            elif name == "otel":
+                registry.exporters.append(OtelSpanExporter(open(os.getenv("METRICS_OTEL_PATH", "spans.jsonl"), "a")))
+            elif name == "prometheus":
+                registry.exporters.append(PrometheusExporter(registry, int(os.getenv("METRICS_PORT", "9464")), os.getenv("METRICS_HOST", "127.0.0.1")))
+            else:
+                registry.console.print(f"Unknown metrics exporter '{name}'", style="warning")
+        except Exception as e:
+            registry.console.print(f"❌ Could not start the '{name}' metrics exporter: {e}", style="error")
+    return registry
+
+
+metrics = configure(Metrics())
@@ -1,97 +1,431 @@
 from langchain_redis import RedisConfig, RedisVectorStore
 from config.log_config import LoggingConfig
 from config.llm_config import LLMConfig
+from config.metrics import InstrumentedEmbeddings, metrics
 from rich.prompt import Prompt
 from rich.panel import Panel
-from collections import defaultdict
+from redis import BlockingConnectionPool, Redis
+from redis.client import Pipeline
+from redis.exceptions import ResponseError
+from redis.commands.search import reducers
+from redis.commands.search.aggregation import AggregateRequest, Asc
+from redis.commands.search.query import Query
+from redisvl.index import SearchIndex
+from redisvl.query import FilterQuery
+from redisvl.schema import IndexSchema
+from redisvl.query.filter import Tag
+from dataclasses import dataclass, field
 from dotenv import load_dotenv
+from functools import cache
+from typing import Any, Dict, List, Optional, Tuple
+import threading
+import fnmatch
+import json
 import os
 
-class RedisConnection:
-    """Class for initializing and managing Redis connection and vector store."""
+load_dotenv()
+
+DEFAULT_INDEX_NAME = "index"
+METADATA_SCHEMA = [
+    {"name": "book_id", "type": "tag"},
+    {"name": "image_id", "type": "tag"},
+]
+# Field-level chunks of the pages (INDEX_MODE=chunk), linked to their page by book_id and image_id
+CHUNK_INDEX_NAME = f"{DEFAULT_INDEX_NAME}_chunks"
+CHUNK_METADATA_SCHEMA = METADATA_SCHEMA + [
+    {"name": "field", "type": "tag"},
+    {"name": "chunk", "type": "numeric"},
+]
+
+
+class InstrumentedPipeline(Pipeline):
+    """Pipeline timing each round trip as one `redis` operation."""
+
+    def execute(self, raise_on_error: bool = True) -> List[Any]:
+        with metrics.timer("redis", span=False, command="PIPELINE"):
+            return super().execute(raise_on_error)
+
+
+class InstrumentedRedis(Redis):
+    """Redis client timing every command, without a span per command."""
+
+    def execute_command(self, *args, **options):
+        with metrics.timer("redis", span=False, command=str(args[0]).split(" ")[0].upper()):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Any = None) -> Pipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class TypedVectorStore(RedisVectorStore):
+    """RedisVectorStore encoding query vectors in the datatype of its index.
+
+    langchain-redis leaves them at redisvl's float32 default, which a FLOAT16 or FLOAT64 index rejects.
+    """
+
+    def _query_builder(self, *args: Any, **kwargs: Any) -> Any:
+        query = super()._query_builder(*args, **kwargs)
+        query._dtype = self.config.vector_datatype.lower()
+        return query
+
+
+class IndexSettings:
+    """Vector field definition used when an index is created or migrated.
+
+    Existing indexes keep the definition they were built with; changing these settings
+    takes effect through `python -m utils.maintenance migrate-index`.
+    """
+
+    def __init__(self, algorithm: Optional[str] = None, datatype: Optional[str] = None, distance_metric: Optional[str] = None,
+                 m: Optional[int] = None, ef_construction: Optional[int] = None, ef_runtime: Optional[int] = None):
+        load_dotenv()
+        self.algorithm = (algorithm or os.getenv("INDEX_ALGORITHM", "FLAT")).upper()
+        self.datatype = (datatype or os.getenv("INDEX_DATATYPE", "FLOAT32")).upper()
+        self.distance_metric = (distance_metric or os.getenv("INDEX_DISTANCE_METRIC", "COSINE")).upper()
+        self.m = m or int(os.getenv("INDEX_HNSW_M", "16"))
+        self.ef_construction = ef_construction or int(os.getenv("INDEX_HNSW_EF_CONSTRUCTION", "200"))
+        self.ef_runtime = ef_runtime or int(os.getenv("INDEX_HNSW_EF_RUNTIME", "10"))
+
+    def vector_attrs(self, dims: int) -> Dict[str, Any]:
+        attrs = {
+            "dims": dims,
+            "algorithm": self.algorithm.lower(),
+            "datatype": self.datatype.lower(),
+            "distance_metric": self.distance_metric.lower(),
+        }
+        if self.algorithm == "HNSW":
+            attrs.update(m=self.m, ef_construction=self.ef_construction, ef_runtime=self.ef_runtime)
+        return attrs
 
-    def __init__(self, url: str):
-        """Initialize Redis connection and vector store."""
+    def describe(self) -> Dict[str, str]:
+        description = {"algorithm": self.algorithm, "datatype": self.datatype, "distance_metric": self.distance_metric}
+        if self.algorithm == "HNSW":
+            description.update(m=str(self.m), ef_construction=str(self.ef_construction), ef_runtime=str(self.ef_runtime))
+        return description
+
+
+def index_schema(index_name: str, metadata_schema: List[Dict[str, Any]], settings: IndexSettings, dims: int) -> IndexSchema:
+    """Schema laid out like the langchain-redis default one, with a configurable vector field."""
+    metadata_fields = [
+        {**field, "attrs": {"separator": "|", **field.get("attrs", {})}} if field["type"] == "tag" else field
+        for field in metadata_schema
+    ]
+    return IndexSchema.from_dict({
+        "index": {"name": index_name, "prefix": f"{index_name}:", "storage_type": "hash"},
+        "fields": [
+            {"name": "text", "type": "text"},
+            {"name": "embedding", "type": "vector", "attrs": settings.vector_attrs(dims)},
+            {"name": "_index_name", "type": "text"},
+            {"name": "_metadata_json", "type": "text"},
+            *metadata_fields,
+        ],
+    })
+
+
+class RedisManager:
+    """Process-wide owner of the pooled Redis client, the embeddings client and one vector store per index."""
+
+    def __init__(self, url: Optional[str] = None):
         load_dotenv()
         self.console = LoggingConfig().console
-        self.console.print(f"Connecting to {os.getenv('REDIS_URL') or url}", style="system")
-
-        # Get embeddings model from config
-        llm_config = LLMConfig()
-        self.embeddings = llm_config.get_model('embeddings')
-        
-        self.config = RedisConfig(
-            index_name="index",
-            redis_url=os.getenv("REDIS_URL", f"{url}"),
-            metadata_schema=[
-                {"name": "book_id", "type": "tag"},
-                {"name": "image_id", "type": "tag"},
-            ],
+        self.url = url or os.getenv("REDIS_URL")
+        self.max_connections = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+        self.health_check_interval = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+        # Known size of text-embedding-004 vectors, so opening a store never needs a probe embedding call
+        self.embedding_dimensions = int(os.getenv("EMBEDDING_DIMENSIONS", "768"))
+        self.index_settings = IndexSettings()
+
+        self._lock = threading.Lock()
+        self._client: Optional[Redis] = None
+        self._embeddings: Any = None
+        self._vectorstores: Dict[str, RedisVectorStore] = {}
+
+    @property
+    def client(self) -> Redis:
+        """Return the shared Redis client, creating its connection pool on first use."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self.console.print(f"Connecting to {self.url}", style="system")
+                    pool = BlockingConnectionPool.from_url(
+                        self.url,
+                        max_connections=self.max_connections,
+                        health_check_interval=self.health_check_interval,
+                        socket_keepalive=True,
+                    )
+                    self._client = InstrumentedRedis(connection_pool=pool)
+        return self._client
+
+    @property
+    def embeddings(self) -> Any:
+        """Return the shared embeddings client."""
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    self._embeddings = InstrumentedEmbeddings(lambda: LLMConfig().get_model('embeddings'))
+        return self._embeddings
+
+    def resolve(self, name: str) -> str:
+        """Return the index an alias points to, or `name` itself if it is an index or does not exist yet."""
+        try:
+            return self.client.ft(name).info()["index_name"]
+        except ResponseError:
+            return name
+
+    def open_vectorstore(self, index_name: str, metadata_schema: Optional[List[Dict[str, Any]]] = None,
+                         settings: Optional[IndexSettings] = None) -> RedisVectorStore:
+        """Open a vector store on a concrete index, creating the index from `settings` if it is missing.
+
+        An existing index keeps its own vector definition, so writes always match its datatype.
+        """
+        client = self.client
+        try:
+            client.ft(index_name).info()
+            schema = SearchIndex.from_existing(index_name, redis_client=client).schema
+        except ResponseError:
+            schema = index_schema(index_name, metadata_schema or METADATA_SCHEMA, settings or self.index_settings, self.embedding_dimensions)
+        vector = schema.fields["embedding"].attrs
+        config = RedisConfig(
+            index_name=index_name,
+            redis_client=client,
+            index_schema=schema,
+            embedding_dimensions=vector.dims,
+            distance_metric=vector.distance_metric.value,
+            indexing_algorithm=vector.algorithm.value,
+            vector_datatype=vector.datatype.value,
         )
+        return TypedVectorStore(self.embeddings, config=config)
+
+    def get_vectorstore(self, index_name: str = DEFAULT_INDEX_NAME, metadata_schema: Optional[List[Dict[str, Any]]] = None) -> RedisVectorStore:
+        """Return the vector store behind an index name or alias, opening it once per process."""
+        vectorstore = self._vectorstores.get(index_name)
+        if vectorstore is not None:
+            return vectorstore
+
+        physical_name = self.resolve(index_name)
+        with self._lock:
+            if index_name not in self._vectorstores:
+                self._vectorstores[index_name] = self.open_vectorstore(physical_name, metadata_schema)
+            return self._vectorstores[index_name]
+
+    def health_check(self) -> bool:
+        """Ping the server through the pool."""
+        try:
+            return bool(self.client.ping())
+        except Exception as e:
+            self.console.print(f"❌ Redis health check failed: {e}", style="error")
+            return False
+
+    def close(self) -> None:
+        """Drop cached stores and release every pooled connection."""
+        with self._lock:
+            self._vectorstores.clear()
+            if self._client is not None:
+                self._client.connection_pool.disconnect()
+                self._client = None
+
+
+_managers: Dict[Optional[str], RedisManager] = {}
+_manager_lock = threading.Lock()
+
+
+def get_redis_manager(url: Optional[str] = None) -> RedisManager:
+    """Return the process-wide RedisManager of a server, REDIS_URL by default."""
+    url = url or os.getenv("REDIS_URL")
+    manager = _managers.get(url)
+    if manager is None:
+        with _manager_lock:
+            if url not in _managers:
+                _managers[url] = RedisManager(url)
+            manager = _managers[url]
+    return manager
+
+
+# Books no collection of COLLECTIONS claims are stored in this one, the `index` index of REDIS_URL
+DEFAULT_COLLECTION = "default"
+
+
+@dataclass
+class Collection:
+    """A named group of books with its own index, and so its own key prefix, optionally on its own Redis server."""
+    name: str
+    index_name: str
+    url: Optional[str] = None
+    # Patterns ('*' wildcard) of the book ids stored in the collection
+    books: List[str] = field(default_factory=list)
+
+    @property
+    def manager(self) -> RedisManager:
+        return get_redis_manager(self.url)
+
+    @property
+    def chunk_index_name(self) -> str:
+        return f"{self.index_name}_chunks"
+
+    def vectorstore(self) -> RedisVectorStore:
+        return self.manager.get_vectorstore(self.index_name)
+
+    def chunk_vectorstore(self) -> RedisVectorStore:
+        return self.manager.get_vectorstore(self.chunk_index_name, CHUNK_METADATA_SCHEMA)
+
+    def holds(self, book_id: str) -> bool:
+        return any(fnmatch.fnmatchcase(book_id, pattern) for pattern in self.books)
+
+
+@cache
+def get_collections() -> Dict[str, Collection]:
+    """The default collection and those of COLLECTIONS, a JSON object such as
+    {"letters": {"books": ["letters_*"], "url": "redis://other-host:6379"}}; each one is indexed in `index_<name>`."""
+    collections = {DEFAULT_COLLECTION: Collection(DEFAULT_COLLECTION, DEFAULT_INDEX_NAME)}
+    for name, settings in json.loads(os.getenv("COLLECTIONS") or "{}").items():
+        index_name = DEFAULT_INDEX_NAME if name == DEFAULT_COLLECTION else f"{DEFAULT_INDEX_NAME}_{name}"
+        collections[name] = Collection(name, settings.get("index", index_name), settings.get("url"), list(settings.get("books", [])))
+    return collections
+
+
+def get_collection(name: str) -> Collection:
+    collections = get_collections()
+    if name not in collections:
+        raise ValueError(f"Unknown collection: {name}. Available collections: {', '.join(collections)}")
+    return collections[name]
+
+
+def route_collection(book_id: str) -> Collection:
+    """The collection a book is stored in: INGEST_COLLECTION if set, else the first one holding it, else the default one."""
+    if forced := os.getenv("INGEST_COLLECTION"):
+        return get_collection(forced)
+    collections = get_collections()
+    return next((c for c in collections.values() if c.holds(book_id)), collections[DEFAULT_COLLECTION])
+
+
+class RedisConnection:
+    """Class for initializing and managing Redis connection and vector store."""
+
+    def __init__(self, url: str, index_name: str = DEFAULT_INDEX_NAME):
+        """Attach to the shared Redis connection and vector store."""
+        self.console = LoggingConfig().console
+        self.manager = get_redis_manager(url)
 
         try:
-            self.vectorstore = RedisVectorStore(self.embeddings, config=self.config)
+            self.vectorstore = self.manager.get_vectorstore(index_name)
         except Exception as e:
             self.console.print(f"❌ Error connecting to Redis: {e}", style="error")
             exit()
 
+        self.config = self.vectorstore.config
+        self.embeddings = self.manager.embeddings
+
     def get_vectorstore(self) -> RedisVectorStore:
         """Return the initialized vector store."""
         return self.vectorstore
-    
+
     def get_config(self) -> RedisConfig:
         """Return the initialized config."""
         return self.config
-        
-    def read_vectorstore(self) -> None:
-        """Fetch and display documents from the RedisVectorStore."""
-        self.console.print("Fetching all available documents from the RedisVectorStore...", style="system")
-        docs = self.vectorstore.similarity_search("dummy", k=1000)
-        books = defaultdict(lambda: defaultdict(list))
-        for doc in docs:
-            book = doc.metadata.get("book_id", "unknown")
-            image_id = doc.metadata.get("image_id", "unknown")
-            books[book][image_id].append(doc)
 
-        book_names = sorted(books.keys())
+    @staticmethod
+    def _row_to_dict(row: List[Any]) -> Dict[str, str]:
+        """Turn a flat [field, value, ...] aggregation row into a dict of strings."""
+        values = [v.decode() if isinstance(v, bytes) else str(v) for v in row]
+        return dict(zip(values[::2], values[1::2]))
+
+    def list_books(self) -> List[Tuple[str, int]]:
+        """Return every book with its page count, reading the aggregation through a cursor."""
+        search = self.manager.client.ft(self.config.index_name)
+        request = (
+            AggregateRequest("*")
+            .group_by("@book_id", reducers.count().alias("pages"))
+            .cursor(count=500)
+            .dialect(2)
+        )
+        result = search.aggregate(request)
+        rows = list(result.rows)
+        while result.cursor and result.cursor.cid:
+            result = search.aggregate(result.cursor)
+            rows.extend(result.rows)
+
+        books = [self._row_to_dict(row) for row in rows]
+        return sorted((book["book_id"], int(book["pages"])) for book in books if "book_id" in book)
+
+    def list_pages(self, book_id: str, offset: int = 0, limit: int = 20) -> Tuple[List[str], int]:
+        """Return one page of image ids of a book, without loading their content, and the book size."""
+        search = self.manager.client.ft(self.config.index_name)
+        book_filter = str(Tag("book_id") == book_id)
+        total = search.search(Query(book_filter).no_content().paging(0, 0).dialect(2)).total
+        request = (
+            AggregateRequest(book_filter)
+            .load("@image_id")
+            .sort_by(Asc("@image_id"))
+            .limit(offset, limit)
+            .dialect(2)
+        )
+        rows = [self._row_to_dict(row) for row in search.aggregate(request).rows]
+        return [row["image_id"] for row in rows if "image_id" in row], total
+
+    def get_page(self, book_id: str, image_id: str) -> List[str]:
+        """Load the stored content of a single page."""
+        query = FilterQuery(
+            filter_expression=(Tag("book_id") == book_id) & (Tag("image_id") == image_id),
+            return_fields=[self.config.content_field],
+            num_results=10,
+        )
+        return [result[self.config.content_field] for result in self.vectorstore.index.query(query)]
+
+    def read_vectorstore(self) -> None:
+        """Browse the catalog of books and pages, loading content only for the selected page."""
+        self.console.print("Fetching the catalog of available books...", style="system")
+        books = self.list_books()
 
         self.console.print("\n📚 [info]Available books:[/info]")
-        if not book_names:
+        if not books:
             self.console.print("No books found.", style="warning")
             return
-        
-        for i, book in enumerate(book_names):
-            self.console.print(f"[info]{i}[/info]: {book}")
+
+        for i, (book, pages) in enumerate(books):
+            self.console.print(f"[info]{i}[/info]: {book} ({pages} pages)")
 
         book_index = Prompt.ask("\nSelect a book number to view (or 'quit' to exit)", console=self.console)
         if book_index.lower() == "quit" or book_index.lower() == "exit":
             return
         try:
-            selected_book = book_names[int(book_index)]
+            selected_book = books[int(book_index)][0]
         except (ValueError, IndexError):
             self.console.print("❌ Invalid book selection.", style="error")
             return
 
-        # Select document in book
-        image_ids = sorted(books[selected_book].keys())
+        # Select document in book, one catalog page at a time
+        page_size = int(os.getenv("CATALOG_PAGE_SIZE", "20"))
+        offset = 0
+        while True:
+            image_ids, total = self.list_pages(selected_book, offset, page_size)
 
-        self.console.print(f"\n📦 [info]Documents in book '{selected_book}':[/info]")
-        for i, img_id in enumerate(image_ids):
-            self.console.print(f"[info]{i}[/info]: {img_id}")
+            self.console.print(f"\n📦 [info]Documents in book '{selected_book}' ({offset + 1}-{offset + len(image_ids)} of {total}):[/info]")
+            for i, img_id in enumerate(image_ids, start=offset):
+                self.console.print(f"[info]{i}[/info]: {img_id}")
 
-        try:
-            index = int(Prompt.ask("\nSelect a page number to view", console=self.console))
-            selected_id = image_ids[index]
-        except (ValueError, IndexError):
-            self.console.print("❌ Invalid page selection.", style="error")
-            exit()
+            choice = Prompt.ask("\nSelect a page number to view ('n' next, 'p' previous)", console=self.console)
+            if choice.lower() == "n":
+                offset = offset + page_size if offset + page_size < total else offset
+                continue
+            if choice.lower() == "p":
+                offset = max(0, offset - page_size)
+                continue
+            try:
+                index = int(choice)
+                if not offset <= index < offset + len(image_ids):
+                    raise IndexError
+                selected_id = image_ids[index - offset]
+                break
+            except (ValueError, IndexError):
+                self.console.print("❌ Invalid page selection.", style="error")
+                exit()
 
         # Display document
         self.console.print(f"\n📄 [document]Content of '{selected_id}' ('{selected_book}'):[/document]")
 
-        for doc in books[selected_book][selected_id]:
+        for content in self.get_page(selected_book, selected_id):
             self.console.print(Panel.fit(
-                doc.page_content.strip(),
+                content.strip(),
                 title=f"[bold]{selected_id}[/bold]",
                 border_style="document"
             ))
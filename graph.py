@@ -1,26 +1,59 @@
 from langchain_core.messages import HumanMessage, SystemMessage
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.constants import Send
 from langgraph.graph import END, StateGraph, START
 from config.log_config import LoggingConfig
 from config.decorators import node
 from config.llm_config import LLMConfig
-from schemas.models import EvaluationState, Evaluation
+from config.checkpoint_config import get_checkpointer
+from config.metrics import metrics
+from schemas.models import BatchEvaluation, EvaluationState, Evaluation
 from handlers.output_handler import OutputHandler
-from handlers.input_handler import InputHandler
+from handlers.input_handler import InputHandler, prefetch
+from handlers.ingest_handler import IngestHandler
+from handlers.cache_handler import IngestCache
+from handlers.image_handler import ImagePreprocessor, PreparedImage
+from handlers.batch_handler import BatchScanner
+from handlers.consensus_handler import ConsensusHandler
+from utils.rate_limit import RateLimiter, call_with_retry
+from utils.deadline import LatencyTracker, call_hedged, call_with_deadline
 
-from rich.panel import Panel
 from rich.prompt import Prompt
 from pathlib import Path
-import base64
+from typing import Any, List, Optional
+import asyncio
 import time
+import os
 
-start_time = time.time()
 console = LoggingConfig().console
 
-# Initialize LLM configuration
-llm_config = LLMConfig()
-model = llm_config.get_model('vision')
+# Shared by every worker so concurrent pages stay within the vision model quota
+rate_limiter = RateLimiter.from_env("VISION")
+
+# Bump whenever the image_scan prompt changes, so cached evaluations are not reused
+PROMPT_VERSION = "1"
+ingest_cache = IngestCache(PROMPT_VERSION)
+# Pages are downscaled and recompressed before the vision call; PDF pages never touch the disk
+preprocessor = ImagePreprocessor()
+
+# Seconds a vision call may take before its page gives up on it (0 waits forever)
+vision_timeout = float(os.getenv("VISION_TIMEOUT", "120")) or None
+# Optional cheaper model asked as well when the primary one is slower than its p95 latency
+hedge_model_name = os.getenv("VISION_HEDGE_MODEL", "")
+hedge_after = float(os.getenv("VISION_HEDGE_AFTER", "30"))
+vision_latency = LatencyTracker()
+
+def evaluation_models() -> list:
+    """Models every page is evaluated with, created on first use rather than at import"""
+    # The default model, then the VISION_MODELS ones, whose evaluations are merged into one
+    extra = [name.strip() for name in os.getenv("VISION_MODELS", "").split(",") if name.strip()]
+    return [ LLMConfig().get_model('vision') ] + [ LLMConfig().get_model(f'vision:{name}') for name in extra ]
+
+def vision_model(name: str) -> Any:
+    """The evaluation model called `name`; graph states hold model names rather than clients"""
+    for model in evaluation_models():
+        if model.model == name:
+            return model
+    raise ValueError(f"Unknown vision model: {name}")
 
 # Nodes
 @node
@@ -31,19 +64,54 @@ def human_feedback_node(state: EvaluationState):
 def init_evaluation(state: EvaluationState):
     return [
         Send("conduct_evaluation", {
-            "model": model,
+            "model": model.model,
             "evaluations": state.get("evaluations", []),
             "input_image": state["input_image"],
             "human_feedback": state.get("human_feedback", "")
         })
-        for model in llm_list
+        for model in evaluation_models()
     ]
 
 @node
 def conduct_evaluation(state: EvaluationState):
-    evaluation = image_scan(state)
+    try:
+        return evaluate(state)
+    except Exception as e:
+        if len(evaluation_models()) == 1:
+            raise
+        # The other models still answer for the page
+        console.print(f"⚠️ {state['model']} failed on {Path(state['input_image']).name}: {e}", style="warning")
+        return {"evaluations": []}
+
+def evaluate(state: EvaluationState):
+    image = preprocessor.load(state["input_image"])
+    if image.blank:
+        console.print(f"Skipping blank page {Path(state['input_image']).name}", style="info")
+        evaluation = Evaluation(model=state["model"], transcription="", translation="", keywords=[])
+        return {"evaluations": state.get("evaluations", []) + [evaluation]}
+
+    cache_key = ingest_cache.key(image.data, state["model"])
+    batched = batch_scanner.take(state["input_image"], state["model"])
+    # Feedback changes the prompt, so such pages are always scanned again
+    evaluation = None if state.get("human_feedback") else ingest_cache.get(cache_key, state["input_image"])
+    if evaluation is None:
+        evaluation = None if state.get("human_feedback") else batched
+        if evaluation is None:
+            evaluation = image_scan(state, image)
+        # An answer of the hedge model is not cached as the primary model's
+        if evaluation.model == state["model"]:
+            ingest_cache.set(cache_key, state["input_image"], evaluation)
     return {"evaluations": state.get("evaluations", []) + [evaluation]}
 
+@node
+def merge_evaluations(state: EvaluationState):
+    """Merge the latest evaluation of every model into the one stored for the page"""
+    # Earlier models come first, so the primary one wins the ties
+    evaluations = ConsensusHandler.latest(state["evaluations"], [model.model for model in evaluation_models()])
+    if not evaluations:
+        raise ValueError(f"No model evaluated {Path(state['input_image']).name}")
+    return {"merged": ConsensusHandler().merge(evaluations)}
+
 @node
 def evaluation_summary(state: EvaluationState):
     handler = OutputHandler()
@@ -51,16 +119,8 @@ def evaluation_summary(state: EvaluationState):
     return state
 
 
-# Image scan and helper functions
-def encode_image(image_path: str) -> str:
-    """Encode image to base64"""
-    with open(image_path, "rb") as img:
-        return base64.b64encode(img.read()).decode()
-
-
-def image_scan(state: EvaluationState) -> Evaluation:
-    b64 = encode_image(state["input_image"])
-    structured_llm = state["model"].with_structured_output(Evaluation)
+# Image scan
+def image_scan(state: EvaluationState, image: PreparedImage) -> Evaluation:
     prompt = f"""
         You are a historical‐document expert. Provide:
         1) A perfect literal transcription in the original language, respecting the original orthography, punctuation, spacing and formatting.
@@ -75,84 +135,165 @@ def image_scan(state: EvaluationState) -> Evaluation:
 
         Take into account the user feedback about the document (if any): {state.get('human_feedback','')}
         """
-    result = structured_llm.invoke([
+    messages = [
         SystemMessage(content=prompt),
         HumanMessage(content=[
-            {"type":"image_url","image_url":{"url":f"data:image/jpeg;base64,{b64}"}},
+            {"type":"image_url","image_url":{"url":image.data_url()}},
             {"type":"text","text":"Please analyze this document."}
         ])
-    ])
+    ]
+
+    def call(model: Any, hedge: bool = False):
+        structured_llm = model.with_structured_output(Evaluation, include_raw=True)
+
+        def invoke():
+            rate_limiter.acquire()
+            with metrics.timer("llm", kind="vision_hedge" if hedge else "vision", model=model.model):
+                return structured_llm.invoke(messages)
+
+        def scan():
+            started = time.monotonic()
+            response = call_with_retry(invoke, label="vision")
+            if not hedge:
+                vision_latency.observe(time.monotonic() - started)
+            return model.model, response
+        return scan
+
+    primary = call(vision_model(state["model"]))
+    if hedge_model_name and state["model"] == evaluation_models()[0].model:
+        hedge = call(LLMConfig().get_model(f"vision:{hedge_model_name}"), hedge=True)
+        (model_name, response), hedged = call_hedged(
+            primary, hedge, vision_latency.percentile(95, hedge_after), vision_timeout
+        )
+        if hedged:
+            metrics.increment("vision_hedged_total")
+    else:
+        model_name, response = call_with_deadline(primary, vision_timeout)
+    usage = getattr(response["raw"], "usage_metadata", None) or {}
+    rate_limiter.record(usage.get("total_tokens", 0))
+    metrics.record_tokens(model_name, usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+    if response["parsed"] is None:
+        raise ValueError(f"Unparsable evaluation: {response['parsing_error']}")
+    result = response["parsed"]
     state['human_feedback'] = None
-    # Use the actual model name from the model's configuration
-    result.model = state["model"].model
+    # Use the actual model name from the configuration of the model that answered
+    result.model = model_name
     return result
 
 
-# Assemble and run graph
-llm_list = [ model ] # Models other than the default one may be added for further evaluations
+BATCH_PROMPT = """
+    You are a historical‐document expert. You receive several consecutive pages of the same document, numbered from 1.
+    For every page, provide:
+    1) A perfect literal transcription in the original language, respecting the original orthography, punctuation, spacing and formatting.
+    2) An English translation (if the document is already written in modern English, leave ONLY the "translation" field empty instead).
+    3) A list of English keywords about the page. IMPORTANT: use capital letters initials only for proper names.
+
+    Return exactly one entry per page, with its page number, and never mix the text of different pages.
+    A page may end with a truncated word which is finishing on the next page: transcribe each part on its own page and
+    don't complete the word, but use the following page to translate the sentence correctly.
+
+    Sometimes there is no text since the picture may represent just a cover, an illustration or a blank page. In that case, just
+    keep the related fields empty.
+    """
+
+def batch_scan(model: Any, images: List[PreparedImage]) -> List[Optional[Evaluation]]:
+    """Scan consecutive pages in one request; pages missing from the answer come back as None."""
+    structured_llm = model.with_structured_output(BatchEvaluation, include_raw=True)
+    content = []
+    for n, image in enumerate(images, start=1):
+        content.append({"type":"text","text":f"Page {n}:"})
+        content.append({"type":"image_url","image_url":{"url":image.data_url()}})
+    content.append({"type":"text","text":f"Please analyze these {len(images)} pages."})
+    messages = [SystemMessage(content=BATCH_PROMPT), HumanMessage(content=content)]
+    estimated = sum(sum(batch_scanner.estimate(image)) for image in images)
+
+    def invoke():
+        rate_limiter.acquire(estimated)
+        with metrics.timer("llm", kind="vision_batch", model=model.model):
+            return structured_llm.invoke(messages)
+
+    response = call_with_deadline(lambda: call_with_retry(invoke, label="vision"), vision_timeout)
+    usage = getattr(response["raw"], "usage_metadata", None) or {}
+    rate_limiter.record(usage.get("total_tokens", 0), estimated)
+    metrics.record_tokens(model.model, usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+    if response["parsed"] is None:
+        raise ValueError(f"Unparsable batch evaluation: {response['parsing_error']}")
+
+    pages = {}
+    for page in response["parsed"].pages:
+        # A page answered twice is ambiguous, so it is scanned again on its own
+        pages[page.page] = None if page.page in pages else page
+    return [
+        Evaluation(model=model.model, transcription=page.transcription, translation=page.translation, keywords=page.keywords)
+        if (page := pages.get(n)) is not None else None
+        for n in range(1, len(images) + 1)
+    ]
+
+# Optional (VISION_BATCH_PAGES > 1) scan of consecutive pages in one request, ahead of the graph
+batch_scanner = BatchScanner(
+    batch_scan,
+    preprocessor,
+    skip=lambda image_path, image, model: image.blank or ingest_cache.has(ingest_cache.key(image.data, model.model), image_path),
+)
+
 
+# Assemble the graph; building it has no side effects, so it can be imported (e.g. by langgraph.json)
 builder = StateGraph(EvaluationState)
 builder.add_node("human_feedback_node", human_feedback_node)
 builder.add_node("conduct_evaluation", conduct_evaluation)
+builder.add_node("merge_evaluations", merge_evaluations)
 builder.add_node("evaluation_summary", evaluation_summary)
 
 builder.add_edge(START, "human_feedback_node")
 builder.add_conditional_edges("human_feedback_node", init_evaluation, ["conduct_evaluation"])
-builder.add_edge("conduct_evaluation", "evaluation_summary")
+builder.add_edge("conduct_evaluation", "merge_evaluations")
+builder.add_edge("merge_evaluations", "evaluation_summary")
 builder.add_edge("evaluation_summary", END)
 
-graph = builder.compile(checkpointer=MemorySaver(), interrupt_before=["human_feedback_node"])
+# CHECKPOINTER=sqlite or redis keeps page states out of process memory, so interrupted books can be resumed
+graph = builder.compile(checkpointer=get_checkpointer(), interrupt_before=["human_feedback_node"])
 # graph.get_graph().draw_mermaid_png(output_file_path="graph.png")
 
 
-# Input config
-user_input = Prompt.ask("Please provide the path to the document or the folder you want to process", console=console)
-if user_input.lower() == "exit" or user_input.lower() == "quit":
-    exit()
-INPUT_PATH = Path(user_input)  # Can be a folder or a PDF
-TEMP_IMAGE_DIR = Path(INPUT_PATH.stem)
-TEMP_IMAGE_DIR.mkdir(exist_ok=True)
-
-image_files = InputHandler().extract(INPUT_PATH)
-
-
-feedback = Prompt.ask("Would you like to give some human-in-the-loop feedback for every scanned page? (y/n)", console=console)
-if feedback.lower() == "y":
-    feedback = True
-else:
-    feedback = False
-
-# Loop over images
-for image_path in image_files:
-    image_id = Path(image_path).stem
-
-    console.rule(f"Processing {Path(image_path).name}", style="event")
-
-    try:
-        thread = {"configurable": {"thread_id": f"{INPUT_PATH.name}:{image_id}"}}
-        initial_state = {
-            "evaluations": [],
-            "model": llm_list,
-            "input_image": str(image_path),
-            "human_feedback": ""
-        }
-
-        # Run graph verbose
-        for event in graph.stream(initial_state, thread, stream_mode="values"):
-            console.print(Panel.fit(str(event), title="📦 Event", border_style="event"))
-
-        if feedback:
-            feedback = console.input("[feedback]Insert feedback:[/feedback] ")
-        graph.update_state(thread, {"human_feedback": feedback}, as_node="human_feedback_node")
-
-        # Resume from feedback node
-        for event in graph.stream(None, thread, stream_mode="updates"):
-            console.print(Panel.fit(str(event), title="📦 Event", border_style="event"))
-
-    except Exception as e:
-        console.print(f"❌ Error processing {Path(image_path).name}: {e}", style="error")
-
-console.print(f"Execution time: --- {time.time() - start_time:.2f} seconds ---", style="system")
-
-# if INPUT_PATH.suffix.lower() == ".pdf":
-#     shutil.rmtree(TEMP_IMAGE_DIR)
\ No newline at end of file
+if __name__ == "__main__":
+    start_time = time.time()
+
+    # Input config
+    user_input = Prompt.ask("Please provide the path to the document or the folder you want to process", console=console)
+    if user_input.lower() == "exit" or user_input.lower() == "quit":
+        exit()
+    INPUT_PATH = Path(user_input)  # Can be a folder or a PDF
+    TEMP_IMAGE_DIR = Path(INPUT_PATH.stem)
+    TEMP_IMAGE_DIR.mkdir(exist_ok=True)
+
+    # Pages are rendered in the background while earlier ones are being scanned
+    image_files = prefetch(InputHandler(preprocessor).extract(INPUT_PATH), depth=int(os.getenv("PREFETCH_PAGES", "4")))
+
+
+    feedback = Prompt.ask("Would you like to give some human-in-the-loop feedback for every scanned page? (y/n)", console=console)
+    if feedback.lower() == "y":
+        feedback = True
+    else:
+        feedback = False
+
+    # Loop over images
+    concurrency = int(os.getenv("INGEST_CONCURRENCY", "1"))
+    # Drafts are scanned without feedback, so reviewed pages can share batched requests too
+    image_files = batch_scanner.scan(image_files, evaluation_models())
+    ingest = IngestHandler(graph, INPUT_PATH.name, evaluation_models(), feedback=feedback, concurrency=concurrency, preprocessor=preprocessor)
+    if feedback:
+        # Upcoming pages are drafted while the operator reviews, and stored once approved
+        ingest.review(image_files, ahead=int(os.getenv("REVIEW_AHEAD", "3")))
+    elif concurrency > 1:
+        asyncio.run(ingest.arun(image_files))
+    else:
+        ingest.run(image_files)
+
+    ingest_cache.report()
+    batch_scanner.report()
+    preprocessor.report()
+    metrics.report()
+    console.print(f"Execution time: --- {time.time() - start_time:.2f} seconds ---", style="system")
+
+    # if INPUT_PATH.suffix.lower() == ".pdf":
+    #     shutil.rmtree(TEMP_IMAGE_DIR)
\ No newline at end of file
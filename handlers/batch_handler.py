@@ -0,0 +1,139 @@
+from config.log_config import LoggingConfig
+from handlers.image_handler import ImagePreprocessor, PreparedImage
+from schemas.models import Evaluation
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+from dotenv import load_dotenv
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+import threading
+import math
+import os
+
+load_dotenv()
+
+# Input tokens of one 768x768 image tile
+TILE_TOKENS = 258
+# Ink share of a page densely covered with text, which gets the full VISION_PAGE_TOKENS output estimate
+DENSE_INK = 0.05
+
+BatchScan = Callable[[Any, List[PreparedImage]], List[Optional[Evaluation]]]
+
+
+class BatchScanner:
+    """Scans runs of consecutive pages with one vision request each, ahead of the graph.
+
+    Pages are grouped while their estimated output fits VISION_BATCH_TOKENS, up to VISION_BATCH_PAGES
+    pages, so covers and sparse pages share a request while dense ones go alone. The evaluations wait
+    in memory until `conduct_evaluation` takes them; pages missing from an answer, or from a failed
+    batch, get no evaluation here and are scanned one at a time by the graph as usual.
+    """
+
+    def __init__(self, scan: BatchScan, preprocessor: ImagePreprocessor, skip: Callable[[str, PreparedImage, Any], bool]):
+        self.console = LoggingConfig().console
+        self.scan_batch = scan
+        self.preprocessor = preprocessor
+        # Pages that need no vision call (blank or already cached) are left out of the batches
+        self.skip = skip
+        self.max_pages = int(os.getenv("VISION_BATCH_PAGES", "1"))
+        self.max_tokens = int(os.getenv("VISION_BATCH_TOKENS", "16000"))
+        self.page_tokens = int(os.getenv("VISION_PAGE_TOKENS", "2000"))
+        self.workers = int(os.getenv("VISION_BATCH_WORKERS", os.getenv("INGEST_CONCURRENCY", "2")))
+        self._results: Dict[Tuple[str, str], Evaluation] = {}
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.batched_pages = 0
+        self.fallback_pages = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_pages > 1
+
+    def estimate(self, image: PreparedImage) -> Tuple[int, int]:
+        """Estimated (input, output) tokens of a page: its image tiles, and its text by its amount of ink."""
+        width, height = image.size
+        input_tokens = math.ceil(width / 768) * math.ceil(height / 768) * TILE_TOKENS
+        output_tokens = max(100, int(self.page_tokens * min(1.0, image.ink / DENSE_INK)))
+        return input_tokens, output_tokens
+
+    def groups(self, pages: Iterable[str], models: List[Any]) -> Iterator[List[Tuple[str, Optional[PreparedImage]]]]:
+        """Split the pages into runs to scan together; skipped pages come alone and without an image."""
+        group: List[Tuple[str, Optional[PreparedImage]]] = []
+        tokens = 0
+        for image_path in pages:
+            image_path = str(image_path)
+            image = self.preprocessor.load(image_path)
+            if all(self.skip(image_path, image, model) for model in models):
+                if group:
+                    yield group
+                group, tokens = [], 0
+                yield [(image_path, None)]
+                continue
+            output_tokens = self.estimate(image)[1]
+            if group and (len(group) >= self.max_pages or tokens + output_tokens > self.max_tokens):
+                yield group
+                group, tokens = [], 0
+            group.append((image_path, image))
+            tokens += output_tokens
+        if group:
+            yield group
+
+    def _scan(self, group: List[Tuple[str, Optional[PreparedImage]]], models: List[Any]) -> None:
+        paths = [image_path for image_path, _ in group]
+        images = [image for _, image in group]
+        for model in models:
+            try:
+                evaluations = self.scan_batch(model, images) if len(images) > 1 else [None]
+            except Exception as e:
+                self.console.print(f"⚠️ Batch {Path(paths[0]).name}..{Path(paths[-1]).name} failed, scanning its pages one at a time: {e}", style="warning")
+                evaluations = [None] * len(paths)
+            with self._lock:
+                self.batches += len(images) > 1
+                for image_path, evaluation in zip(paths, evaluations):
+                    if evaluation is None:
+                        self.fallback_pages += 1
+                        continue
+                    self.batched_pages += 1
+                    self._results[(image_path, model.model)] = evaluation
+
+    def scan(self, pages: Iterable[str], models: List[Any]) -> Iterator[str]:
+        """Scan `pages` in batches on VISION_BATCH_WORKERS threads, yielding each page, in order, once its batch is done."""
+        if not self.enabled:
+            yield from pages
+            return
+
+        in_flight: Deque[Tuple[List[str], Optional[Future]]] = deque()
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+            for group in self.groups(pages, models):
+                scanned = [(path, image) for path, image in group if image is not None]
+                future = pool.submit(self._scan, scanned, models) if scanned else None
+                in_flight.append(([path for path, _ in group], future))
+                # Hand out finished pages right away, and wait once every worker is busy
+                while in_flight and (
+                    in_flight[0][1] is None or in_flight[0][1].done()
+                    or sum(f is not None and not f.done() for _, f in in_flight) >= self.workers
+                ):
+                    paths, future = in_flight.popleft()
+                    if future is not None:
+                        future.result()
+                    yield from paths
+            while in_flight:
+                paths, future = in_flight.popleft()
+                if future is not None:
+                    future.result()
+                yield from paths
+
+    def take(self, image_path: str, model_name: str) -> Optional[Evaluation]:
+        """Remove and return the batched evaluation of a page, if its batch produced one."""
+        with self._lock:
+            return self._results.pop((str(image_path), model_name), None)
+
+    def report(self) -> None:
+        if not self.enabled:
+            return
+        self.console.print(
+            f"Batched scan: {self.batched_pages} pages in {self.batches} requests, "
+            f"{self.fallback_pages} pages left to single-page scans",
+            style="system"
+        )
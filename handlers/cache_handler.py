@@ -0,0 +1,369 @@
+from langchain_core.embeddings import Embeddings
+from config.log_config import LoggingConfig
+from config.redis_config import get_redis_manager
+from schemas.models import Evaluation
+
+from redisvl.index import SearchIndex
+from redisvl.query import FilterQuery, VectorQuery
+from redisvl.query.filter import Tag
+from collections import OrderedDict
+from dotenv import load_dotenv
+from pathlib import Path
+from pydantic import ValidationError
+from typing import Any, List, Optional, Union
+import numpy as np
+import threading
+import tempfile
+import hashlib
+import os
+
+load_dotenv()
+
+
+class IngestCache:
+    """Content-addressed cache of page evaluations, stored next to the JSON dumps and in Redis.
+
+    Entries are keyed by the hash of the preprocessed image bytes, the prompt version and the model
+    name, so a page is only sent to the vision model again when one of those changes.
+    """
+
+    def __init__(self, prompt_version: str, prefix: str = "ingest_cache"):
+        self.console = LoggingConfig().console
+        self.prompt_version = prompt_version
+        self.prefix = prefix
+        self.enabled = os.getenv("INGEST_CACHE", "1") != "0"
+        ttl = os.getenv("INGEST_CACHE_TTL")
+        self.ttl = int(ttl) if ttl else None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, image: bytes, model_name: str) -> str:
+        """Hash of the image bytes sent to the model, the prompt version and the model name."""
+        digest = hashlib.sha256(image)
+        digest.update(f"|{self.prompt_version}|{model_name}".encode())
+        return digest.hexdigest()
+
+    def _local_path(self, image_path: str, key: str) -> Path:
+        return Path(image_path).parent / "json" / ".cache" / f"{key}.json"
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _decode(self, cached: Union[str, bytes], source: str) -> Optional[Evaluation]:
+        """Parse a cached evaluation; an unreadable one (e.g. cut short by a killed run) is a miss."""
+        try:
+            return Evaluation.model_validate_json(cached)
+        except ValidationError as e:
+            self.console.print(f"⚠️ Dropping unreadable ingest cache entry {source}: {e.errors()[0]['msg']}", style="warning")
+            return None
+
+    def get(self, key: str, image_path: str) -> Optional[Evaluation]:
+        """Return the evaluation stored under `key`, if any."""
+        if not self.enabled:
+            return None
+
+        local_path = self._local_path(image_path, key)
+        if local_path.exists():
+            evaluation = self._decode(local_path.read_bytes(), str(local_path))
+            if evaluation is not None:
+                self._count(True)
+                return evaluation
+            local_path.unlink(missing_ok=True)
+
+        client = None
+        try:
+            client = get_redis_manager().client
+            cached = client.get(f"{self.prefix}:{key}")
+        except Exception as e:
+            self.console.print(f"Ingest cache lookup failed, scanning instead: {e}", style="warning")
+            cached = None
+        evaluation = self._decode(cached, f"{self.prefix}:{key}") if cached is not None else None
+        if evaluation is None:
+            if cached is not None:
+                try:
+                    client.delete(f"{self.prefix}:{key}")
+                except Exception:
+                    pass
+            self._count(False)
+            return None
+
+        self._write_local(local_path, evaluation)
+        self._count(True)
+        return evaluation
+
+    def has(self, key: str, image_path: str) -> bool:
+        """Tell whether an evaluation is stored under `key`, without counting a lookup."""
+        if not self.enabled:
+            return False
+        if self._local_path(image_path, key).exists():
+            return True
+        try:
+            return bool(get_redis_manager().client.exists(f"{self.prefix}:{key}"))
+        except Exception:
+            return False
+
+    def set(self, key: str, image_path: str, evaluation: Evaluation) -> None:
+        """Store an evaluation in both tiers."""
+        if not self.enabled:
+            return
+        self._write_local(self._local_path(image_path, key), evaluation)
+        try:
+            get_redis_manager().client.set(f"{self.prefix}:{key}", evaluation.model_dump_json(), ex=self.ttl)
+        except Exception as e:
+            self.console.print(f"Ingest cache write failed: {e}", style="warning")
+
+    def _write_local(self, path: Path, evaluation: Evaluation) -> None:
+        """Write through a temporary file renamed into place, so a killed run never leaves half an entry."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as file:
+                file.write(evaluation.model_dump_json())
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def report(self) -> None:
+        if not self.enabled:
+            return
+        stats = self.stats()
+        self.console.print(
+            f"Ingest cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate)",
+            style="system"
+        )
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper caching query vectors in an in-process LRU and in Redis.
+
+    Queries are keyed by their normalized text and the embedding model, so repeated
+    questions skip the embedding round trip. Document embeddings are not cached.
+    """
+
+    def __init__(self, embeddings: Any, prefix: str = "embedding_cache"):
+        self.console = LoggingConfig().console
+        self.embeddings = embeddings
+        self.prefix = prefix
+        self.max_size = int(os.getenv("EMBEDDING_CACHE_SIZE", "1024"))
+        self.ttl = int(os.getenv("EMBEDDING_CACHE_TTL", "86400"))
+        self._lru: OrderedDict[str, List[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @property
+    def model_name(self) -> str:
+        # Read on use, since the embeddings model may only be loaded on its first call
+        return getattr(self.embeddings, "model", type(self.embeddings).__name__)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.lower().split())
+
+    def _key(self, text: str) -> str:
+        digest = hashlib.sha256(self.normalize(text).encode()).hexdigest()
+        return f"{self.prefix}:{self.model_name}:{digest}"
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        with self._lock:
+            self._lru[key] = vector
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_size:
+                self._lru.popitem(last=False)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        """Return the query vector from memory, then Redis, then the embeddings model."""
+        key = self._key(text)
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+                self.memory_hits += 1
+                return vector
+
+        client = get_redis_manager().client
+        try:
+            cached = client.get(key)
+        except Exception as e:
+            self.console.print(f"Embedding cache lookup failed: {e}", style="warning")
+            cached = None
+        if cached is not None:
+            vector = np.frombuffer(cached, dtype=np.float32).tolist()
+            self._remember(key, vector)
+            with self._lock:
+                self.redis_hits += 1
+            return vector
+
+        vector = self.embeddings.embed_query(text)
+        self._remember(key, vector)
+        with self._lock:
+            self.misses += 1
+        try:
+            client.set(key, np.asarray(vector, dtype=np.float32).tobytes(), ex=self.ttl)
+        except Exception as e:
+            self.console.print(f"Embedding cache write failed: {e}", style="warning")
+        return vector
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.redis_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.redis_hits) / lookups if lookups else 0.0,
+        }
+
+    def report(self) -> None:
+        stats = self.stats()
+        self.console.print(
+            f"Embedding cache: {stats['memory_hits']} memory hits, {stats['redis_hits']} Redis hits, "
+            f"{stats['misses']} misses ({stats['hit_rate']:.1%} hit rate)",
+            style="system"
+        )
+
+
+class AnswerCache:
+    """Opt-in semantic cache of final answers, kept in its own Redis vector index.
+
+    An answer is reused when a new query is similar enough to a cached one and the
+    retrieval returned exactly the same pages. Entries are dropped whenever one of
+    those pages is re-ingested or deleted, whether or not the process writing the
+    pages uses the cache itself.
+    """
+
+    def __init__(self, index_name: str = "answer_cache"):
+        self.console = LoggingConfig().console
+        self.enabled = os.getenv("ANSWER_CACHE", "0") == "1"
+        self.threshold = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+        ttl = os.getenv("ANSWER_CACHE_TTL")
+        self.ttl = int(ttl) if ttl else None
+        self.index_name = index_name
+        self._index: Optional[SearchIndex] = None
+        self._created = False
+        # Only a found index is remembered: a chat process may create it at any time
+        self._exists = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_index(self, create: bool = True) -> SearchIndex:
+        """Return the cache index, creating it in Redis on first write or lookup."""
+        with self._lock:
+            if self._index is None:
+                manager = get_redis_manager()
+                self._index = SearchIndex.from_dict({
+                    "index": {"name": self.index_name, "prefix": self.index_name, "storage_type": "hash"},
+                    "fields": [
+                        {"name": "doc_ids", "type": "tag", "attrs": {"separator": ","}},
+                        {"name": "context", "type": "tag"},
+                        {"name": "embedding", "type": "vector", "attrs": {
+                            "dims": manager.embedding_dimensions,
+                            "distance_metric": "cosine",
+                            "algorithm": "flat",
+                            "datatype": "float32",
+                        }},
+                    ],
+                }, redis_client=manager.client)
+            if create and not self._created:
+                self._index.create(overwrite=False)
+                self._created = self._exists = True
+        return self._index
+
+    def exists(self) -> bool:
+        """Tell whether the cache index exists in Redis, asking again until it does."""
+        if not self._exists:
+            self._exists = self._get_index(create=False).exists()
+        return self._exists
+
+    @staticmethod
+    def context_key(doc_ids: List[str]) -> str:
+        """Order-independent fingerprint of the retrieved pages."""
+        return hashlib.sha256("\n".join(sorted(doc_ids)).encode()).hexdigest()
+
+    def lookup(self, vector: List[float], doc_ids: List[str]) -> Optional[str]:
+        """Return a cached answer for a similar query over the same pages, if any."""
+        if not self.enabled or not doc_ids:
+            return None
+        query = VectorQuery(
+            vector=vector,
+            vector_field_name="embedding",
+            return_fields=["answer"],
+            filter_expression=Tag("context") == self.context_key(doc_ids),
+            num_results=1,
+        )
+        try:
+            results = self._get_index().query(query)
+        except Exception as e:
+            self.console.print(f"Answer cache lookup failed: {e}", style="warning")
+            results = []
+        # Cosine distance is 1 - similarity
+        if results and 1 - float(results[0]["vector_distance"]) >= self.threshold:
+            self.hits += 1
+            return results[0]["answer"]
+        self.misses += 1
+        return None
+
+    def store(self, vector: List[float], doc_ids: List[str], query: str, answer: str) -> None:
+        if not self.enabled or not doc_ids:
+            return
+        try:
+            self._get_index().load([{
+                "query": query,
+                "answer": answer,
+                "doc_ids": ",".join(doc_ids),
+                "context": self.context_key(doc_ids),
+                "embedding": np.asarray(vector, dtype=np.float32).tobytes(),
+            }], ttl=self.ttl)
+        except Exception as e:
+            self.console.print(f"Answer cache write failed: {e}", style="warning")
+
+    def invalidate(self, doc_ids: List[str]) -> int:
+        """Drop every cached answer built on any of the given pages, even with ANSWER_CACHE off in this process.
+
+        Failures are only reported: the pages are already stored, and stale answers expire with ANSWER_CACHE_TTL.
+        """
+        if not doc_ids:
+            return 0
+        query = FilterQuery(
+            filter_expression=Tag("doc_ids") == list(doc_ids),
+            return_fields=["id"],
+            num_results=1000,
+        )
+        deleted = 0
+        try:
+            if not self.exists():
+                return 0
+            index = self._get_index(create=False)
+            while results := index.query(query):
+                dropped = index.drop_keys([result["id"] for result in results])
+                if not dropped:
+                    break
+                deleted += dropped
+        except Exception as e:
+            self.console.print(f"Answer cache invalidation failed: {e}", style="warning")
+        return deleted
+
+    def report(self) -> None:
+        if not self.enabled:
+            return
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0.0
+        self.console.print(f"Answer cache: {self.hits} hits, {self.misses} misses ({rate:.1%} hit rate)", style="system")
@@ -0,0 +1,65 @@
+from langchain_redis import RedisVectorStore
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from config.redis_config import DEFAULT_COLLECTION, Collection, get_collection
+from config.log_config import LoggingConfig
+from schemas.models import Evaluation
+
+from redisvl.query import FilterQuery
+from redisvl.query.filter import Tag
+from dotenv import load_dotenv
+from typing import Any, Dict, List, Optional, Tuple
+import os
+
+load_dotenv()
+
+CHUNK_FIELDS = ("translation", "transcription", "keywords")
+
+
+class PageChunker:
+    """Splits page evaluations into field-level chunks, with overlapping windows for long fields,
+    and stores them in the chunk index of a collection, each linked to its page by `book_id` and `image_id`."""
+
+    def __init__(self, collection: Optional[Collection] = None):
+        self.console = LoggingConfig().console
+        self.collection = collection or get_collection(DEFAULT_COLLECTION)
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=int(os.getenv("CHUNK_SIZE", "1000")),
+            chunk_overlap=int(os.getenv("CHUNK_OVERLAP", "200")),
+        )
+
+    @property
+    def vectorstore(self) -> RedisVectorStore:
+        return self.collection.chunk_vectorstore()
+
+    def chunks(self, evaluation: Evaluation, book_id: str, image_id: str) -> List[Tuple[str, Dict[str, Any], str]]:
+        """Return the (text, metadata, id) of every chunk of a page."""
+        chunks = []
+        for field in CHUNK_FIELDS:
+            value = getattr(evaluation, field)
+            text = ", ".join(value) if isinstance(value, list) else value
+            for n, piece in enumerate(self.splitter.split_text(text)):
+                metadata = {"book_id": book_id, "image_id": image_id, "field": field, "chunk": n}
+                chunks.append((piece, metadata, f"{book_id}:{image_id}:{field}:{n}"))
+        return chunks
+
+    def delete(self, book_id: str, image_id: str) -> None:
+        """Remove the chunks of a page, so a shorter re-scan leaves no stale windows behind."""
+        index = self.vectorstore.index
+        query = FilterQuery(
+            filter_expression=(Tag("book_id") == book_id) & (Tag("image_id") == image_id),
+            return_fields=["id"],
+            num_results=1000,
+        )
+        while True:
+            keys = [result["id"] for result in index.query(query)]
+            if not keys or not index.drop_keys(keys):
+                return
+
+    def store(self, evaluation: Evaluation, book_id: str, image_id: str) -> int:
+        """Replace the chunks of a page; all of them are embedded in one batched call."""
+        chunks = self.chunks(evaluation, book_id, image_id)
+        self.delete(book_id, image_id)
+        if chunks:
+            texts, metadatas, ids = zip(*chunks)
+            self.vectorstore.add_texts(list(texts), metadatas=list(metadatas), ids=list(ids))
+        return len(chunks)
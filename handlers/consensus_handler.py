@@ -0,0 +1,59 @@
+from schemas.models import Evaluation
+
+from difflib import SequenceMatcher
+from typing import List, Optional
+
+
+class ConsensusHandler:
+    """Merges the evaluations of one page by several models into one.
+
+    The transcription and the translation are the ones agreeing most with the other models'
+    (the medoid by word-level similarity), and the keywords are the union of all of them.
+    """
+
+    @staticmethod
+    def similarity(a: str, b: str) -> float:
+        return SequenceMatcher(None, a.split(), b.split(), autojunk=False).ratio()
+
+    def best(self, texts: List[str]) -> str:
+        """The text with the highest mean similarity to the others; ties go to the earlier model."""
+        if len(texts) < 3:
+            # Two texts agree with each other equally, so keep the primary model's
+            return texts[0]
+        scores = [
+            sum(self.similarity(text, other) for j, other in enumerate(texts) if j != i)
+            for i, text in enumerate(texts)
+        ]
+        return texts[max(range(len(texts)), key=lambda i: (scores[i], -i))]
+
+    @staticmethod
+    def keywords(evaluations: List[Evaluation]) -> List[str]:
+        seen, merged = set(), []
+        for evaluation in evaluations:
+            for keyword in evaluation.keywords:
+                if keyword.lower() not in seen:
+                    seen.add(keyword.lower())
+                    merged.append(keyword)
+        return merged
+
+    @staticmethod
+    def latest(evaluations: List[Evaluation], models: Optional[List[str]] = None) -> List[Evaluation]:
+        """The last evaluation of every model, in the order of `models` if given (others last)."""
+        latest = {}
+        for evaluation in reversed(evaluations):
+            latest.setdefault(evaluation.model, evaluation)
+        order = {name: n for n, name in enumerate(models or [])}
+        return sorted(reversed(list(latest.values())), key=lambda e: order.get(e.model, len(order)))
+
+    def merge(self, evaluations: List[Evaluation]) -> Evaluation:
+        if len(evaluations) == 1:
+            return evaluations[0]
+        # Empty answers (e.g. a model that missed the text) never win the vote
+        transcriptions = [e.transcription for e in evaluations if e.transcription.strip()] or [""]
+        translations = [e.translation for e in evaluations if e.translation.strip()] or [""]
+        return Evaluation(
+            model=", ".join(dict.fromkeys(e.model for e in evaluations)),
+            transcription=self.best(transcriptions),
+            translation=self.best(translations),
+            keywords=self.keywords(evaluations),
+        )
@@ -0,0 +1,143 @@
+from langchain_core.documents import Document
+from langchain_redis import RedisVectorStore
+from config.redis_config import DEFAULT_COLLECTION, get_collections
+from config.log_config import LoggingConfig
+from handlers.history_handler import estimate_tokens
+from handlers.retrieval_handler import stored_vectors
+
+from dotenv import load_dotenv
+from typing import Dict, List, Optional
+import numpy as np
+import os
+import re
+
+load_dotenv()
+
+FIELD = re.compile(r"^(Model|Transcription|Translation|Keywords):\s*", re.MULTILINE)
+SENTENCE = re.compile(r"(?<=[.!?;])\s+|\n+")
+TERM = re.compile(r"\w{3,}")
+
+
+class ContextPacker:
+    """Turns over-fetched retrieval candidates into a small prompt context.
+
+    Candidates are diversified with maximal marginal relevance on their stored vectors,
+    near-duplicate pages are dropped, and each kept page is cut down to the sentences that
+    share the most terms with the query, within a token budget. The page metadata, and so
+    the `[book / image]` citations, are left untouched.
+    """
+
+    def __init__(self, vectorstore: Optional[RedisVectorStore] = None):
+        self.console = LoggingConfig().console
+        # Store of the candidates not tagged with the collection they were found in; the default collection's if None
+        self.vectorstore = vectorstore
+        self.candidates = int(os.getenv("CONTEXT_CANDIDATES", "20"))
+        self.token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+        self.mmr_lambda = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+        self.duplicate_threshold = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.97"))
+
+    def stored_vectors(self, docs: List[Document]) -> List[Optional[np.ndarray]]:
+        """Read the vectors of the candidate pages, from the collection each one was found in."""
+        collections = get_collections()
+        groups: Dict[Optional[str], List[int]] = {}
+        for i, doc in enumerate(docs):
+            groups.setdefault(doc.metadata.get("collection"), []).append(i)
+        vectors: List[Optional[np.ndarray]] = [None] * len(docs)
+        for name, positions in groups.items():
+            if name in collections:
+                vectorstore = collections[name].vectorstore()
+            else:
+                vectorstore = self.vectorstore or collections[DEFAULT_COLLECTION].vectorstore()
+            for i, vector in zip(positions, stored_vectors(vectorstore, [docs[i] for i in positions])):
+                vectors[i] = vector
+        return vectors
+
+    def select(self, query_vector: List[float], docs: List[Document], k: int) -> List[Document]:
+        """Pick `k` relevant but diverse pages with MMR, skipping near-duplicates of picked ones."""
+        try:
+            vectors = self.stored_vectors(docs)
+        except Exception as e:
+            self.console.print(f"⚠️ Could not read stored vectors, keeping the retrieval order: {e}", style="warning")
+            return docs[:k]
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        # Pages without a stored vector keep a relevance derived from their retrieval rank
+        relevance = [float(v @ query) if v is not None else 1.0 - rank / len(docs) for rank, v in enumerate(vectors)]
+
+        selected: List[int] = []
+        remaining = list(range(len(docs)))
+        while remaining and len(selected) < k:
+            best, best_score = None, -np.inf
+            for i in list(remaining):
+                similarity = max(
+                    (float(vectors[i] @ vectors[j]) for j in selected if vectors[i] is not None and vectors[j] is not None),
+                    default=0.0,
+                )
+                if similarity >= self.duplicate_threshold:
+                    remaining.remove(i)
+                    continue
+                score = self.mmr_lambda * relevance[i] - (1 - self.mmr_lambda) * similarity
+                if score > best_score:
+                    best, best_score = i, score
+            if best is None:
+                break
+            selected.append(best)
+            remaining.remove(best)
+        return [docs[i] for i in selected]
+
+    @staticmethod
+    def fields(content: str) -> Dict[str, str]:
+        """Split a stored page into its Model / Transcription / Translation / Keywords fields."""
+        parts = FIELD.split(content)
+        return {name: value.strip() for name, value in zip(parts[1::2], parts[2::2])}
+
+    def excerpt(self, query: str, content: str, budget: int) -> str:
+        """Keep the keywords and the sentences sharing most terms with the query, in their original order."""
+        fields = self.fields(content)
+        if not fields:
+            return content[:budget * 4]
+
+        lines = []
+        if fields.get("Keywords"):
+            lines.append(f"Keywords: {fields['Keywords']}")
+            budget -= estimate_tokens(lines[0])
+
+        terms = {term.lower() for term in TERM.findall(query)}
+        sentences = [
+            (field, sentence.strip())
+            for field in ("Translation", "Transcription")
+            for sentence in SENTENCE.split(fields.get(field, ""))
+            if sentence.strip()
+        ]
+        overlap = [len(terms & {term.lower() for term in TERM.findall(sentence)}) for _, sentence in sentences]
+        # Most query terms first; the translation before the transcription, then page order.
+        # Pages that match the query only through their vector keep their opening sentences.
+        scored = sorted(range(len(sentences)), key=lambda i: (-overlap[i], i))
+        if any(overlap):
+            scored = [i for i in scored if overlap[i]]
+
+        kept = set()
+        for i in scored:
+            cost = estimate_tokens(sentences[i][1])
+            if cost > budget:
+                continue
+            kept.add(i)
+            budget -= cost
+
+        for field in ("Translation", "Transcription"):
+            text = " ".join(sentence for i, (name, sentence) in enumerate(sentences) if name == field and i in kept)
+            if text:
+                lines.append(f"{field}: {text}")
+        return "\n".join(lines)
+
+    def pack(self, query: str, query_vector: List[float], docs: List[Document], k: int) -> List[Document]:
+        """Return at most `k` diverse pages, each cut down to its share of the token budget."""
+        selected = self.select(query_vector, docs, k)
+        if not selected:
+            return []
+        budget = self.token_budget // len(selected)
+        return [
+            Document(page_content=self.excerpt(query, doc.page_content, budget), metadata=doc.metadata)
+            for doc in selected
+        ]
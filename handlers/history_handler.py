@@ -0,0 +1,77 @@
+from config.log_config import LoggingConfig
+
+from dotenv import load_dotenv
+from typing import Awaitable, Callable, List, Optional, Tuple
+import asyncio
+import os
+
+load_dotenv()
+
+Exchange = Tuple[str, str]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token), good enough for budgeting."""
+    return len(text) // 4 + 1
+
+
+class ConversationHistory:
+    """Chat memory with a roughly constant size: the last exchanges verbatim, older ones in a rolling digest.
+
+    Only the questions and answers are kept; the retrieved excerpts injected into each turn's
+    system prompt are dropped, since every turn retrieves its own. Evicted exchanges are merged
+    into the digest by `summarize(digest, exchanges)` in the background, while the user reads the answer.
+    """
+
+    def __init__(self, summarize: Callable[[str, List[Exchange]], Awaitable[str]], keep_turns: Optional[int] = None, token_budget: Optional[int] = None):
+        self.console = LoggingConfig().console
+        self.summarize = summarize
+        self.keep_turns = keep_turns or int(os.getenv("HISTORY_TURNS", "3"))
+        self.token_budget = token_budget or int(os.getenv("HISTORY_TOKEN_BUDGET", "8000"))
+        self.digest_tokens = int(os.getenv("HISTORY_DIGEST_TOKENS", "500"))
+        self.digest = ""
+        self.exchanges: List[Exchange] = []
+        self._evicted: List[Exchange] = []
+        self._compaction: Optional[asyncio.Task] = None
+
+    def add(self, user: str, assistant: str) -> None:
+        """Record an exchange, moving the ones beyond the last `keep_turns` to the digest."""
+        self.exchanges.append((user, assistant))
+        if len(self.exchanges) > self.keep_turns:
+            self._evicted.extend(self.exchanges[:-self.keep_turns])
+            self.exchanges = self.exchanges[-self.keep_turns:]
+            if self._compaction is None or self._compaction.done():
+                self._compaction = asyncio.create_task(self._compact())
+
+    async def _compact(self) -> None:
+        while self._evicted:
+            evicted, self._evicted = self._evicted, []
+            try:
+                self.digest = await self.summarize(self.digest, evicted)
+            except Exception as e:
+                self.console.print(f"⚠️ History digest failed, keeping the questions only: {e}", style="warning")
+                self.digest = "\n".join([self.digest] + [f"- {user}" for user, _ in evicted]).strip()
+            # Keep the most recent part of an oversized digest
+            self.digest = self.digest[-self.digest_tokens * 4:]
+
+    async def messages(self, new_messages: List[dict]) -> List[dict]:
+        """Return the history to send before `new_messages`, within the token budget.
+
+        The newest exchanges are kept first; the digest comes before them if it still fits.
+        """
+        if self._compaction is not None:
+            await self._compaction
+
+        budget = self.token_budget - sum(estimate_tokens(message["content"]) for message in new_messages)
+        turns: List[dict] = []
+        for user, assistant in reversed(self.exchanges):
+            cost = estimate_tokens(user) + estimate_tokens(assistant)
+            if cost > budget:
+                break
+            budget -= cost
+            turns[:0] = [{"role": "user", "content": user}, {"role": "assistant", "content": assistant}]
+
+        history = turns
+        if self.digest and estimate_tokens(self.digest) <= budget:
+            history = [{"role": "system", "content": f"Summary of the earlier conversation:\n{self.digest}"}] + turns
+        return history + new_messages
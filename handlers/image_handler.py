@@ -0,0 +1,171 @@
+from config.log_config import LoggingConfig
+from config.metrics import metrics
+
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+from rich.table import Table
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import threading
+import base64
+import io
+import os
+
+load_dotenv()
+
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
+@dataclass
+class PreparedImage:
+    """Page image as sent to the vision model, with the numbers of the payload report."""
+    data: bytes
+    mime_type: str
+    size: Tuple[int, int]
+    original_size: Tuple[int, int]
+    original_bytes: int
+    seconds: float
+    ink: float = 0.0
+    blank: bool = False
+
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{base64.b64encode(self.data).decode()}"
+
+
+@dataclass
+class PageReport:
+    size: Tuple[int, int]
+    original_size: Tuple[int, int]
+    original_bytes: int
+    sent_bytes: int
+    seconds: float
+    blank: bool
+
+
+class ImagePreprocessor:
+    """Downscales, optionally grayscales and recompresses page images before the vision call.
+
+    Rasterized PDF pages are prepared right away and kept in memory until their page is done,
+    while images of a folder are prepared from disk on first use. With IMAGE_SKIP_BLANK=1, pages
+    with almost no ink are flagged as blank so the vision call can be skipped.
+    """
+
+    def __init__(self):
+        self.console = LoggingConfig().console
+        self.enabled = os.getenv("IMAGE_PREPROCESS", "1") != "0"
+        self.max_dimension = int(os.getenv("IMAGE_MAX_DIMENSION", "2048"))
+        self.grayscale = os.getenv("IMAGE_GRAYSCALE", "0") == "1"
+        self.format = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+        self.quality = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+        self.skip_blank = os.getenv("IMAGE_SKIP_BLANK", "0") == "1"
+        self.blank_ink = float(os.getenv("IMAGE_BLANK_INK", "0.002"))
+        if self.format not in MIME_TYPES:
+            raise ValueError(f"Unsupported IMAGE_FORMAT: {self.format}. Supported formats: {', '.join(MIME_TYPES)}")
+        self._buffers: Dict[str, PreparedImage] = {}
+        # Only the numbers of the report are kept for every page, so memory stays flat over a book
+        self._pages: List[Tuple[str, PageReport]] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def ink(image: Image.Image) -> float:
+        """Share of the pixels of a small grayscale copy that differ from the background."""
+        thumbnail = image.convert("L")
+        thumbnail.thumbnail((512, 512))
+        pixels = np.asarray(thumbnail, dtype=np.int16)
+        return float((np.abs(pixels - np.median(pixels)) > 32).mean())
+
+    @staticmethod
+    def estimated_size(image: Image.Image) -> int:
+        """Approximate size of the image as a JPEG at the default quality, i.e. what was uploaded before preprocessing.
+
+        Estimated at about 10:1 of the RGB pixels, since encoding every page a second time just for the report
+        would cost as much as preprocessing it.
+        """
+        width, height = image.size
+        return width * height * 3 // 10
+
+    def prepare(self, image: Image.Image, original_bytes: int, raw: Optional[bytes] = None) -> PreparedImage:
+        """Encode `image` for the vision model; `raw` (the source file) is sent as is when preprocessing is off."""
+        with metrics.timer("preprocess", span=False) as timer:
+            original_size = image.size
+            # Also sizes pages for batched scans, so it is measured even without blank detection
+            ink = self.ink(image)
+            blank = self.skip_blank and ink < self.blank_ink
+            if not self.enabled and raw is not None:
+                data, mime_type = raw, Image.MIME.get(image.format or "", "image/jpeg")
+            else:
+                image = ImageOps.exif_transpose(image)
+                image = image.convert("L" if self.grayscale else "RGB")
+                if self.enabled and self.max_dimension and max(image.size) > self.max_dimension:
+                    image.thumbnail((self.max_dimension, self.max_dimension), Image.LANCZOS)
+                buffer = io.BytesIO()
+                if not self.enabled:
+                    image.save(buffer, "JPEG")
+                    mime_type = MIME_TYPES["JPEG"]
+                else:
+                    image.save(buffer, self.format, quality=self.quality, optimize=True)
+                    mime_type = MIME_TYPES[self.format]
+                data = buffer.getvalue()
+        metrics.increment("image_bytes_total", original_bytes, stage="original")
+        metrics.increment("image_bytes_total", len(data), stage="sent")
+        return PreparedImage(data, mime_type, image.size, original_size, original_bytes, timer.duration, ink, blank)
+
+    def _remember(self, image_path: str, prepared: PreparedImage) -> PreparedImage:
+        with self._lock:
+            self._buffers[image_path] = prepared
+            self._pages.append((Path(image_path).name, PageReport(
+                prepared.size, prepared.original_size, prepared.original_bytes, len(prepared.data), prepared.seconds, prepared.blank
+            )))
+        return prepared
+
+    def add(self, image_path: str, image: Image.Image, original_bytes: Optional[int] = None) -> PreparedImage:
+        """Prepare an in-memory page (e.g. a rasterized PDF page) and keep it until `release`."""
+        if original_bytes is None:
+            original_bytes = self.estimated_size(image)
+        return self._remember(image_path, self.prepare(image, original_bytes))
+
+    def load(self, image_path: str) -> PreparedImage:
+        """Return the prepared page, preparing it from disk if it is not in memory yet."""
+        with self._lock:
+            prepared = self._buffers.get(image_path)
+        if prepared is not None:
+            return prepared
+        raw = Path(image_path).read_bytes()
+        with Image.open(io.BytesIO(raw)) as image:
+            return self._remember(image_path, self.prepare(image, len(raw), raw))
+
+    def release(self, image_path: str) -> None:
+        """Drop the in-memory copy of a finished page."""
+        with self._lock:
+            self._buffers.pop(image_path, None)
+
+    def report(self) -> None:
+        """Print the payload and preparation time of every page, before and after preprocessing."""
+        with self._lock:
+            pages = list(self._pages)
+        if not pages:
+            return
+        table = Table(title="Image preprocessing")
+        for column in ("page", "original", "sent", "original KB", "sent KB", "ms", "blank"):
+            table.add_column(column)
+        for name, page in pages:
+            table.add_row(
+                name,
+                "x".join(map(str, page.original_size)),
+                "x".join(map(str, page.size)),
+                f"{page.original_bytes / 1024:.0f}",
+                f"{page.sent_bytes / 1024:.0f}",
+                f"{page.seconds * 1000:.0f}",
+                "yes" if page.blank else "",
+            )
+        original = sum(page.original_bytes for _, page in pages)
+        sent = sum(page.sent_bytes for _, page in pages)
+        table.add_row(
+            f"total ({len(pages)})", "", "", f"{original / 1024:.0f}", f"{sent / 1024:.0f}",
+            f"{sum(page.seconds for _, page in pages) * 1000:.0f}", str(sum(page.blank for _, page in pages)),
+        )
+        self.console.print(table)
+        if original:
+            self.console.print(f"Upload size: {original / 1024:.0f} KB → {sent / 1024:.0f} KB ({sent / original - 1:+.1%})", style="system")
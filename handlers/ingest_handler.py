@@ -0,0 +1,334 @@
+from config.log_config import LoggingConfig
+from config.metrics import metrics
+from handlers.image_handler import ImagePreprocessor
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from collections import deque
+from dotenv import load_dotenv
+from rich.panel import Panel
+from pathlib import Path
+from typing import Any, Deque, Iterable, Iterator, List, Optional, Tuple
+import threading
+import asyncio
+import queue
+import time
+import os
+
+load_dotenv()
+
+# The graph stops before this node until the page feedback is given
+FEEDBACK_NODE = "human_feedback_node"
+# In review mode, the graph also stops before this node, which stores the page, until the page is approved
+COMMIT_NODE = "evaluation_summary"
+
+
+class IngestHandler:
+    """Runs the evaluation graph over the pages of a book, one page after another or concurrently.
+
+    Pages left unfinished by an earlier run are resumed from their last checkpoint (with a durable
+    CHECKPOINTER), and the checkpoints of finished pages are deleted unless CHECKPOINT_PRUNE=0.
+    """
+
+    def __init__(self, graph: Any, book_name: str, models: List[Any], feedback: bool = False, concurrency: int = 1,
+                 preprocessor: Optional[ImagePreprocessor] = None):
+        self.console = LoggingConfig().console
+        # In-memory page images are released once their page is done
+        self.preprocessor = preprocessor
+        self.graph = graph
+        self.book_name = book_name
+        self.models = models
+        self.prune = os.getenv("CHECKPOINT_PRUNE", "1") != "0"
+        self.feedback = feedback
+        self.concurrency = max(1, concurrency)
+        self.total: Optional[int] = None
+        self.done = 0
+        self.failed = 0
+        self.start_time = time.monotonic()
+
+    def thread(self, image_path: str) -> dict:
+        """One checkpointer thread per page."""
+        return {"configurable": {"thread_id": f"{self.book_name}:{Path(image_path).stem}"}}
+
+    def initial_state(self, image_path: str) -> dict:
+        return {
+            "evaluations": [],
+            "model": self.models[0].model,
+            "input_image": str(image_path),
+            "human_feedback": ""
+        }
+
+    def _resume_point(self, thread: dict, snapshot: Any) -> Tuple[str, ...]:
+        """Nodes an interrupted page still has to run; empty for a page to start from scratch."""
+        if snapshot.next:
+            self.console.print(f"Resuming {thread['configurable']['thread_id']} at {', '.join(dict.fromkeys(snapshot.next))}", style="info")
+        return tuple(snapshot.next)
+
+    def _finished(self, snapshot: Any) -> bool:
+        """Whether the checkpoint of a thread is a page finished by an earlier run, to be started over."""
+        return bool(snapshot.values) and not snapshot.next
+
+    @contextmanager
+    def _page(self, image_path: str, release: bool = True) -> Iterator[None]:
+        """Root span of a page; node, vision, embeddings and Redis time add up in its breakdown."""
+        try:
+            with metrics.timer("page", book=self.book_name) as span:
+                # On the span only, so the page histogram keeps one series per book
+                span.labels["page"] = Path(image_path).name
+                yield
+        finally:
+            # Drafts under review keep their image, which a re-scan still needs
+            if release and self.preprocessor is not None:
+                self.preprocessor.release(str(image_path))
+
+    def pages_per_minute(self) -> float:
+        elapsed = time.monotonic() - self.start_time
+        return self.done / elapsed * 60 if elapsed > 0 else 0.0
+
+    def _page_finished(self, image_path: str, started: float) -> None:
+        self.done += 1
+        total = f"/{self.total}" if self.total is not None else ""
+        self.console.print(
+            f"✅ [{self.done}{total}] {Path(image_path).name} done in {time.monotonic() - started:.1f}s "
+            f"({self.pages_per_minute():.1f} pages/min)",
+            style="info"
+        )
+
+    def _page_failed(self, image_path: str, error: Exception) -> None:
+        self.failed += 1
+        self.console.print(f"❌ Error processing {Path(image_path).name}: {error}", style="error")
+
+    def _report(self) -> None:
+        self.console.print(
+            f"Processed {self.done} pages ({self.failed} failed) at {self.pages_per_minute():.1f} pages/min",
+            style="system"
+        )
+
+    def _start(self, image_files: Iterable[str]) -> None:
+        self.total = len(image_files) if hasattr(image_files, "__len__") else None
+        self.done = 0
+        self.failed = 0
+        self.start_time = time.monotonic()
+
+    def run(self, image_files: Iterable[str]) -> None:
+        """Process pages one after another, printing every graph event."""
+        self._start(image_files)
+        for image_path in image_files:
+            self.console.rule(f"Processing {Path(image_path).name}", style="event")
+            started = time.monotonic()
+            try:
+                with self._page(image_path):
+                    thread = self.thread(image_path)
+                    snapshot = self.graph.get_state(thread)
+                    if self._finished(snapshot):
+                        self.graph.checkpointer.delete_thread(thread["configurable"]["thread_id"])
+                    pending = self._resume_point(thread, snapshot)
+
+                    if not pending:
+                        # Run graph verbose
+                        for event in self.graph.stream(self.initial_state(image_path), thread, stream_mode="values"):
+                            self.console.print(Panel.fit(str(event), title="📦 Event", border_style="event"))
+
+                    if pending in ((), (FEEDBACK_NODE,)):
+                        page_feedback = ""
+                        if self.feedback:
+                            page_feedback = self.console.input("[feedback]Insert feedback:[/feedback] ")
+                        self.graph.update_state(thread, {"human_feedback": page_feedback}, as_node=FEEDBACK_NODE)
+
+                    # Resume from feedback node, or from where an interrupted run stopped
+                    for event in self.graph.stream(None, thread, stream_mode="updates"):
+                        self.console.print(Panel.fit(str(event), title="📦 Event", border_style="event"))
+
+                    if self.prune:
+                        self.graph.checkpointer.delete_thread(thread["configurable"]["thread_id"])
+
+                self._page_finished(image_path, started)
+            except Exception as e:
+                self._page_failed(image_path, e)
+        self._report()
+
+    async def arun(self, image_files: Iterable[str]) -> None:
+        """Process up to `concurrency` pages at a time, reporting progress per page."""
+        self._start(image_files)
+        # Sync graph nodes run in the loop's default executor, which must fit every worker
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency + 4)
+        loop.set_default_executor(executor)
+        try:
+            await self._arun(image_files)
+        finally:
+            # Back to a default-sized executor, created as lazily as the loop's own, so the loop stays usable
+            loop.set_default_executor(ThreadPoolExecutor())
+            executor.shutdown(wait=False)
+        self._report()
+
+    async def _arun(self, image_files: Iterable[str]) -> None:
+        pages = iter(image_files)
+        pages_lock = asyncio.Lock()
+        feedback_lock = asyncio.Lock()
+
+        async def next_page():
+            # Pages may still be rendering, so wait for them off the event loop, one worker at a time
+            async with pages_lock:
+                return await asyncio.to_thread(next, pages, None)
+
+        async def worker():
+            while (image_path := await next_page()) is not None:
+                await self._aprocess_page(image_path, feedback_lock)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+    async def _aprocess_page(self, image_path: str, feedback_lock: asyncio.Lock) -> None:
+        started = time.monotonic()
+        try:
+            with self._page(image_path):
+                thread = self.thread(image_path)
+                snapshot = await self.graph.aget_state(thread)
+                if self._finished(snapshot):
+                    await self.graph.checkpointer.adelete_thread(thread["configurable"]["thread_id"])
+                pending = self._resume_point(thread, snapshot)
+
+                if not pending:
+                    async for _ in self.graph.astream(self.initial_state(image_path), thread, stream_mode="values"):
+                        pass
+
+                if pending in ((), (FEEDBACK_NODE,)):
+                    page_feedback = ""
+                    if self.feedback:
+                        # Operator prompts are serialized so concurrent pages never interleave on the console
+                        async with feedback_lock:
+                            page_feedback = await asyncio.to_thread(
+                                self.console.input, f"[feedback]Insert feedback for {Path(image_path).name}:[/feedback] "
+                            )
+                    await self.graph.aupdate_state(thread, {"human_feedback": page_feedback}, as_node=FEEDBACK_NODE)
+
+                async for _ in self.graph.astream(None, thread, stream_mode="updates"):
+                    pass
+
+                if self.prune:
+                    await self.graph.checkpointer.adelete_thread(thread["configurable"]["thread_id"])
+
+            self._page_finished(image_path, started)
+        except Exception as e:
+            self._page_failed(image_path, e)
+
+    def _draft(self, image_path: str, feedback: Optional[str] = None) -> Any:
+        """Scan a page up to its commit and return the merged evaluation; `feedback` re-scans a drafted page."""
+        with self._page(image_path, release=False):
+            thread = self.thread(image_path)
+            if feedback is not None:
+                self.graph.update_state(thread, {"human_feedback": feedback}, as_node=FEEDBACK_NODE)
+                pending: Tuple[str, ...] = ()
+            else:
+                snapshot = self.graph.get_state(thread)
+                if self._finished(snapshot):
+                    self.graph.checkpointer.delete_thread(thread["configurable"]["thread_id"])
+                pending = self._resume_point(thread, snapshot)
+                if not pending:
+                    for _ in self.graph.stream(self.initial_state(image_path), thread, stream_mode="values"):
+                        pass
+                if pending in ((), (FEEDBACK_NODE,)):
+                    self.graph.update_state(thread, {"human_feedback": ""}, as_node=FEEDBACK_NODE)
+            # A page drafted by an earlier run is already waiting before its commit
+            if pending != (COMMIT_NODE,):
+                for _ in self.graph.stream(None, thread, stream_mode="updates", interrupt_before=[COMMIT_NODE]):
+                    pass
+            return self.graph.get_state(thread).values["merged"]
+
+    def _commit(self, image_path: str) -> None:
+        """Store an approved page."""
+        with self._page(image_path):
+            thread = self.thread(image_path)
+            for _ in self.graph.stream(None, thread, stream_mode="updates"):
+                pass
+            if self.prune:
+                self.graph.checkpointer.delete_thread(thread["configurable"]["thread_id"])
+
+    def review(self, image_files: Iterable[str], ahead: int = 3) -> None:
+        """Let the operator review draft scans while the next `ahead` pages are scanned in the background.
+
+        An empty answer approves a page, which is then stored in the background; any other answer is
+        feedback, and the page is re-scanned with it and comes back for review once its new draft is
+        ready, while the operator goes on with the next pages.
+        """
+        self._start(image_files)
+        ahead = max(1, ahead)
+        upcoming: "queue.Queue[Optional[Tuple[str, Future]]]" = queue.Queue(maxsize=ahead)
+        rescans: Deque[Tuple[str, Future]] = deque()
+        commits: List[Tuple[str, Future]] = []
+        started = {}
+        waited = reading = 0.0
+        rescanned = 0
+
+        def flush_commits(wait: bool = False) -> None:
+            # Progress is only printed between prompts, so it never breaks into the operator's typing
+            for image_path, future in list(commits):
+                if wait or future.done():
+                    commits.remove((image_path, future))
+                    try:
+                        future.result()
+                        self._page_finished(image_path, started[image_path])
+                    except Exception as e:
+                        self._page_failed(image_path, e)
+
+        with ThreadPoolExecutor(max_workers=max(ahead, self.concurrency) + 1) as pool:
+            def produce():
+                try:
+                    for image_path in image_files:
+                        image_path = str(image_path)
+                        started[image_path] = time.monotonic()
+                        # Blocks while `ahead` drafts wait for the operator
+                        upcoming.put((image_path, pool.submit(self._draft, image_path)))
+                finally:
+                    upcoming.put(None)
+
+            threading.Thread(target=produce, name="review-drafts", daemon=True).start()
+            exhausted = False
+            while not exhausted or rescans:
+                # Re-scanned pages come back as soon as they are ready, the others in page order
+                item = next((rescan for rescan in rescans if rescan[1].done()), None)
+                if item is not None:
+                    rescans.remove(item)
+                elif exhausted:
+                    item = rescans.popleft()
+                else:
+                    item = upcoming.get()
+                    if item is None:
+                        exhausted = True
+                        continue
+
+                image_path, future = item
+                wait_started = time.monotonic()
+                try:
+                    evaluation = future.result()
+                except Exception as e:
+                    self._page_failed(image_path, e)
+                    if self.preprocessor is not None:
+                        self.preprocessor.release(image_path)
+                    continue
+                waited += time.monotonic() - wait_started
+                metrics.observe("review_wait_seconds", time.monotonic() - wait_started)
+
+                flush_commits()
+                self.console.print(Panel(
+                    f"[bold]Transcription[/bold]\n{evaluation.transcription}\n\n"
+                    f"[bold]Translation[/bold]\n{evaluation.translation}\n\n"
+                    f"[bold]Keywords[/bold]: {', '.join(evaluation.keywords)}",
+                    title=f"📝 {Path(image_path).name} ({evaluation.model})", border_style="event"
+                ))
+                read_started = time.monotonic()
+                page_feedback = self.console.input(f"[feedback]Feedback for {Path(image_path).name} (Enter to approve):[/feedback] ").strip()
+                reading += time.monotonic() - read_started
+
+                if page_feedback:
+                    rescanned += 1
+                    rescans.append((image_path, pool.submit(self._draft, image_path, page_feedback)))
+                else:
+                    commits.append((image_path, pool.submit(self._commit, image_path)))
+            flush_commits(wait=True)
+
+        self._report()
+        self.console.print(
+            f"Review: {rescanned} re-scans, {reading:.1f}s reading and {waited:.1f}s waiting for drafts",
+            style="system"
+        )
@@ -1,8 +1,15 @@
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import List
+from typing import Iterable, Iterator, List, Optional
 from config.log_config import LoggingConfig
-from pdf2image import convert_from_path
+from handlers.image_handler import ImagePreprocessor
+from pdf2image import convert_from_path, pdfinfo_from_path
+from dotenv import load_dotenv
+import threading
+import queue
+import os
+
+load_dotenv()
 
 console = LoggingConfig().console
 
@@ -17,7 +24,17 @@ class BaseHandler(ABC):
 
 class PDFHandler(BaseHandler):
     """Handler for PDF files."""   
-    def extract_content(self, source: Path) -> List[Path]:
+    def __init__(self, preprocessor: ImagePreprocessor):
+        super().__init__()
+        self.preprocessor = preprocessor
+        self.dpi = int(os.getenv("PDF_DPI", "200"))
+        # Pages go from the rasterizer to the vision request in memory; writing them out is optional
+        self.save_pages = os.getenv("PDF_SAVE_PAGES", "0") == "1"
+        self.thread_count = int(os.getenv("PDF_THREAD_COUNT", "2"))
+        # Pages rasterized per poppler call; bounds how many full-size images are in memory at once
+        self.chunk_pages = int(os.getenv("PDF_CHUNK_PAGES", str(self.thread_count)))
+
+    def extract_content(self, source: Path) -> Iterator[str]:
         self.console.print(f"Input PDF: {source}", style="info")
         
         if not source.exists():
@@ -27,17 +44,32 @@ class PDFHandler(BaseHandler):
         if not source.suffix.lower() == ".pdf":
             raise ValueError(f"Input is not a PDF file: {source}")
         
-        image_paths = self.pdf_to_images(source)
-        return image_paths
+        return self.pdf_to_images(source)
 
-    def pdf_to_images(self, source: Path) -> List[Path]:
-        images = convert_from_path(str(source))
-        image_paths = []
-        for i, img in enumerate(images):
-            img_path = f"{source.stem}/{source.stem}_page_{i+1}.jpg"
-            img.save(img_path, "JPEG")
-            image_paths.append(img_path)
-        return image_paths
+    def pdf_to_images(self, source: Path) -> Iterator[str]:
+        """Rasterize the PDF a few pages at a time, yielding each page path as soon as it is prepared.
+
+        Unless PDF_SAVE_PAGES=1 the path is only the page's name, and the image lives in the preprocessor.
+        """
+        page_count = pdfinfo_from_path(str(source))["Pages"]
+        for first_page in range(1, page_count + 1, self.chunk_pages):
+            last_page = min(first_page + self.chunk_pages - 1, page_count)
+            images = convert_from_path(
+                str(source),
+                dpi=self.dpi,
+                first_page=first_page,
+                last_page=last_page,
+                thread_count=self.thread_count,
+            )
+            for i, img in enumerate(images, start=first_page):
+                img_path = f"{source.stem}/{source.stem}_page_{i}.jpg"
+                original_bytes = None
+                if self.save_pages:
+                    img.save(img_path, "JPEG")
+                    original_bytes = os.path.getsize(img_path)
+                self.preprocessor.add(img_path, img, original_bytes)
+                img.close()
+                yield img_path
 
 class ImageHandler(BaseHandler):
     """Handler for folder of images."""
@@ -61,9 +93,9 @@ class ImageHandler(BaseHandler):
 
 class InputHandler:
     """Input handler for different types of files."""
-    def __init__(self):
+    def __init__(self, preprocessor: Optional[ImagePreprocessor] = None):
         self.handlers = {
-            '.pdf': PDFHandler(),
+            '.pdf': PDFHandler(preprocessor or ImagePreprocessor()),
             '': ImageHandler(), # folder of images
         }
 
@@ -72,4 +104,24 @@ class InputHandler:
         handler = self.handlers.get(source.suffix)
         if not handler:
             raise ValueError(f"No handler available for source type: {source.suffix}")
-        return handler.extract_content(source)
\ No newline at end of file
+        return handler.extract_content(source)
+
+
+def prefetch(items: Iterable, depth: int = 4) -> Iterator:
+    """Produce `items` on a background thread, keeping at most `depth` of them ready ahead of the consumer."""
+    buffer = queue.Queue(maxsize=max(1, depth))
+    done = object()
+
+    def produce():
+        try:
+            for item in items:
+                buffer.put(item)
+        except Exception as e:
+            buffer.put(e)
+        buffer.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while (item := buffer.get()) is not done:
+        if isinstance(item, Exception):
+            raise item
+        yield item
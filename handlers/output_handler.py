@@ -1,33 +1,47 @@
 from langchain_core.documents import Document
-from schemas.models import EvaluationState
-from config.redis_config import RedisConnection
+from schemas.models import Evaluation, EvaluationState
+from config.redis_config import route_collection
 from config.log_config import LoggingConfig
+from handlers.cache_handler import AnswerCache
+from handlers.chunk_handler import PageChunker
 
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, List, Tuple
 import json
 import os
 
 
+# Answers built on a page are stale once that page is stored again
+answer_cache = AnswerCache()
+# page: one vector per page; chunk: also one per field-level chunk, in the chunk index
+index_mode = os.getenv("INDEX_MODE", "page")
+
+
 class OutputHandler:
     def __init__(self):
         self.console = LoggingConfig().console
 
+    @staticmethod
+    def document(doc: Evaluation, book_label: str, image_id: str) -> Tuple[str, Dict[str, Any], str]:
+        """The (text, metadata, id) a page is stored under."""
+        doc_text = f"Model: {doc.model}\nTranscription: {doc.transcription}\nTranslation: {doc.translation}\nKeywords: {', '.join(doc.keywords)}"
+        doc_id = f"{book_label}:{image_id}"
+        return doc_text, {"book_id": book_label, "image_id": image_id, "id": doc_id}, doc_id
+
     def summary(self, state: EvaluationState):
         documents = state["evaluations"]
+        # One document per page: the consensus of the models, or the only evaluation there is
+        doc = state.get("merged") or (documents[-1] if documents else None)
         image_id = os.path.splitext(os.path.basename(state["input_image"]))[0]
         book_label = Path(state["input_image"]).parent.name
         # Store into Redis
-        for doc in documents:
-            doc_text = f"Model: {doc.model}\nTranscription: {doc.transcription}\nTranslation: {doc.translation}\nKeywords: {', '.join(doc.keywords)}"
-            doc_id = f"{book_label}:{image_id}"
-            redis_init = RedisConnection(os.getenv("REDIS_URL"))
-            vectorstore = redis_init.get_vectorstore()
-            vectorstore.add_texts(
-                [doc_text],
-                metadatas=[{"book_id": book_label, "image_id": image_id, "id": doc_id}],
-                ids=[doc_id]
-            )
+        if doc is not None:
+            collection = route_collection(book_label)
+            doc_text, metadata, doc_id = self.document(doc, book_label, image_id)
+            collection.vectorstore().add_texts([doc_text], metadatas=[metadata], ids=[doc_id])
+            if index_mode == "chunk":
+                PageChunker(collection).store(doc, book_label, image_id)
+        answer_cache.invalidate([f"{book_label}:{image_id}"])
         # Dump to JSON
         self.save_to_json(documents, state["input_image"])
         return state
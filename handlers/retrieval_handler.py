@@ -0,0 +1,211 @@
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_redis import RedisVectorStore
+from config.redis_config import Collection, get_collection, get_collections
+from config.log_config import LoggingConfig
+
+from redisvl.query import TextQuery
+from redisvl.query.filter import FilterExpression, Tag
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+import os
+import re
+
+load_dotenv()
+
+FILTER_PREFIX = re.compile(r'\b(book|image):("[^"]+"|\S+)')
+COLLECTION_PREFIX = re.compile(r'\bcollection:("[^"]+"|\S+)')
+
+
+def doc_key(doc: Document) -> str:
+    """Identifier of the page a document belongs to."""
+    return f"{doc.metadata.get('book_id', 'unknown')}:{doc.metadata.get('image_id', 'unknown')}"
+
+
+def chunk_key(doc: Document) -> str:
+    """Identifier of a field-level chunk of a page."""
+    return f"{doc_key(doc)}:{doc.metadata.get('field')}:{doc.metadata.get('chunk')}"
+
+
+def stored_vectors(vectorstore: RedisVectorStore, docs: List[Document]) -> List[Optional[np.ndarray]]:
+    """Read the stored vectors of pages with one pipelined HGET each, normalized."""
+    config = vectorstore.config
+    with vectorstore.index.client.pipeline(transaction=False) as pipe:
+        for doc in docs:
+            pipe.hget(f"{config.key_prefix}:{doc_key(doc)}", config.embedding_field)
+        raw = pipe.execute()
+
+    vectors = []
+    for value in raw:
+        if not value:
+            vectors.append(None)
+            continue
+        vector = np.frombuffer(value, dtype=np.dtype(config.vector_datatype.lower())).astype(np.float32)
+        norm = np.linalg.norm(vector)
+        vectors.append(vector / norm if norm else None)
+    return vectors
+
+
+def collapse_chunks(docs: List[Document], k: int) -> List[Document]:
+    """Group ranked chunk hits by page, returning the first `k` pages with only their matching chunks."""
+    pages: Dict[str, Dict[str, Dict[int, str]]] = {}
+    metadata: Dict[str, dict] = {}
+    for doc in docs:
+        key = doc_key(doc)
+        if key not in pages:
+            if len(pages) == k:
+                continue
+            pages[key] = {}
+            metadata[key] = {"book_id": doc.metadata.get("book_id"), "image_id": doc.metadata.get("image_id")}
+        field = doc.metadata.get("field") or "translation"
+        pages[key].setdefault(field, {})[int(doc.metadata.get("chunk") or 0)] = doc.page_content
+    return [
+        Document(
+            page_content="\n".join(
+                f"{field.capitalize()}: {' '.join(chunks[n] for n in sorted(chunks))}" for field, chunks in fields.items()
+            ),
+            metadata=metadata[key],
+        )
+        for key, fields in pages.items()
+    ]
+
+
+class HybridRetriever:
+    """Retrieves pages with vector KNN, BM25 full-text search, or both fused with reciprocal-rank fusion.
+
+    Queries may start with `book:<id>` / `image:<id>` tokens (quoted if they contain spaces),
+    which become tag pre-filters for both searches.
+    """
+
+    # Shared by all retrievers so the two searches of a query always run side by side
+    executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval")
+
+    def __init__(self, vectorstore: RedisVectorStore, embeddings: Embeddings, rrf_k: int = 60, candidates: int = 20, key: Callable[[Document], str] = doc_key):
+        self.console = LoggingConfig().console
+        self.vectorstore = vectorstore
+        self.embeddings = embeddings
+        # Identity of a hit when fusing rankings: the page, or the chunk in the chunk index
+        self.key = key
+        self.rrf_k = rrf_k
+        self.candidates = candidates
+
+    @staticmethod
+    def parse_query(query: str) -> Tuple[str, Dict[str, str]]:
+        """Split the `book:`/`image:` filter tokens from the query text (`collection:` ones are dropped)."""
+        filters = {f"{name}_id": value.strip('"') for name, value in FILTER_PREFIX.findall(query)}
+        text = " ".join(COLLECTION_PREFIX.sub(" ", FILTER_PREFIX.sub(" ", query)).split())
+        return text, filters
+
+    @staticmethod
+    def filter_expression(filters: Dict[str, str]) -> Optional[FilterExpression]:
+        expression = None
+        for field, value in filters.items():
+            condition = Tag(field) == value
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    def vector_search(self, text: str, k: int, filter: Optional[FilterExpression] = None) -> List[Document]:
+        return self.vectorstore.similarity_search_by_vector(self.embeddings.embed_query(text), k=k, filter=filter)
+
+    def text_search(self, text: str, k: int, filter: Optional[FilterExpression] = None) -> List[Document]:
+        """BM25 full-text search over the stored page text."""
+        content_field = self.vectorstore.config.content_field
+        internal = {content_field, self.vectorstore.config.embedding_field, "_index_name", "_metadata_json"}
+        metadata_fields = [name for name in self.vectorstore.index.schema.field_names if name not in internal]
+        try:
+            query = TextQuery(
+                text,
+                text_field_name=content_field,
+                text_scorer="BM25",
+                filter_expression=filter,
+                return_fields=[content_field, *metadata_fields],
+                num_results=k,
+                stopwords=None,
+            )
+        except ValueError:
+            # Nothing searchable left in the query
+            return []
+        return [
+            Document(
+                page_content=result[content_field],
+                metadata={field: result.get(field) for field in metadata_fields},
+            )
+            for result in self.vectorstore.index.query(query)
+        ]
+
+    def fuse(self, *rankings: List[Document]) -> List[Document]:
+        """Reciprocal-rank fusion: every list adds 1 / (rrf_k + rank) to the score of each page it returns."""
+        scores: Dict[str, float] = {}
+        docs: Dict[str, Document] = {}
+        for ranking in rankings:
+            for rank, doc in enumerate(ranking, start=1):
+                key = self.key(doc)
+                scores[key] = scores.get(key, 0.0) + 1.0 / (self.rrf_k + rank)
+                docs.setdefault(key, doc)
+        return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+    def search(self, query: str, k: int, mode: str = "hybrid") -> List[Document]:
+        """Return the top `k` pages for `query` using the `vector`, `text` or `hybrid` strategy."""
+        text, filters = self.parse_query(query)
+        filter = self.filter_expression(filters)
+        if not text:
+            text = query
+        if mode == "vector":
+            return self.vector_search(text, k, filter)
+        if mode == "text":
+            return self.text_search(text, k, filter)
+
+        candidates = max(k, self.candidates)
+        vector_future = self.executor.submit(self.vector_search, text, candidates, filter)
+        text_future = self.executor.submit(self.text_search, text, candidates, filter)
+        return self.fuse(vector_future.result(), text_future.result())[:k]
+
+
+class ScatterRetriever:
+    """Searches several collections side by side and merges their hits into one top `k`.
+
+    Every collection returns its own top `k` with `search`, in any retrieval mode. The hits are then
+    scored by the cosine similarity of their stored vectors to the query, which compares across
+    indexes, and the best `k` overall are kept, each tagged with its collection. The collections come
+    from `collection:<name>` tokens in the query, else QUERY_COLLECTIONS, else all of them.
+    """
+
+    executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="scatter")
+
+    def __init__(self, search: Callable[[Collection, str, int], List[Document]], embeddings: Embeddings):
+        self.search_collection = search
+        self.embeddings = embeddings
+
+    @staticmethod
+    def select(query: str) -> Tuple[str, List[Collection]]:
+        """Split the `collection:` tokens from the query, returning the query and the collections to search."""
+        names = [value.strip('"') for value in COLLECTION_PREFIX.findall(query)]
+        names = names or [name.strip() for name in os.getenv("QUERY_COLLECTIONS", "").split(",") if name.strip()]
+        collections = [get_collection(name) for name in dict.fromkeys(names)] or list(get_collections().values())
+        return " ".join(COLLECTION_PREFIX.sub(" ", query).split()), collections
+
+    def _search(self, collection: Collection, query: str, k: int, query_vector: Optional[np.ndarray]) -> List[Tuple[float, Document]]:
+        docs = self.search_collection(collection, query, k)
+        for doc in docs:
+            doc.metadata["collection"] = collection.name
+        if query_vector is None:
+            return [(0.0, doc) for doc in docs]
+        # Pages without a stored vector rank after every scored one
+        return [
+            (float(vector @ query_vector) if vector is not None else -1.0, doc)
+            for vector, doc in zip(stored_vectors(collection.vectorstore(), docs), docs)
+        ]
+
+    def search(self, query: str, k: int) -> List[Document]:
+        query, collections = self.select(query)
+        if len(collections) == 1:
+            # Nothing to merge, so the collection's own ranking is kept
+            return [doc for _, doc in self._search(collections[0], query, k, None)]
+
+        query_vector = np.asarray(self.embeddings.embed_query(HybridRetriever.parse_query(query)[0] or query), dtype=np.float32)
+        query_vector = query_vector / (np.linalg.norm(query_vector) or 1.0)
+        futures = [self.executor.submit(self._search, collection, query, k, query_vector) for collection in collections]
+        hits = [hit for future in futures for hit in future.result()]
+        return [doc for _, doc in sorted(hits, key=lambda hit: hit[0], reverse=True)[:k]]
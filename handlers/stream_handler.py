@@ -0,0 +1,82 @@
+from agents import Agent, Runner, RunResultStreaming, TResponseInputItem
+from config.metrics import metrics, model_name
+
+from openai.types.responses import ResponseTextDeltaEvent
+from rich.console import Console
+from rich.live import Live
+from rich.panel import Panel
+from typing import Any, AsyncIterator, Awaitable, Optional
+import time
+
+
+class AnswerStream:
+    """Streams the text of an agent run as it is generated, timing the first token and the whole run.
+
+    An optional `gate` (e.g. the input guardrail) is awaited before the first token is released,
+    so the model starts generating right away but nothing is shown for a rejected query.
+    The run is recorded as an `llm` operation of the agent's kind, with its token usage.
+    """
+
+    def __init__(self, agent: Agent, input: str | list[TResponseInputItem], gate: Optional[Awaitable[Any]] = None, started: Optional[float] = None):
+        self.agent = agent
+        self.input = input
+        self.gate = gate
+        self.started = started if started is not None else time.perf_counter()
+        self.result: Optional[RunResultStreaming] = None
+        self.first_token: Optional[float] = None
+        self.total: Optional[float] = None
+        self.text = ""
+
+    async def _open_gate(self) -> None:
+        if self.gate is not None:
+            gate, self.gate = self.gate, None
+            await gate
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        """Yield the text deltas of the run; the run is cancelled if iteration stops early."""
+        self.result = Runner.run_streamed(self.agent, self.input)
+        wall_start, error = time.time(), None
+        try:
+            async for event in self.result.stream_events():
+                if event.type != "raw_response_event" or not isinstance(event.data, ResponseTextDeltaEvent):
+                    continue
+                if self.first_token is None:
+                    await self._open_gate()
+                    self.first_token = time.perf_counter() - self.started
+                self.text += event.data.delta
+                yield event.data.delta
+            await self._open_gate()
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if not self.result.is_complete:
+                self.result.cancel()
+            self.total = time.perf_counter() - self.started
+            self._record(wall_start, error)
+
+    def _record(self, wall_start: float, error: Optional[str]) -> None:
+        model = model_name(self.agent.model)
+        kind = self.agent.name.lower().replace(" ", "_")
+        metrics.record("llm", wall_start, error, kind=kind, model=model)
+        if self.first_token is not None:
+            metrics.observe("llm_first_token_seconds", self.first_token, kind=kind, model=model)
+        usage = self.result.context_wrapper.usage
+        metrics.record_tokens(model, usage.input_tokens, usage.output_tokens)
+
+    @property
+    def final_output(self) -> Any:
+        return self.result.final_output if self.result else None
+
+    async def render(self, console: Console, title: str, transient: bool = False) -> Any:
+        """Render the answer into a live panel as tokens arrive, returning the final output."""
+        panel = lambda: Panel.fit(self.text or "...", title=title, title_align="left", border_style="assistant")
+        with Live(panel(), console=console, transient=transient, refresh_per_second=12) as live:
+            async for _ in self:
+                live.update(panel())
+        return self.final_output
+
+    def timing(self) -> str:
+        first = f"{self.first_token:.2f}s" if self.first_token is not None else "-"
+        return f"⏱️ first token {first}, total {self.total or 0:.2f}s"
+
@@ -1,45 +1,74 @@
 from langchain_core.documents import Document
-from config.redis_config import RedisConnection
+from config.redis_config import DEFAULT_COLLECTION, Collection, RedisConnection, get_collections, get_redis_manager
 from config.log_config import LoggingConfig
 from config.llm_config import LLMConfig
+from config.metrics import metrics, model_name
 from schemas.models import QueryCheck, QueryGraph
-from agents import (
-    Agent,
-    InputGuardrail,
-    GuardrailFunctionOutput,
-    Runner,
-    InputGuardrailTripwireTriggered,
-    OutputGuardrailTripwireTriggered,
-    RunContextWrapper,
-    TResponseInputItem,
-)
+from handlers.cache_handler import AnswerCache, CachedEmbeddings
+from handlers.retrieval_handler import HybridRetriever, ScatterRetriever, chunk_key, collapse_chunks, doc_key
+from handlers.history_handler import ConversationHistory
+from handlers.context_handler import ContextPacker
 from rich.prompt import Prompt
 from rich.panel import Panel
-from typing import Any
+from functools import cache
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Any, AsyncIterator, Optional
 import asyncio
+import time
 import os
 
+if TYPE_CHECKING:
+    from agents import Agent, GuardrailFunctionOutput, RunContextWrapper, TResponseInputItem
+
 # Config
 console = LoggingConfig().console
 
-# Get query model from config
-llm_config = LLMConfig()
-model = llm_config.get_model('query')
+# Query vectors are cached in memory and in Redis, so repeated questions skip the embedding call
+embedding_cache = CachedEmbeddings(get_redis_manager().embeddings)
+# Opt-in (ANSWER_CACHE=1) reuse of answers to near-identical questions over the same pages
+answer_cache = AnswerCache()
+# vector, text (BM25) or hybrid (both, fused with reciprocal-rank fusion)
+retrieval_mode = os.getenv("RETRIEVAL_MODE", "hybrid")
+# page: search whole pages; chunk: search field-level chunks and collapse them to their pages
+index_mode = os.getenv("INDEX_MODE", "page")
+# Pages packed into the prompt, out of the CONTEXT_CANDIDATES retrieved
+context_pages = int(os.getenv("CONTEXT_PAGES", "5"))
 
 # Agents and functions
-async def guardrail_function(ctx: RunContextWrapper[Any], agent: Agent, input: str | list[TResponseInputItem]) -> GuardrailFunctionOutput:
+async def guardrail_function(ctx: "RunContextWrapper[Any]", agent: "Agent", input: "str | list[TResponseInputItem]") -> "GuardrailFunctionOutput":
+    from agents import GuardrailFunctionOutput, Runner
+
+    guardrail_agent = get_agents().guardrail
     result = await Runner.run(guardrail_agent, input, context=ctx.context)
+    usage = result.context_wrapper.usage
+    metrics.record_tokens(model_name(guardrail_agent.model), usage.input_tokens, usage.output_tokens)
     final_output = result.final_output_as(QueryCheck)
     return GuardrailFunctionOutput(
         output_info=final_output,
         tripwire_triggered=not final_output.is_content_or_search_related,
     )
 
+async def check_input(user_input: str) -> None:
+    """Run the input guardrail on its own, raising InputGuardrailTripwireTriggered on rejection."""
+    from agents import InputGuardrailTripwireTriggered, RunContextWrapper
+
+    guardrail = get_agents().input_guardrail
+    with metrics.timer("llm", kind="guardrail", model=model_name(get_agents().guardrail.model)):
+        result = await guardrail.run(get_agents().query, user_input, RunContextWrapper(context=None))
+    if result.output.tripwire_triggered:
+        raise InputGuardrailTripwireTriggered(result)
+
+def search_collection(collection: Collection, query: str, k: int) -> list[Document]:
+    """Search the index of one collection, honouring `book:`/`image:` filters in the query."""
+    if index_mode == "chunk":
+        # A page has a few chunks, so over-fetch them to still end up with `k` pages
+        chunks = HybridRetriever(collection.chunk_vectorstore(), embedding_cache, key=chunk_key).search(query, k=k * 3, mode=retrieval_mode)
+        return collapse_chunks(chunks, k)
+    return HybridRetriever(collection.vectorstore(), embedding_cache).search(query, k=k, mode=retrieval_mode)
+
 def retrieve_relevant_evaluations(query: str, k: int) -> list[Document]:
-    """Perform semantic similarity search from Redis vectorstore."""
-    redis_init = RedisConnection(os.getenv("REDIS_URL"))
-    vectorstore = redis_init.get_vectorstore()
-    return vectorstore.similarity_search(query, k=k)
+    """Search the collections picked by `collection:` tokens or QUERY_COLLECTIONS (all by default), merging their top `k`."""
+    return ScatterRetriever(search_collection, embedding_cache).search(query, k)
 
 def build_prompt(query: str, context_docs: list[Document]) -> list:
     context = "\n\n".join(
@@ -59,71 +88,164 @@ def build_prompt(query: str, context_docs: list[Document]) -> list:
     return [{"role": "system", "content": system_prompt}, {"role": "user", "content": query}]
 
 
-def context_retrieval(user_input: str):
-    relevant_docs = retrieve_relevant_evaluations(user_input, k=5)
+def context_retrieval(user_input: str) -> tuple[list, list[Document]]:
+    """Over-fetch candidates, then pack the most relevant and diverse excerpts into the prompt."""
+    with metrics.timer("retrieval", mode=retrieval_mode):
+        # Candidates are tagged with their collection, whose store holds their vectors
+        packer = ContextPacker()
+        candidates = retrieve_relevant_evaluations(user_input, k=packer.candidates)
+        query_vector = embedding_cache.embed_query(HybridRetriever.parse_query(user_input)[0] or user_input)
+        relevant_docs = packer.pack(user_input, query_vector, candidates, k=context_pages)
     new_messages = build_prompt(user_input, relevant_docs)
-    return new_messages
-
-
-guardrail_agent = Agent(
-    name="Input Check",
-    instructions="Check if the user input is related to a query search using the stored documents.",
-    output_type=QueryCheck,
-    model=model,
-)
-
-query_agent = Agent(
-    name="Query Agent",
-    instructions="Answer the user query using the stored documents.",
-    input_guardrails=[
-        InputGuardrail(guardrail_function=guardrail_function),
-    ],
-    model=model,
-)
-
-graph_agent = Agent(
-    name="Graph Agent",
-    instructions="Based on the query, build a relationship graph. Do not add any additional text or explanation. Only return the required graph.",
-    output_type=QueryGraph,
-    model=model,
-)
+    return new_messages, relevant_docs
+
+
+def cached_answer_lookup(user_input: str, relevant_docs: list[Document]) -> tuple[list[float], list[str], Optional[str]]:
+    """Return the query vector, the retrieved page ids and the cached answer for them, if any."""
+    query_vector = embedding_cache.embed_query(HybridRetriever.parse_query(user_input)[0] or user_input)
+    doc_ids = [doc_key(doc) for doc in relevant_docs]
+    # Relationship graphs are not cached, so those queries always run the agents
+    cached_answer = None if user_input.endswith("-g") else answer_cache.lookup(query_vector, doc_ids)
+    return query_vector, doc_ids, cached_answer
+
+
+@cache
+def get_agents() -> SimpleNamespace:
+    """Create the agents, and the query model they share, once per process.
+
+    The Agents SDK and the query model are the slowest imports, so "store" never loads them.
+    """
+    from agents import Agent, InputGuardrail
+
+    model = LLMConfig().get_model('query')
+    return SimpleNamespace(
+        guardrail=Agent(
+            name="Input Check",
+            instructions="Check if the user input is related to a query search using the stored documents.",
+            output_type=QueryCheck,
+            model=model,
+        ),
+        # Run by chat_loop alongside retrieval and the answer, instead of by the Runner before the agent
+        input_guardrail=InputGuardrail(guardrail_function=guardrail_function),
+        query=Agent(
+            name="Query Agent",
+            instructions="Answer the user query using the stored documents.",
+            model=model,
+        ),
+        digest=Agent(
+            name="History Digest",
+            instructions="Merge the previous digest and the new exchanges into one short digest of the conversation: the questions asked and the key facts of the answers, with their [book / image] citations. Return only the digest.",
+            model=model,
+        ),
+        graph=Agent(
+            name="Graph Agent",
+            instructions="Based on the query, build a relationship graph. Do not add any additional text or explanation. Only return the required graph.",
+            output_type=QueryGraph,
+            model=model,
+        ),
+    )
+
+async def summarize_history(digest: str, exchanges: list[tuple[str, str]]) -> str:
+    """Merge older exchanges into the rolling digest of the conversation."""
+    from agents import Runner
+
+    transcript = "\n\n".join(f"User: {user}\nAssistant: {assistant}" for user, assistant in exchanges)
+    result = await Runner.run(get_agents().digest, f"Previous digest:\n{digest or '(none)'}\n\nNew exchanges:\n{transcript}")
+    return result.final_output
+
+async def stream_answer(user_input: str, conversation_history: Optional[list] = None) -> AsyncIterator[str]:
+    """Answer a query outside the chat loop, yielding the answer text as it is generated.
+
+    Raises InputGuardrailTripwireTriggered before the first token if the query is rejected.
+    """
+    from handlers.stream_handler import AnswerStream
+
+    guard = asyncio.create_task(check_input(user_input))
+    try:
+        new_messages, _ = await asyncio.to_thread(context_retrieval, user_input)
+        async for delta in AnswerStream(get_agents().query, (conversation_history or []) + new_messages, gate=guard):
+            yield delta
+    finally:
+        guard.cancel()
 
 async def chat_loop():
+    from agents import InputGuardrailTripwireTriggered, OutputGuardrailTripwireTriggered
+    from handlers.stream_handler import AnswerStream
+
     console.print("\nChat session started. Type 'exit' to quit. Add '-g' to the query to build a relationship graph.", style="system")
     console.print("The query must be fitting the stored documents or it will be rejected.", style="system")
 
     try:
-        conversation_history = []
+        # Last exchanges verbatim plus a digest of the older ones, within HISTORY_TOKEN_BUDGET
+        conversation_history = ConversationHistory(summarize_history)
 
         while True:
-            user_input = Prompt.ask("\n[input]You[/input]", console=console)
+            # Prompting off the event loop lets other sessions keep running meanwhile
+            user_input = await asyncio.to_thread(Prompt.ask, "\n[input]You[/input]", console=console)
             if user_input.strip().lower() in {"exit", "quit"}:
                 console.print("\nGoodbye!", style="system")
                 break
 
             console.print("\nThinking...", style="system")
-            new_messages = context_retrieval(user_input)
-            full_input = conversation_history + new_messages
+            # Root span of the turn: retrieval, guardrail, answer and Redis time add up in its breakdown
+            with metrics.timer("query"):
+                started = time.perf_counter()
+                # The guardrail runs while the context is retrieved and the answer generated; a rejection cancels both
+                guard = asyncio.create_task(check_input(user_input))
+                try:
+                    try:
+                        new_messages, relevant_docs = await asyncio.to_thread(context_retrieval, user_input)
+                    except ValueError as e:
+                        # e.g. an unknown `collection:` name, which should not end the session
+                        console.print(f"❌ {e}", style="error")
+                        continue
+
+                    query_vector, doc_ids, cached_answer = await asyncio.to_thread(cached_answer_lookup, user_input, relevant_docs)
+                    if cached_answer is not None:
+                        # A cached answer is only served to a query the guardrail accepts
+                        await guard
+                        console.print(Panel.fit(cached_answer, title="📜 Assistant (cached)", title_align="left", border_style="assistant"))
+                        conversation_history.add(user_input, cached_answer)
+                        continue
 
-            response = await Runner.run(query_agent, full_input)
-            console.print(Panel.fit(response.final_output, title="📜 Assistant", title_align="left", border_style="assistant"))
+                    full_input = await conversation_history.messages(new_messages)
+                    if guard.done():
+                        await guard  # surface an early rejection before paying for the answer
+                    # Tokens are generated right away but only shown once the guardrail has passed
+                    answer = AnswerStream(get_agents().query, full_input, gate=guard, started=started)
+                    final_output = await answer.render(console, "📜 Assistant")
+                finally:
+                    guard.cancel()
 
-            # Makes graph only if user input ends with "-g"
-            if user_input.endswith("-g"):
-                console.print("\nBuilding connections...", style="system")
-                graph_response = await Runner.run(graph_agent, full_input)
-                console.print(graph_response.final_output, style="assistant")
+                console.print(answer.timing(), style="system")
+                await asyncio.to_thread(answer_cache.store, query_vector, doc_ids, user_input, final_output)
 
-            conversation_history = response.to_input_list()
+                # Makes graph only if user input ends with "-g"
+                if user_input.endswith("-g"):
+                    console.print("\nBuilding connections...", style="system")
+                    graph = AnswerStream(get_agents().graph, full_input)
+                    console.print(await graph.render(console, "🕸️ Graph", transient=True), style="assistant")
+                    console.print(graph.timing(), style="system")
+
+                conversation_history.add(user_input, final_output)
 
     except (InputGuardrailTripwireTriggered, OutputGuardrailTripwireTriggered):
         console.print("❌ Request not supported", style="error")
     except Exception as e:
         console.print(f"❌ An error occurred: {e}", style="error")
 
+    embedding_cache.report()
+    answer_cache.report()
+    metrics.report()
+
 
 async def redis_store():
-    redis_init = RedisConnection(os.getenv("REDIS_URL"))
+    collections = get_collections()
+    name = DEFAULT_COLLECTION
+    if len(collections) > 1:
+        name = Prompt.ask("[input]Collection[/input]", choices=list(collections), default=DEFAULT_COLLECTION, console=console)
+    collection = collections[name]
+    redis_init = RedisConnection(collection.url, collection.index_name)
     redis_init.read_vectorstore()
 
 
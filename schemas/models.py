@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Annotated, Any
+from typing import List, Annotated
 from typing_extensions import TypedDict
 from operator import add
 
@@ -10,10 +10,22 @@ class Evaluation(BaseModel):
     translation: str = Field(description="English translation of the document.")
     keywords: List[str] = Field(description="List of keywords about the document.")
 
+# One page of a batched scan, numbered as in the request
+class PageEvaluation(BaseModel):
+    page: int = Field(description="Number of the page in the request, starting from 1.")
+    transcription: str = Field(description="Literal transcription of the page.")
+    translation: str = Field(description="English translation of the page.")
+    keywords: List[str] = Field(description="List of keywords about the page.")
+
+# Several consecutive pages scanned in one request
+class BatchEvaluation(BaseModel):
+    pages: List[PageEvaluation] = Field(description="One evaluation per page of the request, in page order.")
+
 # LangChain graph state
 class EvaluationState(TypedDict):
     evaluations: Annotated[List[Evaluation], add]
-    model: Any = Field(description="LLM version used to scan the document.")
+    merged: Evaluation = Field(description="Consensus of the latest evaluations of every model, stored for the page.")
+    model: str = Field(description="LLM version used to scan the document.")
     input_image: str = Field(description="Input image path.")
     human_feedback: str = Field(description="(Optional) Feedback from the user about the document.")
 
@@ -0,0 +1,14 @@
+import os
+
+# The Redis manager needs a URL to be built, but no test connects to it
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+
+from benchmarks import fakes
+
+import pytest
+
+
+@pytest.fixture(scope="session", autouse=True)
+def fake_models() -> fakes.FakeEmbeddings:
+    """Fake vision, query and embedding models, and the in-memory store for the default index."""
+    return fakes.install()
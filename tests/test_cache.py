@@ -0,0 +1,184 @@
+from config.redis_config import DEFAULT_INDEX_NAME, get_redis_manager
+from handlers.cache_handler import AnswerCache, IngestCache
+from schemas.models import Evaluation
+
+from benchmarks import fakes
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Set
+import handlers.cache_handler as cache_handler
+import re
+
+import pytest
+
+
+class FakeIndex:
+    """Answer cache index holding entries as id -> page ids, answering the doc_ids filter of `invalidate`."""
+
+    def __init__(self, entries: Optional[Dict[str, Set[str]]] = None, exists: bool = True):
+        self.entries = dict(entries or {})
+        self.found = exists
+        self.exists_calls = 0
+        self.results: List[dict] = []
+
+    def create(self, overwrite: bool = False) -> None:
+        self.found = True
+
+    def exists(self) -> bool:
+        self.exists_calls += 1
+        return self.found
+
+    def query(self, query) -> List[dict]:
+        if not hasattr(query, "filter") or "@doc_ids" not in str(query.filter):
+            return self.results
+        tags = re.search(r"\{(.*)\}", str(query.filter)).group(1)
+        wanted = {re.sub(r"\\(.)", r"\1", tag) for tag in re.split(r"(?<!\\)\|", tags)}
+        return [{"id": id} for id, doc_ids in self.entries.items() if doc_ids & wanted]
+
+    def drop_keys(self, keys: List[str]) -> int:
+        for key in keys:
+            del self.entries[key]
+        return len(keys)
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values: Dict[str, bytes] = {}
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.values.get(key)
+
+    def set(self, key: str, value, ex: Optional[int] = None) -> None:
+        self.values[key] = value.encode() if isinstance(value, str) else value
+
+    def delete(self, key: str) -> None:
+        self.values.pop(key, None)
+
+    def exists(self, key: str) -> int:
+        return int(key in self.values)
+
+
+def answer_cache(monkeypatch: pytest.MonkeyPatch, enabled: bool, index: FakeIndex) -> AnswerCache:
+    monkeypatch.setenv("ANSWER_CACHE", "1" if enabled else "0")
+    cache = AnswerCache()
+    cache._index = index
+    return cache
+
+
+@pytest.mark.parametrize("enabled", [True, False])
+def test_invalidate_drops_answers_built_on_the_pages(monkeypatch, enabled):
+    index = FakeIndex({"a1": {"book:page_1", "book:page_2"}, "a2": {"book:page_3"}, "a3": {"other book:page_1"}})
+    cache = answer_cache(monkeypatch, enabled, index)
+
+    assert cache.invalidate(["book:page_2", "other book:page_1"]) == 2
+    assert set(index.entries) == {"a2"}
+
+
+def test_invalidate_asks_again_until_the_index_exists(monkeypatch):
+    index = FakeIndex({"a1": {"book:page_1"}}, exists=False)
+    cache = answer_cache(monkeypatch, False, index)
+
+    assert cache.invalidate(["book:page_1"]) == 0
+    index.found = True
+    assert cache.invalidate(["book:page_1"]) == 1
+    cache.invalidate(["book:page_1"])
+    assert index.exists_calls == 2
+
+
+def test_invalidate_only_warns_on_errors(monkeypatch):
+    index = FakeIndex()
+    index.exists = lambda: (_ for _ in ()).throw(ConnectionError("down"))
+    cache = answer_cache(monkeypatch, False, index)
+
+    assert cache.invalidate(["book:page_1"]) == 0
+
+
+def test_storing_a_page_invalidates_its_answers(monkeypatch, tmp_path):
+    import handlers.output_handler as output_handler
+
+    index = FakeIndex({"a1": {"book:page_1"}, "a2": {"book:page_2"}})
+    monkeypatch.setattr(output_handler.answer_cache, "_index", index)
+    image = tmp_path / "book" / "page_1.jpg"
+    image.parent.mkdir()
+    evaluation = fakes.fake_evaluation("page_1")
+
+    output_handler.OutputHandler().summary({"evaluations": [evaluation], "merged": None, "input_image": str(image)})
+
+    assert set(index.entries) == {"a2"}
+    assert "book:page_1" in get_redis_manager().get_vectorstore(DEFAULT_INDEX_NAME).positions
+    assert (tmp_path / "book" / "json" / "page_1.json").exists()
+
+
+@pytest.mark.parametrize("distance, hit", [("0.02", True), ("0.2", False)])
+def test_lookup_honours_the_threshold(monkeypatch, distance, hit):
+    monkeypatch.setenv("ANSWER_CACHE_THRESHOLD", "0.95")
+    index = FakeIndex()
+    index.results = [{"vector_distance": distance, "answer": "cached"}]
+    cache = answer_cache(monkeypatch, True, index)
+
+    assert cache.lookup([1.0, 0.0], ["book:page_1"]) == ("cached" if hit else None)
+    assert (cache.hits, cache.misses) == ((1, 0) if hit else (0, 1))
+
+
+def test_lookup_is_off_unless_enabled(monkeypatch):
+    index = FakeIndex()
+    index.results = [{"vector_distance": "0", "answer": "cached"}]
+
+    assert answer_cache(monkeypatch, False, index).lookup([1.0, 0.0], ["book:page_1"]) is None
+
+
+def test_context_key_ignores_the_page_order():
+    assert AnswerCache.context_key(["a:1", "b:2"]) == AnswerCache.context_key(["b:2", "a:1"])
+    assert AnswerCache.context_key(["a:1"]) != AnswerCache.context_key(["a:1", "b:2"])
+
+
+@pytest.fixture
+def ingest_cache(monkeypatch) -> IngestCache:
+    monkeypatch.setenv("INGEST_CACHE", "1")
+    client = FakeRedis()
+    monkeypatch.setattr(cache_handler, "get_redis_manager", lambda: SimpleNamespace(client=client))
+    return IngestCache("v1")
+
+
+def test_ingest_key_changes_with_image_prompt_and_model():
+    cache = IngestCache("v1")
+    key = cache.key(b"image", "model")
+
+    assert key == IngestCache("v1").key(b"image", "model")
+    assert len({key, cache.key(b"other", "model"), cache.key(b"image", "other"), IngestCache("v2").key(b"image", "model")}) == 4
+
+
+def test_ingest_cache_round_trip(ingest_cache, tmp_path):
+    image = str(tmp_path / "book" / "page_1.jpg")
+    key = ingest_cache.key(b"image", "model")
+    evaluation = Evaluation(model="model", transcription="text", translation="", keywords=["king"])
+
+    assert ingest_cache.get(key, image) is None
+    ingest_cache.set(key, image, evaluation)
+
+    assert ingest_cache.get(key, image) == evaluation
+    assert ingest_cache.stats()["hits"] == 1
+    assert not list(Path(image).parent.glob("json/.cache/*.tmp"))
+
+
+def test_unreadable_local_entry_falls_back_to_redis(ingest_cache, tmp_path):
+    image = str(tmp_path / "book" / "page_1.jpg")
+    key = ingest_cache.key(b"image", "model")
+    evaluation = Evaluation(model="model", transcription="text", translation="", keywords=[])
+    ingest_cache.set(key, image, evaluation)
+    local = ingest_cache._local_path(image, key)
+    local.write_text('{"model": "mod')
+
+    assert ingest_cache.get(key, image) == evaluation
+    assert Evaluation.model_validate_json(local.read_text()) == evaluation
+
+
+def test_unreadable_redis_entry_is_a_miss(ingest_cache, tmp_path):
+    image = str(tmp_path / "book" / "page_1.jpg")
+    key = ingest_cache.key(b"image", "model")
+    client = cache_handler.get_redis_manager().client
+    client.set(f"ingest_cache:{key}", "not json")
+
+    assert ingest_cache.get(key, image) is None
+    assert f"ingest_cache:{key}" not in client.values
+    assert ingest_cache.stats()["misses"] == 1
@@ -0,0 +1,34 @@
+from handlers.consensus_handler import ConsensusHandler
+from schemas.models import Evaluation
+
+
+def evaluation(model: str, transcription: str, keywords=()) -> Evaluation:
+    return Evaluation(model=model, transcription=transcription, translation=transcription, keywords=list(keywords))
+
+
+def test_merge_keeps_the_text_most_models_agree_with():
+    merged = ConsensusHandler().merge([
+        evaluation("a", "the king rode to the abbey", ["King"]),
+        evaluation("b", "the kin rode to the abbey in winter", ["abbey", "king"]),
+        evaluation("c", "the king rode to the abbey in winter", ["winter"]),
+    ])
+
+    assert merged.model == "a, b, c"
+    assert merged.transcription == "the king rode to the abbey in winter"
+    assert merged.keywords == ["King", "abbey", "winter"]
+
+
+def test_merge_of_two_keeps_the_primary_and_skips_empty_answers():
+    merged = ConsensusHandler().merge([evaluation("a", ""), evaluation("b", "some text"), evaluation("c", "other text")])
+    assert merged.transcription == "some text"
+
+    merged = ConsensusHandler().merge([evaluation("a", "first"), evaluation("b", "second")])
+    assert merged.transcription == "first"
+
+
+def test_latest_keeps_the_last_evaluation_of_every_model_in_model_order():
+    evaluations = [evaluation("b", "old b"), evaluation("a", "a"), evaluation("b", "new b")]
+
+    latest = ConsensusHandler.latest(evaluations, ["a", "b"])
+
+    assert [(e.model, e.transcription) for e in latest] == [("a", "a"), ("b", "new b")]
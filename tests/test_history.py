@@ -0,0 +1,61 @@
+from handlers.history_handler import ConversationHistory
+
+from typing import List, Tuple
+import asyncio
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class Digest:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.calls: List[List[Tuple[str, str]]] = []
+
+    async def __call__(self, digest: str, exchanges: List[Tuple[str, str]]) -> str:
+        self.calls.append(exchanges)
+        if self.fail:
+            raise RuntimeError("model down")
+        return " ".join(filter(None, [digest] + [user for user, _ in exchanges]))
+
+
+def test_old_exchanges_move_to_the_digest():
+    async def chat():
+        digest = Digest()
+        history = ConversationHistory(digest, keep_turns=2, token_budget=1000)
+        for n in range(4):
+            history.add(f"q{n}", f"a{n}")
+        messages = await history.messages([{"role": "user", "content": "q4"}])
+        return digest, history, messages
+
+    digest, history, messages = run(chat())
+
+    assert history.exchanges == [("q2", "a2"), ("q3", "a3")]
+    assert history.digest == "q0 q1"
+    assert [message["content"] for message in messages] == [
+        "Summary of the earlier conversation:\nq0 q1", "q2", "a2", "q3", "a3", "q4",
+    ]
+
+
+def test_failed_digest_keeps_the_questions():
+    async def chat():
+        history = ConversationHistory(Digest(fail=True), keep_turns=1, token_budget=1000)
+        history.add("q0", "a0")
+        history.add("q1", "a1")
+        await history.messages([])
+        return history
+
+    assert run(chat()).digest == "- q0"
+
+
+def test_messages_stay_within_the_token_budget():
+    async def chat():
+        history = ConversationHistory(Digest(), keep_turns=5, token_budget=60)
+        history.add("old question", "x" * 400)
+        history.add("recent question", "short answer")
+        return await history.messages([{"role": "user", "content": "new question"}])
+
+    contents = [message["content"] for message in run(chat())]
+
+    assert contents == ["recent question", "short answer", "new question"]
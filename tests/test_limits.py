@@ -0,0 +1,84 @@
+from utils.deadline import LatencyTracker, call_hedged, call_with_deadline
+from utils.rate_limit import TokenBucket
+
+import time
+
+import pytest
+
+
+def slow(seconds: float, value: str):
+    def call() -> str:
+        time.sleep(seconds)
+        return value
+    return call
+
+
+def failing(message: str):
+    def call() -> str:
+        raise RuntimeError(message)
+    return call
+
+
+def test_bucket_allows_its_burst_then_the_refill_rate():
+    bucket = TokenBucket(per_minute=600)
+    started = time.monotonic()
+    for _ in range(600):
+        bucket.acquire()
+    assert time.monotonic() - started < 0.1
+
+    started = time.monotonic()
+    bucket.acquire()
+    # 10 tokens per second
+    assert 0.05 <= time.monotonic() - started < 0.3
+
+
+def test_drained_bucket_waits_for_the_refill():
+    bucket = TokenBucket(per_minute=1200)
+    bucket.drain()
+    started = time.monotonic()
+    bucket.acquire(2)
+    assert 0.05 <= time.monotonic() - started < 0.3
+
+
+def test_adjust_charges_and_refunds():
+    bucket = TokenBucket(per_minute=60)
+    bucket.adjust(70)
+    assert bucket.tokens < 0
+    bucket.adjust(-100)
+    assert bucket.tokens == bucket.capacity
+
+
+def test_deadline_raises_on_slow_calls():
+    assert call_with_deadline(slow(0, "done"), 1.0) == "done"
+    with pytest.raises(TimeoutError):
+        call_with_deadline(slow(0.5, "late"), 0.05)
+
+
+def test_hedge_answers_when_the_primary_is_slow():
+    assert call_hedged(slow(0.5, "primary"), slow(0, "hedge"), hedge_after=0.05, timeout=1.0) == ("hedge", True)
+
+
+def test_no_hedge_when_the_primary_is_fast():
+    assert call_hedged(slow(0, "primary"), slow(0, "hedge"), hedge_after=0.5, timeout=1.0) == ("primary", False)
+
+
+def test_hedge_right_away_when_the_primary_fails():
+    started = time.monotonic()
+    assert call_hedged(failing("down"), slow(0, "hedge"), hedge_after=5.0, timeout=1.0) == ("hedge", True)
+    assert time.monotonic() - started < 1.0
+
+
+def test_hedged_call_raises_the_last_error_or_a_timeout():
+    with pytest.raises(RuntimeError, match="hedge down"):
+        call_hedged(failing("down"), failing("hedge down"), hedge_after=0.01, timeout=1.0)
+    with pytest.raises(TimeoutError):
+        call_hedged(slow(0.5, "primary"), slow(0.5, "hedge"), hedge_after=0.01, timeout=0.05)
+
+
+def test_latency_tracker_uses_the_default_until_enough_samples():
+    tracker = LatencyTracker(window=10, min_samples=3)
+    tracker.observe(1.0)
+    assert tracker.percentile(95, default=7.0) == 7.0
+    for seconds in (2.0, 3.0):
+        tracker.observe(seconds)
+    assert tracker.percentile(50, default=7.0) == 2.0
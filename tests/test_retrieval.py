@@ -0,0 +1,131 @@
+from langchain_core.documents import Document
+from config.redis_config import get_collections, get_redis_manager
+from handlers.context_handler import ContextPacker
+from handlers.retrieval_handler import HybridRetriever, ScatterRetriever, collapse_chunks, doc_key
+
+from benchmarks import fakes
+from typing import List
+
+import pytest
+
+
+def page(book: str, image: str, text: str = "", **metadata) -> Document:
+    return Document(page_content=text or f"{book} {image}", metadata={"book_id": book, "image_id": image, **metadata})
+
+
+def keys(docs: List[Document]) -> List[str]:
+    return [doc_key(doc) for doc in docs]
+
+
+def test_fuse_ranks_pages_found_by_both_searches_first(fake_models):
+    retriever = HybridRetriever(None, fake_models, rrf_k=60)
+    vector = [page("b", "1"), page("b", "2"), page("b", "3")]
+    text = [page("b", "3"), page("b", "4"), page("b", "1")]
+
+    assert keys(retriever.fuse(vector, text)) == ["b:1", "b:3", "b:2", "b:4"]
+
+
+def test_fuse_keeps_a_single_ranking(fake_models):
+    ranking = [page("b", str(i)) for i in range(5)]
+
+    assert keys(HybridRetriever(None, fake_models).fuse(ranking)) == keys(ranking)
+
+
+def test_parse_query_splits_filters_and_drops_collections():
+    text, filters = HybridRetriever.parse_query('book:"my book" image:page_1 collection:letters plague in the abbey')
+
+    assert text == "plague in the abbey"
+    assert filters == {"book_id": "my book", "image_id": "page_1"}
+
+
+def test_collapse_chunks_groups_pages_in_rank_order():
+    chunks = [
+        page("b", "2", "second half", field="translation", chunk=1),
+        page("b", "1", "only", field="transcription", chunk=0),
+        page("b", "2", "first half", field="translation", chunk=0),
+        page("b", "3", "dropped", field="translation", chunk=0),
+    ]
+
+    pages = collapse_chunks(chunks, k=2)
+
+    assert keys(pages) == ["b:2", "b:1"]
+    assert pages[0].page_content == "Translation: first half second half"
+    assert pages[1].page_content == "Transcription: only"
+    assert pages[0].metadata == {"book_id": "b", "image_id": "2"}
+
+
+@pytest.fixture
+def two_collections(monkeypatch, fake_models):
+    """The default collection and a `letters` one, each in its own in-memory store."""
+    monkeypatch.setenv("COLLECTIONS", '{"letters": {"books": ["letters_*"]}}')
+    monkeypatch.delenv("QUERY_COLLECTIONS", raising=False)
+    get_collections.cache_clear()
+    stores = {}
+    for name, collection in get_collections().items():
+        stores[name] = fakes.MemoryVectorStore(fake_models, collection.index_name)
+        monkeypatch.setitem(get_redis_manager()._vectorstores, collection.index_name, stores[name])
+    yield stores
+    get_collections.cache_clear()
+
+
+def search_by_vector(fake_models):
+    return lambda collection, query, k: collection.vectorstore().similarity_search_by_vector(fake_models.embed_query(query), k)
+
+
+def test_scatter_merges_collections_by_stored_vector(two_collections, fake_models):
+    two_collections["default"].add_texts(["tax roll", "harvest"], [{"book_id": "rolls", "image_id": str(i)} for i in range(2)], ids=["rolls:0", "rolls:1"])
+    two_collections["letters"].add_texts(["plague letter", "market"], [{"book_id": "letters_1", "image_id": str(i)} for i in range(2)], ids=["letters_1:0", "letters_1:1"])
+
+    docs = ScatterRetriever(search_by_vector(fake_models), fake_models).search("plague letter", k=3)
+
+    assert len(docs) == 3
+    assert doc_key(docs[0]) == "letters_1:0"
+    assert docs[0].metadata["collection"] == "letters"
+    assert {doc.metadata["collection"] for doc in docs} == {"default", "letters"}
+
+
+def test_scatter_searches_the_named_collection_only(two_collections, fake_models):
+    two_collections["default"].add_texts(["tax roll"], [{"book_id": "rolls", "image_id": "0"}], ids=["rolls:0"])
+    two_collections["letters"].add_texts(["plague letter"], [{"book_id": "letters_1", "image_id": "0"}], ids=["letters_1:0"])
+
+    docs = ScatterRetriever(search_by_vector(fake_models), fake_models).search("collection:letters tax roll", k=5)
+
+    assert keys(docs) == ["letters_1:0"]
+
+
+def test_scatter_rejects_unknown_collections(two_collections, fake_models):
+    with pytest.raises(ValueError, match="Unknown collection"):
+        ScatterRetriever(search_by_vector(fake_models), fake_models).search("collection:missing tax", k=5)
+
+
+def test_packer_skips_near_duplicates(fake_models):
+    store = fakes.MemoryVectorStore(fake_models)
+    texts = ["king and queen", "king and queen", "river castle", "abbey bishop"]
+    ids = [f"b:{i}" for i in range(len(texts))]
+    store.add_texts(texts, [{"book_id": "b", "image_id": str(i)} for i in range(len(texts))], ids=ids)
+    candidates = [page("b", str(i), text) for i, text in enumerate(texts)]
+
+    selected = ContextPacker(store).select(fake_models.embed_query("king and queen"), candidates, k=3)
+
+    assert keys(selected)[0] == "b:0"
+    assert sorted(keys(selected)) == ["b:0", "b:2", "b:3"]
+
+
+def test_packer_keeps_the_retrieval_order_without_vectors(fake_models):
+    store = fakes.MemoryVectorStore(fake_models)
+    candidates = [page("b", str(i)) for i in range(4)]
+
+    assert keys(ContextPacker(store).select(fake_models.embed_query("query"), candidates, k=2)) == ["b:0", "b:1"]
+
+
+def test_excerpt_keeps_keywords_and_matching_sentences():
+    content = (
+        "Model: fake\n"
+        "Transcription: Le roi est mort. Il pleut.\n"
+        "Translation: The king died in winter. It rains on the market. The plague came to the abbey.\n"
+        "Keywords: king, plague"
+    )
+
+    excerpt = ContextPacker().excerpt("plague abbey", content, budget=100)
+
+    assert excerpt == "Keywords: king, plague\nTranslation: The plague came to the abbey."
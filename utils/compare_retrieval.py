@@ -0,0 +1,65 @@
+from config.redis_config import DEFAULT_INDEX_NAME, get_redis_manager
+from config.log_config import LoggingConfig
+from handlers.cache_handler import CachedEmbeddings
+from handlers.retrieval_handler import HybridRetriever, doc_key
+
+from rich.table import Table
+from statistics import mean, quantiles
+import argparse
+import json
+import time
+
+MODES = ["vector", "text", "hybrid"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare recall, MRR and latency of the retrieval modes.")
+    parser.add_argument("queries", help='JSONL file of {"query": ..., "expected": ["<book_id>:<image_id>", ...]}')
+    parser.add_argument("--index", default=DEFAULT_INDEX_NAME, help="Index name")
+    parser.add_argument("-k", type=int, default=5, help="Pages retrieved per query")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per query and mode")
+    args = parser.parse_args()
+
+    console = LoggingConfig().console
+    manager = get_redis_manager()
+    embeddings = CachedEmbeddings(manager.embeddings)
+    retriever = HybridRetriever(manager.get_vectorstore(args.index), embeddings)
+    with open(args.queries) as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+
+    # Warm the query embeddings, so timings compare the searches rather than the embedding calls
+    for case in cases:
+        embeddings.embed_query(HybridRetriever.parse_query(case["query"])[0] or case["query"])
+
+    table = Table(title=f"Retrieval comparison ({len(cases)} queries, k={args.k})")
+    for column in ("mode", "recall@k", "MRR", "mean ms", "p50 ms", "p95 ms"):
+        table.add_column(column)
+
+    for mode in MODES:
+        latencies, recalls, reciprocal_ranks = [], [], []
+        for case in cases:
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                docs = retriever.search(case["query"], k=args.k, mode=mode)
+                latencies.append((time.perf_counter() - started) * 1000)
+            expected = set(case.get("expected", []))
+            if expected:
+                recalls.append(len(expected & {doc_key(doc) for doc in docs}) / len(expected))
+                # 1 / rank of the first expected page, 0 if none was retrieved
+                reciprocal_ranks.append(next((1 / rank for rank, doc in enumerate(docs, start=1) if doc_key(doc) in expected), 0.0))
+
+        cuts = quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        table.add_row(
+            mode,
+            f"{mean(recalls):.3f}" if recalls else "-",
+            f"{mean(reciprocal_ranks):.3f}" if reciprocal_ranks else "-",
+            f"{mean(latencies):.1f}",
+            f"{cuts[49]:.1f}",
+            f"{cuts[94]:.1f}",
+        )
+
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
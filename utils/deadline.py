@@ -0,0 +1,108 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Tuple, TypeVar
+import numpy as np
+import threading
+import time
+
+T = TypeVar("T")
+
+# Calls that miss their deadline cannot be interrupted, so they finish here in the background
+MAX_CALLS = 32
+_calls = ThreadPoolExecutor(max_workers=MAX_CALLS, thread_name_prefix="deadline")
+# Held from submission until the call returns, abandoned or not, so timed-out calls
+# cannot pile up: new calls wait for a slot within their deadline and hedges are skipped
+_slots = threading.BoundedSemaphore(MAX_CALLS)
+
+
+def _submit(func: Callable[[], T], timeout: Optional[float] = None, block: bool = True) -> "Optional[Future[T]]":
+    """Run `func` in a free slot, waiting up to `timeout` seconds for one (not at all unless `block`); None if none freed up."""
+    if not (_slots.acquire(timeout=timeout) if block else _slots.acquire(blocking=False)):
+        return None
+    try:
+        # The caller's context travels with the call, so its metrics land in the caller's span
+        future = _calls.submit(copy_context().run, func)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+
+class LatencyTracker:
+    """Rolling window of the latencies of one kind of call, for hedging thresholds."""
+
+    def __init__(self, window: int = 200, min_samples: int = 10):
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, q: float, default: float) -> float:
+        """The q-th percentile of the window, or `default` until enough calls were seen."""
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return default
+            return float(np.percentile(self.samples, q))
+
+
+def call_with_deadline(func: Callable[[], T], timeout: Optional[float]) -> T:
+    """Call `func`, raising TimeoutError if it has not returned within `timeout` seconds (None waits forever).
+
+    The time spent waiting for one of the MAX_CALLS slots counts against the deadline.
+    """
+    if not timeout:
+        return func()
+    started = time.monotonic()
+    future = _submit(func, timeout)
+    if future is None:
+        raise TimeoutError(f"No free slot for the call within {timeout:g}s")
+    done, _ = wait([future], timeout=max(0.0, timeout - (time.monotonic() - started)))
+    if not done:
+        future.cancel()
+        raise TimeoutError(f"No answer within {timeout:g}s")
+    return future.result()
+
+
+def call_hedged(primary: Callable[[], T], secondary: Optional[Callable[[], T]], hedge_after: float,
+                timeout: Optional[float] = None) -> Tuple[T, bool]:
+    """Call `primary`; if it has not answered after `hedge_after` seconds, or failed, also call `secondary`.
+
+    Returns the first answer and whether it came from `secondary`. Raises TimeoutError when nothing
+    answered within `timeout` seconds, or the last error when both calls failed. `secondary` is not
+    called while all MAX_CALLS slots are busy, since a saturated pool is no time to add requests.
+    """
+    started = time.monotonic()
+    first = _submit(primary, timeout)
+    if first is None:
+        raise TimeoutError(f"No free slot for the call within {timeout:g}s")
+    pending: Dict[Future, bool] = {first: False}
+    hedge_at = hedge_after if secondary is not None else None
+    error: Optional[BaseException] = None
+    while pending or hedge_at is not None:
+        elapsed = time.monotonic() - started
+        if hedge_at is not None and (elapsed >= hedge_at or not pending):
+            hedge = _submit(secondary, block=False)
+            if hedge is not None:
+                pending[hedge] = True
+            hedge_at = None
+            continue
+        waits = [limit - elapsed for limit in (timeout, hedge_at) if limit]
+        if timeout and elapsed >= timeout:
+            break
+        done, _ = wait(pending, timeout=min(waits) if waits else None, return_when=FIRST_COMPLETED)
+        for future in done:
+            hedged = pending.pop(future)
+            try:
+                return future.result(), hedged
+            except Exception as e:
+                error = e
+    for future in pending:
+        future.cancel()
+    if pending or error is None:
+        raise TimeoutError(f"No answer within {timeout:g}s")
+    raise error
@@ -0,0 +1,374 @@
+from config.redis_config import CHUNK_METADATA_SCHEMA, DEFAULT_COLLECTION, IndexSettings, get_collection, route_collection
+from config.log_config import LoggingConfig
+from handlers.cache_handler import AnswerCache
+
+from redis.commands.search.query import Query
+from redis.exceptions import ResponseError
+from redisvl.index import SearchIndex
+from redisvl.query import VectorQuery
+from redisvl.query.filter import Tag
+from redisvl.schema import IndexSchema
+from rich.progress import Progress
+from rich.table import Table
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+import argparse
+import time
+import re
+
+
+def tag_pattern(field: str, pattern: str) -> str:
+    """Tag query matching `pattern`, where '*' is a wildcard and everything else is literal."""
+    escaped = re.sub(r"([^\w*])", r"\\\1", pattern)
+    return f"@{field}:{{{escaped}}}"
+
+
+class IndexMaintenance:
+    """Server-side bulk maintenance of the vector index, driven by tag queries.
+
+    Acts on the index of a collection, on that collection's server, or on another index of that server
+    (e.g. its chunk index) when `index_name` is given.
+    """
+
+    def __init__(self, index_name: Optional[str] = None, batch_size: int = 1000, collection: str = DEFAULT_COLLECTION):
+        self.console = LoggingConfig().console
+        collection = get_collection(collection)
+        index_name = index_name or collection.index_name
+        self.manager = collection.manager
+        self.client = self.manager.client
+        self.vectorstore = self.manager.get_vectorstore(index_name)
+        self.index_name = index_name
+        # Deletes from the collection's index also cover its chunks (INDEX_MODE=chunk)
+        self.chunk_index_name = collection.chunk_index_name if index_name == collection.index_name else None
+        self.batch_size = batch_size
+        self.search = self.client.ft(index_name)
+
+    def count(self, query: str, search: Optional[Any] = None) -> int:
+        return (search or self.search).search(Query(query).no_content().paging(0, 0).dialect(2)).total
+
+    def _key_batches(self, query: str, search: Optional[Any] = None) -> Iterator[List[str]]:
+        """Yield batches of matching keys; each batch is expected to be deleted before the next is read."""
+        while True:
+            result = (search or self.search).search(Query(query).no_content().paging(0, self.batch_size).dialect(2))
+            if not result.docs:
+                return
+            yield [doc.id for doc in result.docs]
+
+    def _chunk_search(self) -> Optional[Tuple[Any, str]]:
+        """The search client and key prefix of the chunk index, if the collection has one."""
+        if self.chunk_index_name is None:
+            return None
+        try:
+            self.client.ft(self.chunk_index_name).info()
+        except ResponseError:
+            return None
+        prefix = self.manager.get_vectorstore(self.chunk_index_name, CHUNK_METADATA_SCHEMA).config.key_prefix
+        return self.client.ft(self.chunk_index_name), f"{prefix}:"
+
+    def _unlink(self, query: str, search: Any, total: int, page_id: Callable[[str], str], label: str) -> int:
+        """UNLINK every document matching `query` in batches, invalidating the answers built on their pages."""
+        answer_cache = AnswerCache()
+        deleted = 0
+        with Progress(console=self.console) as progress:
+            task = progress.add_task(label, total=total)
+            for keys in self._key_batches(query, search):
+                with self.client.pipeline(transaction=False) as pipe:
+                    for key in keys:
+                        pipe.unlink(key)
+                    removed = sum(pipe.execute())
+                answer_cache.invalidate(list(dict.fromkeys(page_id(key) for key in keys)))
+                deleted += removed
+                progress.update(task, advance=len(keys))
+                if not removed:
+                    break
+        return deleted
+
+    def delete(self, query: str) -> int:
+        """Delete every document matching `query`, and the chunks of its pages, with pipelined UNLINKs."""
+        chunks = self._chunk_search()
+        total = self.count(query)
+        chunk_total = self.count(query, chunks[0]) if chunks else 0
+        if not total and not chunk_total:
+            self.console.print("No matching documents.", style="warning")
+            return 0
+
+        started = time.monotonic()
+        prefix = f"{self.vectorstore.config.key_prefix}:"
+        deleted = self._unlink(query, self.search, total, lambda key: key.removeprefix(prefix), "Deleting") if total else 0
+        chunks_deleted = 0
+        if chunk_total:
+            search, chunk_prefix = chunks
+            # Chunk ids are `<book>:<image>:<field>:<n>`
+            chunks_deleted = self._unlink(
+                query, search, chunk_total, lambda key: key.removeprefix(chunk_prefix).rsplit(":", 2)[0], "Deleting chunks"
+            )
+
+        self.console.print(
+            f"Deleted {deleted} documents{f' and {chunks_deleted} chunks' if chunks else ''} in {time.monotonic() - started:.2f}s.",
+            style="info"
+        )
+        return deleted
+
+    def delete_book(self, book_id: str) -> int:
+        return self.delete(str(Tag("book_id") == book_id))
+
+    def delete_pages(self, image_pattern: str, book_id: Optional[str] = None) -> int:
+        query = tag_pattern("image_id", image_pattern)
+        if book_id:
+            query = f"{Tag('book_id') == book_id} {query}"
+        return self.delete(query)
+
+    def drop_index(self, delete_documents: bool = False) -> None:
+        """Drop the index definition, and its documents too if asked."""
+        self.vectorstore.index.delete(drop=delete_documents)
+        self.manager.close()
+        self.console.print(f"Dropped index '{self.index_name}'{' and its documents' if delete_documents else ''}.", style="info")
+
+    def _wait_for_indexing(self, index: SearchIndex) -> Dict[str, Any]:
+        """Follow the background scan of an index until it is done, returning its final FT.INFO."""
+        with Progress(console=self.console) as progress:
+            task = progress.add_task("Indexing", total=100)
+            while True:
+                info = index.info()
+                progress.update(task, completed=float(info.get("percent_indexed", 1)) * 100)
+                if not int(info.get("indexing", 0)):
+                    return info
+                time.sleep(0.5)
+
+    def rebuild_index(self) -> None:
+        """Recreate the index over the existing documents and wait for the background scan to finish."""
+        index = self.vectorstore.index
+        index.create(overwrite=True, drop=False)
+        if index.name != self.index_name:
+            # Dropping the definition also dropped the alias pointing at it
+            self.client.ft(index.name).aliasadd(self.index_name)
+        started = time.monotonic()
+        info = self._wait_for_indexing(index)
+        self.console.print(
+            f"Rebuilt index '{self.index_name}' ({info.get('num_docs')} documents) in {time.monotonic() - started:.2f}s.",
+            style="info"
+        )
+
+    def _scan_keys(self, prefix: str) -> Iterator[List[bytes]]:
+        batch = []
+        for key in self.client.scan_iter(match=f"{prefix}*", count=self.batch_size, _type="HASH"):
+            batch.append(key)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _copy(self, keys: List[bytes], old_prefix: str, new_name: str, old_dtype: np.dtype, new_dtype: np.dtype) -> int:
+        """Copy a batch of documents under the prefix of `new_name`, converting their vectors if needed."""
+        with self.client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hgetall(key)
+            records = pipe.execute()
+
+        with self.client.pipeline(transaction=False) as pipe:
+            for key, record in zip(keys, records):
+                if not record:
+                    continue
+                record[b"_index_name"] = new_name.encode()
+                if old_dtype != new_dtype and b"embedding" in record:
+                    record[b"embedding"] = np.frombuffer(record[b"embedding"], dtype=old_dtype).astype(new_dtype).tobytes()
+                pipe.hset(f"{new_name}:{key.decode()[len(old_prefix):]}", mapping=record)
+            return len(pipe.execute())
+
+    def _missing(self, keys: List[bytes], old_prefix: str, new_name: str) -> List[bytes]:
+        """The documents of a batch that have no copy under the prefix of `new_name`."""
+        with self.client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.exists(f"{new_name}:{key.decode()[len(old_prefix):]}")
+            return [key for key, exists in zip(keys, pipe.execute()) if not exists]
+
+    def migrate(self, settings: IndexSettings, drop_old: bool = False) -> str:
+        """Rebuild the documents into a new index version built with `settings`, then move the index name to it.
+
+        The new version is named `<index>_v<n>` and the index name becomes an alias of it, so readers
+        switch over atomically. Running writers keep the key prefix of the old version until they are
+        restarted: their updates are not carried over, and with `drop_old` only the pages they added
+        are copied before the old documents are deleted.
+        """
+        old_index = self.vectorstore.index
+        old_name, old_prefix = old_index.name, f"{old_index.prefix.rstrip(':')}:"
+        version = re.fullmatch(rf"{re.escape(self.index_name)}_v(\d+)", old_name)
+        new_name = f"{self.index_name}_v{int(version.group(1)) + 1 if version else 2}"
+
+        schema = old_index.schema.to_dict()
+        schema["index"].update(name=new_name, prefix=f"{new_name}:")
+        for field in schema["fields"]:
+            if field["name"] == "embedding":
+                field["attrs"] = settings.vector_attrs(field["attrs"]["dims"])
+        new_index = SearchIndex(IndexSchema.from_dict(schema), redis_client=self.client)
+        new_index.create(overwrite=True, drop=True)
+
+        old_dtype = np.dtype(old_index.schema.fields["embedding"].attrs.datatype.value.lower())
+        new_dtype = np.dtype(settings.datatype.lower())
+        total = int(old_index.info().get("num_docs", 0))
+        started = time.monotonic()
+        copied = 0
+        with Progress(console=self.console) as progress:
+            task = progress.add_task(f"Copying to '{new_name}'", total=total)
+            for keys in self._scan_keys(old_prefix):
+                copied += self._copy(keys, old_prefix, new_name, old_dtype, new_dtype)
+                progress.update(task, completed=copied)
+        self._wait_for_indexing(new_index)
+        build_seconds = time.monotonic() - started
+
+        if old_name == self.index_name:
+            # The name still belongs to the original index, whose definition has to go before it becomes an alias;
+            # both in one transaction, so no query finds the name missing in between
+            with self.client.pipeline(transaction=True) as pipe:
+                pipe.execute_command("FT.DROPINDEX", old_name)
+                pipe.execute_command("FT.ALIASADD", self.index_name, new_name)
+                pipe.execute()
+        else:
+            self.client.ft(new_name).aliasupdate(self.index_name)
+
+        self.client.hset(f"index_meta:{new_name}", mapping={
+            **settings.describe(),
+            "documents": copied,
+            "build_seconds": f"{build_seconds:.2f}",
+            "source": old_name,
+        })
+
+        if drop_old:
+            if old_name != self.index_name:
+                self.client.ft(old_name).dropindex(delete_documents=False)
+            carried = 0
+            for keys in self._scan_keys(old_prefix):
+                # Pages added by writers still on the old prefix would otherwise be lost
+                missing = self._missing(keys, old_prefix, new_name)
+                if missing:
+                    carried += self._copy(missing, old_prefix, new_name, old_dtype, new_dtype)
+                self.client.unlink(*keys)
+            if carried:
+                self.console.print(f"Carried over {carried} pages added to '{old_name}' during the migration.", style="info")
+
+        self.manager.close()
+        self.console.print(
+            f"Migrated {copied} documents from '{old_name}' to '{new_name}' in {build_seconds:.2f}s; "
+            f"'{self.index_name}' now points to '{new_name}'.",
+            style="info"
+        )
+        self.console.print("⚠️ Restart running ingests and query agents, which still use the key prefix of the old version.", style="warning")
+        return new_name
+
+    def _load_vectors(self, prefix: str, dtype: np.dtype) -> Tuple[List[str], np.ndarray]:
+        keys, vectors = [], []
+        for batch in self._scan_keys(prefix):
+            with self.client.pipeline(transaction=False) as pipe:
+                for key in batch:
+                    pipe.hget(key, "embedding")
+                values = pipe.execute()
+            for key, value in zip(batch, values):
+                if value:
+                    keys.append(key.decode())
+                    vectors.append(np.frombuffer(value, dtype=dtype).astype(np.float32))
+        return keys, np.vstack(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+
+    def report(self, k: int = 10, samples: int = 100) -> None:
+        """Print the memory, build time and recall@k of the index.
+
+        Recall is measured against an exact (FLAT) search done in memory, using a sample of the
+        stored vectors as queries, so no embedding calls are needed.
+        """
+        index = self.vectorstore.index
+        vector = index.schema.fields["embedding"].attrs
+        info = index.info()
+        meta = {key.decode(): value.decode() for key, value in self.client.hgetall(f"index_meta:{index.name}").items()}
+
+        dtype = np.dtype(vector.datatype.value.lower())
+        keys, vectors = self._load_vectors(f"{index.prefix.rstrip(':')}:", dtype)
+        recalls, latencies = [], []
+        if len(keys):
+            metric = vector.distance_metric.value
+            corpus = vectors / np.linalg.norm(vectors, axis=1, keepdims=True) if metric == "COSINE" else vectors
+            picks = np.random.default_rng(0).choice(len(keys), size=min(samples, len(keys)), replace=False)
+            for i in picks:
+                if metric == "L2":
+                    scores = -np.sum((vectors - vectors[i]) ** 2, axis=1)
+                else:
+                    scores = corpus @ corpus[i]
+                exact = {keys[j] for j in np.argsort(-scores)[:k]}
+                query = VectorQuery(vectors[i].tolist(), "embedding", return_fields=["_index_name"], num_results=k, dtype=dtype.name)
+                started = time.perf_counter()
+                found = {result["id"] for result in index.query(query)}
+                latencies.append((time.perf_counter() - started) * 1000)
+                recalls.append(len(exact & found) / len(exact))
+
+        table = Table(title=f"Index '{self.index_name}' → '{index.name}'")
+        table.add_column("metric")
+        table.add_column("value")
+        rows = [
+            ("documents", info.get("num_docs")),
+            ("algorithm", vector.algorithm.value),
+            ("datatype", vector.datatype.value),
+            ("distance metric", vector.distance_metric.value),
+            ("vector index (MB)", info.get("vector_index_sz_mb", "-")),
+            ("inverted index (MB)", info.get("inverted_sz_mb", "-")),
+            ("build time (s)", meta.get("build_seconds", "-")),
+            (f"recall@{k} vs exact", f"{np.mean(recalls):.3f}" if recalls else "-"),
+            ("mean query (ms)", f"{np.mean(latencies):.1f}" if latencies else "-"),
+        ]
+        if vector.algorithm.value == "HNSW":
+            rows[2:2] = [("M", vector.m), ("EF_CONSTRUCTION", vector.ef_construction), ("EF_RUNTIME", vector.ef_runtime)]
+        for name, value in rows:
+            table.add_row(name, str(value))
+        self.console.print(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk maintenance of the Redis vector index.")
+    parser.add_argument("--collection", help="Collection whose index, on its own server, is maintained (default: the book's for delete-book, else the default one)")
+    parser.add_argument("--index", help="Another index of the collection's server, e.g. its chunk index (default: the collection's index)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Keys deleted per pipeline")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    delete_book = commands.add_parser("delete-book", help="Delete every page of a book")
+    delete_book.add_argument("book_id")
+
+    delete_pages = commands.add_parser("delete-pages", help="Delete pages whose image_id matches a pattern ('*' wildcard)")
+    delete_pages.add_argument("pattern")
+    delete_pages.add_argument("--book", help="Restrict to one book")
+
+    drop = commands.add_parser("drop-index", help="Drop the index")
+    drop.add_argument("--delete-documents", action="store_true", help="Also delete the indexed documents")
+
+    commands.add_parser("rebuild-index", help="Drop and recreate the index over the existing documents")
+
+    migrate = commands.add_parser("migrate-index", help="Copy the documents into a new index version and switch the index name to it")
+    migrate.add_argument("--algorithm", choices=["FLAT", "HNSW"], help="Vector index algorithm (default: INDEX_ALGORITHM)")
+    migrate.add_argument("--datatype", choices=["FLOAT32", "FLOAT16"], help="Stored vector type (default: INDEX_DATATYPE)")
+    migrate.add_argument("--metric", choices=["COSINE", "IP", "L2"], help="Distance metric (default: INDEX_DISTANCE_METRIC)")
+    migrate.add_argument("--m", type=int, help="HNSW M")
+    migrate.add_argument("--ef-construction", type=int, help="HNSW EF_CONSTRUCTION")
+    migrate.add_argument("--ef-runtime", type=int, help="HNSW EF_RUNTIME")
+    migrate.add_argument("--drop-old", action="store_true", help="Delete the previous version and its documents")
+
+    report = commands.add_parser("index-report", help="Show memory, build time and recall@k against exact search")
+    report.add_argument("-k", type=int, default=10, help="Neighbours compared per query")
+    report.add_argument("--samples", type=int, default=100, help="Stored vectors used as queries")
+
+    args = parser.parse_args()
+    collection = args.collection or (route_collection(args.book_id).name if args.command == "delete-book" else DEFAULT_COLLECTION)
+    maintenance = IndexMaintenance(args.index, args.batch_size, collection)
+    if args.command == "delete-book":
+        maintenance.delete_book(args.book_id)
+    elif args.command == "delete-pages":
+        maintenance.delete_pages(args.pattern, args.book)
+    elif args.command == "drop-index":
+        maintenance.drop_index(args.delete_documents)
+    elif args.command == "rebuild-index":
+        maintenance.rebuild_index()
+    elif args.command == "migrate-index":
+        settings = IndexSettings(args.algorithm, args.datatype, args.metric, args.m, args.ef_construction, args.ef_runtime)
+        maintenance.migrate(settings, args.drop_old)
+    elif args.command == "index-report":
+        maintenance.report(args.k, args.samples)
+
+
+if __name__ == "__main__":
+    main()
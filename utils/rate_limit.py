@@ -0,0 +1,125 @@
+from config.log_config import LoggingConfig
+from config.metrics import metrics
+from typing import Callable, Optional, TypeVar
+from dotenv import load_dotenv
+import threading
+import random
+import time
+import os
+
+load_dotenv()
+
+console = LoggingConfig().console
+T = TypeVar("T")
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+RETRYABLE_MARKERS = ("429", "RESOURCE_EXHAUSTED", "UNAVAILABLE", "INTERNAL", "DEADLINE_EXCEEDED", "Too Many Requests")
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `per_minute` tokens per minute."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float = 1.0) -> None:
+        """Block until `amount` tokens are available, then take them."""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def drain(self) -> None:
+        """Empty the bucket, so the next requests wait for the refill rate instead of using the initial burst."""
+        with self._lock:
+            self._refill()
+            self.tokens = 0.0
+
+    def adjust(self, amount: float) -> None:
+        """Charge (or refund, if negative) tokens after the fact; the balance may go below zero."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limiter shared by all workers of a process."""
+
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None, estimated_tokens: int = 2000):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.estimated_tokens = estimated_tokens
+
+    @classmethod
+    def from_env(cls, prefix: str = "VISION") -> "RateLimiter":
+        """Build a limiter from <PREFIX>_RPM, <PREFIX>_TPM and <PREFIX>_TOKENS_PER_REQUEST."""
+        rpm = os.getenv(f"{prefix}_RPM")
+        tpm = os.getenv(f"{prefix}_TPM")
+        return cls(
+            rpm=float(rpm) if rpm else None,
+            tpm=float(tpm) if tpm else None,
+            estimated_tokens=int(os.getenv(f"{prefix}_TOKENS_PER_REQUEST", "2000")),
+        )
+
+    def acquire(self, tokens: Optional[int] = None) -> None:
+        """Wait for one request slot and the estimated token budget of that request."""
+        if self.requests:
+            self.requests.acquire()
+        if self.tokens:
+            self.tokens.acquire(tokens or self.estimated_tokens)
+
+    def drain(self) -> None:
+        """Empty both buckets, e.g. to measure steady-state throughput."""
+        for bucket in (self.requests, self.tokens):
+            if bucket:
+                bucket.drain()
+
+    def record(self, used_tokens: int, estimated: Optional[int] = None) -> None:
+        """Correct the token bucket with the real usage reported by the provider."""
+        if self.tokens and used_tokens:
+            self.tokens.adjust(used_tokens - (estimated or self.estimated_tokens))
+
+
+def is_retryable(error: Exception) -> bool:
+    """Tell whether an error is a rate limit (429) or a transient server error (5xx)."""
+    for status in (
+        getattr(error, "status_code", None),
+        getattr(error, "code", None),
+        getattr(getattr(error, "response", None), "status_code", None),
+    ):
+        if isinstance(status, int):
+            return status in RETRYABLE_STATUS
+    return any(marker in str(error) for marker in RETRYABLE_MARKERS)
+
+
+def call_with_retry(func: Callable[[], T], max_retries: Optional[int] = None, base_delay: float = 2.0, max_delay: float = 60.0, label: str = "llm") -> T:
+    """Call `func`, retrying 429/5xx errors with full-jitter exponential backoff.
+
+    Retries are counted in `llm_retries_total` under `label`.
+    """
+    if max_retries is None:
+        max_retries = int(os.getenv("LLM_MAX_RETRIES", "5"))
+    for attempt in range(max_retries + 1):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            metrics.increment("llm_retries_total", kind=label)
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            console.print(f"Retrying in {delay:.1f}s after transient error ({attempt + 1}/{max_retries}): {e}", style="warning")
+            time.sleep(delay)
@@ -0,0 +1,216 @@
+from config.redis_config import DEFAULT_INDEX_NAME, Collection, get_collection, get_redis_manager, route_collection
+from config.log_config import LoggingConfig
+from handlers.output_handler import OutputHandler, answer_cache, index_mode
+from handlers.consensus_handler import ConsensusHandler
+from handlers.chunk_handler import PageChunker
+from schemas.models import Evaluation
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+from dataclasses import dataclass
+from langchain_redis import RedisVectorStore
+from redisvl.redis.utils import array_to_buffer
+from rich.progress import Progress
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+import argparse
+import json
+import time
+
+
+@dataclass
+class DumpedPage:
+    """A page read from its dump, with what is stored for it."""
+    dump: Path
+    mtime: str
+    text: str
+    metadata: Dict[str, Any]
+    doc_id: str
+    chunks: List[Tuple[str, Dict[str, Any], str]]
+    collection: Collection
+
+
+class Reindexer:
+    """Rebuilds the stored pages from the JSON dumps of their evaluations, without any vision call.
+
+    Dumps are streamed in batches, embedded on a few threads and written in order, one Redis
+    pipeline per batch. Every written dump is recorded with its modification time, so an interrupted
+    run resumes where it stopped, and a dump rewritten since (a page scanned again) is indexed again.
+    Pages go to the collection their book is routed to, unless `collection` names one for all of them.
+    """
+
+    def __init__(self, collection: Optional[str] = None, batch_size: int = 100, workers: int = 4):
+        self.console = LoggingConfig().console
+        self.manager = get_redis_manager()
+        # Progress is kept on the default server, whichever servers the pages go to
+        self.client = self.manager.client
+        self.collection = get_collection(collection) if collection else None
+        # With INDEX_MODE=chunk, the chunks of every page are rebuilt too
+        self.chunk = index_mode == "chunk"
+        self.chunkers: Dict[str, PageChunker] = {}
+        self.consensus = ConsensusHandler()
+        self.progress_key = f"reindex:{self.collection.index_name if self.collection else DEFAULT_INDEX_NAME}"
+        self.batch_size = batch_size
+        self.workers = max(1, workers)
+        self.skipped = 0
+        self.failed = 0
+
+    @staticmethod
+    def dumps(paths: Iterable[str]) -> Iterator[Path]:
+        """The page dumps (`<book>/json/<page>.json`) under the given books, folders or files."""
+        for path in map(Path, paths):
+            if path.is_file():
+                yield path
+                continue
+            for dump in sorted(path.rglob("json/*.json")):
+                if ".cache" not in dump.parts:
+                    yield dump
+
+    def chunker(self, collection: Collection) -> PageChunker:
+        if collection.name not in self.chunkers:
+            self.chunkers[collection.name] = PageChunker(collection)
+        return self.chunkers[collection.name]
+
+    def page(self, dump: Path, mtime: str) -> Optional[DumpedPage]:
+        """The document of a dumped page: the consensus of the latest evaluation of every model."""
+        evaluations = ConsensusHandler.latest([Evaluation(**e) for e in json.loads(dump.read_text())])
+        if not evaluations:
+            return None
+        doc = self.consensus.merge(evaluations)
+        book_id, image_id = dump.parent.parent.name, dump.stem
+        text, metadata, doc_id = OutputHandler.document(doc, book_id, image_id)
+        collection = self.collection or route_collection(book_id)
+        chunks = self.chunker(collection).chunks(doc, book_id, image_id) if self.chunk else []
+        return DumpedPage(dump, mtime, text, metadata, doc_id, chunks, collection)
+
+    def _batches(self, dumps: Iterable[Path]) -> Iterator[List[DumpedPage]]:
+        """Read the dumps not indexed yet, `batch_size` pages at a time."""
+        def read(candidates: List[Path]) -> Iterator[DumpedPage]:
+            if not candidates:
+                return
+            mtimes = [str(dump.stat().st_mtime_ns) for dump in candidates]
+            done = self.client.hmget(self.progress_key, [str(dump) for dump in candidates])
+            for dump, mtime, indexed in zip(candidates, mtimes, done):
+                if indexed is not None and indexed.decode() == mtime:
+                    self.skipped += 1
+                    continue
+                try:
+                    page = self.page(dump, mtime)
+                except Exception as e:
+                    self.failed += 1
+                    self.console.print(f"⚠️ Skipping unreadable dump {dump}: {e}", style="warning")
+                    continue
+                if page is not None:
+                    yield page
+
+        def pages() -> Iterator[DumpedPage]:
+            pending: List[Path] = []
+            for dump in dumps:
+                pending.append(dump)
+                if len(pending) == self.batch_size:
+                    yield from read(pending)
+                    pending = []
+            yield from read(pending)
+
+        batch: List[DumpedPage] = []
+        for page in pages():
+            batch.append(page)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _embed(self, batch: List[DumpedPage]) -> List[List[float]]:
+        """Embed the pages of a batch, and their chunks, in one call."""
+        texts = [page.text for page in batch] + [text for page in batch for text, _, _ in page.chunks]
+        return self.manager.embeddings.embed_documents(texts)
+
+    @staticmethod
+    def _record(vectorstore: RedisVectorStore, text: str, metadata: Dict[str, Any], vector: List[float]) -> Dict[str, Any]:
+        """A document hash laid out as RedisVectorStore.add_texts writes it."""
+        config = vectorstore.config
+        return {
+            config.content_field: text,
+            config.embedding_field: array_to_buffer(vector, dtype=config.vector_datatype),
+            "_index_name": config.index_name,
+            "_metadata_json": json.dumps(metadata),
+            **{field: value for field, value in metadata.items() if value is not None},
+        }
+
+    def _write(self, batch: List[DumpedPage], vectors: List[List[float]]) -> int:
+        """Write a batch, one round trip per collection, then record its dumps as indexed; returns the chunks written."""
+        chunk_vectors = iter(vectors[len(batch):])
+        groups: Dict[str, List[Tuple[DumpedPage, List[float], List[List[float]]]]] = {}
+        for page, vector in zip(batch, vectors):
+            groups.setdefault(page.collection.name, []).append((page, vector, [next(chunk_vectors) for _ in page.chunks]))
+
+        for group in groups.values():
+            collection = group[0][0].collection
+            page_store = collection.vectorstore()
+            chunk_store = self.chunker(collection).vectorstore if self.chunk else None
+            if self.chunk:
+                # Windows of a longer earlier version of a page would otherwise stay behind
+                for page, _, _ in group:
+                    self.chunker(collection).delete(page.metadata["book_id"], page.metadata["image_id"])
+            with collection.manager.client.pipeline(transaction=False) as pipe:
+                for page, vector, vectors_of_chunks in group:
+                    pipe.hset(f"{page_store.config.key_prefix}:{page.doc_id}", mapping=self._record(page_store, page.text, page.metadata, vector))
+                    for (text, metadata, chunk_id), chunk_vector in zip(page.chunks, vectors_of_chunks):
+                        pipe.hset(f"{chunk_store.config.key_prefix}:{chunk_id}", mapping=self._record(chunk_store, text, metadata, chunk_vector))
+                pipe.execute()
+
+        # Only once the pages are written everywhere, so a failed batch is indexed again on resume
+        self.client.hset(self.progress_key, mapping={str(page.dump): page.mtime for page in batch})
+        answer_cache.invalidate([page.doc_id for page in batch])
+        return sum(len(page.chunks) for page in batch)
+
+    def run(self, paths: Iterable[str], restart: bool = False) -> int:
+        """Re-index every dump under `paths`, keeping `workers` batches in flight; returns the pages written."""
+        if restart:
+            self.client.delete(self.progress_key)
+        self.skipped = self.failed = 0
+        written = chunks = 0
+        started = time.monotonic()
+        in_flight: Deque[Tuple[List[DumpedPage], Future]] = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool, Progress(console=self.console) as progress:
+            task = progress.add_task("Re-indexing", total=None)
+
+            def write_next() -> None:
+                nonlocal written, chunks
+                # Batches are written in the order they were read, so later dumps win
+                batch, future = in_flight.popleft()
+                chunks += self._write(batch, future.result())
+                written += len(batch)
+                progress.update(task, completed=written)
+
+            for batch in self._batches(self.dumps(paths)):
+                in_flight.append((batch, pool.submit(self._embed, batch)))
+                while len(in_flight) > self.workers:
+                    write_next()
+            while in_flight:
+                write_next()
+
+        seconds = time.monotonic() - started
+        self.console.print(
+            f"Re-indexed {written} pages{f' and {chunks} chunks' if self.chunk else ''} in {seconds:.1f}s "
+            f"({written / seconds if seconds else 0:.0f} docs/sec); {self.skipped} already indexed, {self.failed} unreadable",
+            style="info"
+        )
+        return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the stored pages from their JSON evaluation dumps, without scanning them again.")
+    parser.add_argument("paths", nargs="+", help="Book folders (with a json/ folder of dumps), folders of books, or dump files")
+    parser.add_argument("--collection", help="Collection to store every page in, instead of the one its book is routed to")
+    parser.add_argument("--batch-size", type=int, default=100, help="Pages embedded per call and written per pipeline")
+    parser.add_argument("--workers", type=int, default=4, help="Embedding calls in flight")
+    parser.add_argument("--restart", action="store_true", help="Forget the progress of earlier runs and index every dump")
+    args = parser.parse_args()
+
+    Reindexer(args.collection, args.batch_size, args.workers).run(args.paths, args.restart)
+
+
+if __name__ == "__main__":
+    main()